@@ -0,0 +1,111 @@
+import tkinter as tk
+
+# Задержка после последнего нажатия клавиши перед поиском подсказок (мс)
+DEBOUNCE_MS = 120
+MAX_SUGGESTIONS = 8
+
+
+class CityAutocomplete:
+    # Выпадающий список подсказок под полем ввода города. Подсказки берутся
+    # из локального индекса городов (city_index.py), сеть не используется;
+    # поиск запускается через DEBOUNCE_MS после последнего нажатия клавиши,
+    # поэтому быстрый набор не нагружает цикл событий Tk
+    def __init__(self, entry, index, on_select=None, limit=MAX_SUGGESTIONS, debounce=DEBOUNCE_MS):
+        self.entry = entry
+        self.index = index
+        self.on_select = on_select
+        self.limit = limit
+        self.debounce = debounce
+        self._job = None
+        self._last_query = None
+        self._suggestions = []
+        self._popup = None
+        self._listbox = None
+
+        entry.bind('<KeyRelease>', self._on_key, add="+")
+        entry.bind('<Down>', self._focus_list, add="+")
+        entry.bind('<Escape>', lambda event: self.hide(), add="+")
+        entry.bind('<FocusOut>', self._on_focus_out, add="+")
+
+    def _on_key(self, event):
+        if event.keysym in ("Down", "Up", "Return", "Escape", "Tab"):
+            return
+        if self._job is not None:
+            self.entry.after_cancel(self._job)
+        self._job = self.entry.after(self.debounce, self._update)
+
+    def _update(self):
+        self._job = None
+        query = self.entry.get().strip()
+        if query == self._last_query:
+            return
+        self._last_query = query
+        if len(query) < 2:
+            self.hide()
+            return
+        try:
+            self._suggestions = self.index.suggest(query, self.limit)
+        except Exception as e:
+            print(f"Ошибка поиска подсказок: {str(e)}")
+            self._suggestions = []
+        if self._suggestions:
+            self._show([text for _, text in self._suggestions])
+        else:
+            self.hide()
+
+    def _show(self, items):
+        if self._popup is None:
+            self._popup = tk.Toplevel(self.entry)
+            self._popup.overrideredirect(True)
+            self._popup.attributes('-topmost', True)
+            self._listbox = tk.Listbox(self._popup, activestyle="none", exportselection=False)
+            self._listbox.pack(fill=tk.BOTH, expand=True)
+            self._listbox.bind('<ButtonRelease-1>', self._choose)
+            self._listbox.bind('<Return>', self._choose)
+            self._listbox.bind('<Escape>', lambda event: self.hide())
+            self._listbox.bind('<FocusOut>', self._on_focus_out)
+
+        self._listbox.delete(0, tk.END)
+        for item in items:
+            self._listbox.insert(tk.END, item)
+        self._listbox.configure(height=len(items))
+
+        x = self.entry.winfo_rootx()
+        y = self.entry.winfo_rooty() + self.entry.winfo_height()
+        self._popup.geometry(f"{self.entry.winfo_width()}x{self._listbox.winfo_reqheight()}+{x}+{y}")
+        self._popup.deiconify()
+
+    def hide(self):
+        if self._popup is not None:
+            self._popup.withdraw()
+
+    def _focus_list(self, event=None):
+        if self._popup is not None and self._popup.winfo_viewable():
+            self._listbox.focus_set()
+            self._listbox.selection_clear(0, tk.END)
+            self._listbox.selection_set(0)
+            self._listbox.activate(0)
+            return "break"
+
+    def _on_focus_out(self, event=None):
+        # Фокус мог перейти из поля ввода в список - проверяем после обработки события
+        self.entry.after(100, self._hide_if_unfocused)
+
+    def _hide_if_unfocused(self):
+        focused = self.entry.focus_get()
+        if focused is None or (focused is not self._listbox and str(focused) != str(self.entry)
+                               and not str(focused).startswith(str(self.entry))):
+            self.hide()
+
+    def _choose(self, event=None):
+        selection = self._listbox.curselection()
+        if not selection:
+            return
+        text = self._listbox.get(selection[0]).rsplit(",", 1)[0]
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, text)
+        self._last_query = text
+        self.hide()
+        self.entry.focus_set()
+        if self.on_select is not None:
+            self.on_select()
@@ -0,0 +1,511 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stub_server
+
+# Замеры пути "запрос -> разбор -> отрисовка" на локальной заглушке:
+#   python benchmark.py                      # все сценарии
+#   python benchmark.py single multi --latency 0.05
+# Для каждого сценария выводятся p50/p95/p99 задержки и число запросов в секунду.
+
+DEFAULT_CITIES = [
+    "Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань",
+    "Нижний Новгород", "Челябинск", "Самара", "Омск", "Ростов-на-Дону",
+    "Уфа", "Красноярск", "Воронеж", "Пермь", "Волгоград",
+    "Краснодар", "Саратов", "Тюмень", "Тольятти", "Ижевск",
+    "Барнаул", "Ульяновск", "Иркутск", "Хабаровск", "Ярославль",
+    "Владивосток", "Махачкала", "Томск", "Оренбург", "Кемерово",
+    "London", "Paris", "Berlin", "Madrid", "Rome",
+    "Vienna", "Prague", "Warsaw", "Helsinki", "Oslo",
+    "Stockholm", "Riga", "Vilnius", "Tallinn", "Minsk",
+    "Kyiv", "Tbilisi", "Yerevan", "Baku", "Almaty",
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def render_labels(provider, data):
+    # Та же работа, что и при обновлении меток в окне, но без Tk
+    if provider == "weatherapi":
+        current = data["current"]
+        return (
+            f"Температура: {current['temp_c']:.1f}°C",
+            f"Влажность: {current['humidity']}%",
+            f"Описание: {current['condition']['text'].capitalize()}",
+        )
+    return (
+        f"Температура: {data['main']['temp']:.1f}°C",
+        f"Влажность: {data['main']['humidity']}%",
+        f"Описание: {data['weather'][0]['description'].capitalize()}",
+    )
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.wall_time = 0.0
+        self.extra = {}
+        self.lock = threading.Lock()
+
+    def add(self, latency, failed=False):
+        with self.lock:
+            self.latencies.append(latency)
+            if failed:
+                self.errors += 1
+
+    def report(self):
+        values = sorted(self.latencies)
+        count = len(values)
+        rps = count / self.wall_time if self.wall_time > 0 else 0.0
+        line = (
+            f"{self.name:<18} n={count:<6} "
+            f"p50={percentile(values, 0.50) * 1000:8.2f} мс  "
+            f"p95={percentile(values, 0.95) * 1000:8.2f} мс  "
+            f"p99={percentile(values, 0.99) * 1000:8.2f} мс  "
+            f"{rps:10.1f} запр/с  ошибок={self.errors}"
+        )
+        for key, value in self.extra.items():
+            line += f"  {key}={value}"
+        return line
+
+
+def timed_lookup(provider, city, fetch, result):
+    started = time.perf_counter()
+    failed = False
+    try:
+        render_labels(provider, fetch(city))
+    except Exception:
+        failed = True
+    result.add(time.perf_counter() - started, failed)
+
+
+def bench_single(args, provider, fetch):
+    # Последовательные одиночные запросы, как при нажатии "Поиск"
+    result = Result("single")
+    started = time.perf_counter()
+    for i in range(args.requests):
+        timed_lookup(provider, args.cities[i % len(args.cities)], fetch, result)
+    result.wall_time = time.perf_counter() - started
+    return result
+
+
+def bench_multi(args, provider, fetch):
+    # Обновление всего дашборда с ограничением числа параллельных запросов
+    result = Result("multi")
+    rounds = max(1, args.requests // len(args.cities))
+    refresh_times = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(rounds):
+            round_started = time.perf_counter()
+            list(executor.map(lambda city: timed_lookup(provider, city, fetch, result), args.cities))
+            refresh_times.append(time.perf_counter() - round_started)
+    result.wall_time = time.perf_counter() - started
+    refresh_times.sort()
+    result.extra["обновление_p50"] = f"{percentile(refresh_times, 0.5) * 1000:.1f}мс"
+    result.extra["городов"] = len(args.cities)
+    return result
+
+
+def bench_cache(args, provider, fetch):
+    # Путь попадания в кэш: сеть не участвует
+    import weather_cache
+
+    cache = weather_cache.WeatherCache(ttl=3600, path=None)
+    for city in args.cities:
+        try:
+            cache.put(provider, city, fetch(city))
+        except Exception:
+            pass
+
+    result = Result("cache-hit")
+    started = time.perf_counter()
+    for i in range(args.requests * 10):
+        city = args.cities[i % len(args.cities)]
+        timed_lookup(provider, city, lambda c: cache.get_or_fetch(provider, c, lambda: fetch(c)), result)
+    result.wall_time = time.perf_counter() - started
+    result.extra["попаданий"] = cache.hits
+    return result
+
+
+def bench_hedge(args, provider, fetch):
+    # Последовательные запросы через providers.HedgedClient: основной
+    # провайдер и запасной, который запрашивается после p95 основного.
+    # Хвост задержек заметен с --slow-rate (например, 0.05)
+    import providers
+
+    primary = providers.PROVIDERS[provider]("benchmark")
+    secondary_name = "weatherapi" if provider == "openweather" else "openweather"
+    secondary = providers.PROVIDERS[secondary_name]("benchmark")
+    results = []
+    for name, hedge in (("hedge-off", False), ("hedge", True)):
+        client = providers.HedgedClient([primary, secondary], hedge=hedge)
+        result = Result(name)
+        started = time.perf_counter()
+        for i in range(args.requests):
+            city = args.cities[i % len(args.cities)]
+            request_started = time.perf_counter()
+            try:
+                client.fetch(city)
+                result.add(time.perf_counter() - request_started)
+            except Exception:
+                result.add(time.perf_counter() - request_started, True)
+        result.wall_time = time.perf_counter() - started
+        stats = client.stats()
+        result.extra["запасной"] = stats["hedged"] + stats["failovers"]
+        result.extra["побед_запасного"] = stats["wins"][secondary_name]
+        client.close()
+        results.append(result)
+    print(results[0].report())
+    return results[1]
+
+
+def bench_bulk(args, provider, fetch):
+    # Обновление всего дашборда с пакетными запросами (OpenWeather - группой
+    # по ID из временного индекса городов) в сравнении с поштучными
+    import city_index
+    import weather_client
+
+    previous_index = weather_client.get_city_index()
+    previous_providers = os.environ.get("WEATHER_BULK_PROVIDERS")
+    result = Result("bulk")
+    rounds = max(1, args.requests // len(args.cities))
+    upstream = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "city.list.json")
+        with open(source, "w", encoding="utf-8") as f:
+            json.dump([{"id": 1000 + i, "name": city, "country": "", "coord": {"lat": 0, "lon": 0}}
+                       for i, city in enumerate(args.cities)], f, ensure_ascii=False)
+        index_path = os.path.join(tmp, "cities.idx")
+        city_index.build_index(source, index_path)
+        index = city_index.CityIndex(index_path)
+        weather_client.set_city_index(index)
+        try:
+            for mode, providers in (("поштучно", ""), ("пакетами", "openweather,weatherapi")):
+                os.environ["WEATHER_BULK_PROVIDERS"] = providers
+                mode_result = result if providers else Result("bulk-off")
+                before = args.server.requests
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    for _ in range(rounds):
+                        list(executor.map(lambda city: timed_lookup(provider, city, fetch, mode_result), args.cities))
+                mode_result.wall_time = time.perf_counter() - started
+                upstream[mode] = args.server.requests - before
+        finally:
+            weather_client.set_city_index(previous_index)
+            if previous_providers is None:
+                os.environ.pop("WEATHER_BULK_PROVIDERS", None)
+            else:
+                os.environ["WEATHER_BULK_PROVIDERS"] = previous_providers
+            index.close()
+
+    for mode, count in upstream.items():
+        result.extra[f"запросов_{mode}"] = count
+    result.extra["городов"] = len(args.cities)
+    return result
+
+
+def bench_forecast(args, provider, fetch):
+    # Прогноз для всех городов: первый раунд - запросы к заглушке, дальше - из
+    # кэша прогнозов; отдельно - время сводки по суткам для всех городов сразу
+    import forecast
+    import providers
+    import weather_cache
+
+    result = Result("forecast")
+    client = forecast.ForecastClient(
+        [providers.PROVIDERS[provider]("benchmark")],
+        cache=weather_cache.WeatherCache(ttl=forecast.DEFAULT_TTL, path=None),
+        max_workers=args.concurrency
+    )
+    rounds = max(2, args.requests // len(args.cities))
+    started = time.perf_counter()
+    try:
+        for _ in range(rounds):
+            round_started = time.perf_counter()
+            days = client.daily(args.cities)
+            failed = any(isinstance(value, Exception) for value in days.values())
+            result.add(time.perf_counter() - round_started, failed)
+        result.wall_time = time.perf_counter() - started
+        series = [client.series(city) for city in args.cities]
+    finally:
+        client.close()
+
+    timings = []
+    for _ in range(20):
+        aggregate_started = time.perf_counter()
+        forecast.aggregate_daily(series)
+        timings.append(time.perf_counter() - aggregate_started)
+    timings.sort()
+    result.extra["сводка_p50"] = f"{percentile(timings, 0.5) * 1000:.2f}мс"
+    result.extra["точек"] = sum(len(item["dt"]) for item in series)
+    return result
+
+
+def bench_nearby(args, provider, fetch):
+    # Запросы по координатам: --requests случайных точек в квадрате 10x10 км
+    # (пригороды, районы одного города) через кэш только с привязкой к
+    # сетке и с поиском соседнего наблюдения в радиусе WEATHER_NEARBY_KM
+    import random
+    import spatial_cache
+    import weather_cache
+
+    rng = random.Random(42)
+    center = spatial_cache.Point(55.7558, 37.6173)
+    span = 5 / spatial_cache.KM_PER_DEGREE
+    scale = math.cos(math.radians(center.lat))
+    points = [spatial_cache.format_point(spatial_cache.Point(
+        center.lat + rng.uniform(-span, span), center.lon + rng.uniform(-span, span) / scale))
+        for _ in range(args.requests)]
+
+    results = []
+    for name, radius in (("nearby-off", 0), ("nearby", spatial_cache.nearby_radius())):
+        cache = weather_cache.WeatherCache(ttl=3600, path=None, nearby_km=radius)
+        result = Result(name)
+        before = args.server.requests
+        started = time.perf_counter()
+        # Последовательно: каждая точка видит ответы, полученные для предыдущих
+        for point in points:
+            timed_lookup(provider, point, lambda p: cache.get_or_fetch(provider, p, lambda: fetch(p)), result)
+        result.wall_time = time.perf_counter() - started
+        result.extra["запросов"] = args.server.requests - before
+        result.extra["соседних"] = cache.nearby_hits
+        results.append(result)
+    print(results[0].report())
+    results[1].extra["радиус"] = f"{spatial_cache.nearby_radius():g}км"
+    return results[1]
+
+
+# Выполняется в отдельном процессе: импорт модуля виджета, создание окна
+# и первая отрисовка; затем - сколько стоят отложенные сетевые модули
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import weather_app
+if sys.argv[1] == "eager":
+    # Как до отложенной загрузки: сетевые модули и индекс городов - до окна
+    import weather_client
+    weather_client.get_city_index()
+result = {"import": time.perf_counter() - started}
+try:
+    app = weather_app.WeatherWidget()
+    app.update()
+    result["paint"] = time.perf_counter() - started
+    app.destroy()
+except Exception as e:
+    result["error"] = f"{type(e).__name__}: {e}"
+deferred = time.perf_counter()
+import weather_client
+result["deferred"] = time.perf_counter() - deferred
+print(json.dumps(result, ensure_ascii=False))
+"""
+
+
+def bench_startup(args, provider, fetch):
+    # Время до первой отрисовки виджета (или до конца импорта, если нет дисплея)
+    # с отложенной загрузкой weather_client и индекса городов и без нее (eager).
+    # Последнее наблюдение берется из state.json во временном каталоге настроек
+    import city_index
+    result = Result("startup")
+    runs = max(3, args.requests // 40)
+    imports, deferred, eager, errors = [], [], [], set()
+    with tempfile.TemporaryDirectory() as config_dir:
+        city = args.cities[0]
+        try:
+            observation = {"city": city, "data": fetch(city), "saved_at": time.time()}
+        except Exception:
+            observation = None
+        with open(os.path.join(config_dir, "state.json"), "w", encoding="utf-8") as f:
+            json.dump({"city": city, "last_observation": observation}, f, ensure_ascii=False)
+
+        env = dict(os.environ, WEATHER_CONFIG_DIR=config_dir, OPENWEATHER_API_KEY="benchmark",
+                   PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        # Индекс городов пользователя, если построен: его открытие входит в eager
+        index_path = city_index.default_index_path()
+        if os.path.exists(index_path):
+            env["WEATHER_CITY_INDEX"] = os.path.abspath(index_path)
+        started = time.perf_counter()
+        for mode in ("deferred", "eager") * runs:
+            run_started = time.perf_counter()
+            completed = None
+            try:
+                completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, mode], cwd=config_dir, env=env,
+                                           capture_output=True, text=True, encoding="utf-8", timeout=60)
+                data = json.loads(completed.stdout.strip().splitlines()[-1])
+            except Exception:
+                result.add(time.perf_counter() - run_started, True)
+                stderr = completed.stderr.strip() if completed is not None else ""
+                errors.add(stderr.splitlines()[-1] if stderr else "нет вывода")
+                continue
+            if "error" in data:
+                errors.add(data["error"])
+            if mode == "eager":
+                eager.append(data.get("paint", data["import"]))
+                continue
+            imports.append(data["import"])
+            deferred.append(data["deferred"])
+            result.add(data.get("paint", data["import"]))
+        result.wall_time = time.perf_counter() - started
+
+    imports.sort()
+    deferred.sort()
+    eager.sort()
+    result.extra["импорт_p50"] = f"{percentile(imports, 0.5) * 1000:.1f}мс"
+    result.extra["отложено_p50"] = f"{percentile(deferred, 0.5) * 1000:.1f}мс"
+    if eager:
+        result.extra["без_отложенной_загрузки_p50"] = f"{percentile(eager, 0.5) * 1000:.1f}мс"
+    for error in sorted(errors):
+        result.extra.setdefault("ошибка", error)
+    return result
+
+
+# Выполняется в отдельном процессе: импорт библиотечного интерфейса, какие
+# тяжелые модули он загрузил, и первый запрос (с загрузкой сетевых модулей)
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import weather_api
+result = {"import": time.perf_counter() - started}
+result["loaded"] = [name for name in ("tkinter", "customtkinter", "PIL", "numpy", "requests", "dotenv")
+                    if name in sys.modules]
+started = time.perf_counter()
+try:
+    weather_api.get_current(sys.argv[1])
+except Exception as e:
+    result["error"] = f"{type(e).__name__}: {e}"
+result["first"] = time.perf_counter() - started
+weather_api.close()
+print(json.dumps(result, ensure_ascii=False))
+"""
+
+
+def bench_import(args, provider, fetch):
+    # Время импорта weather_api в новом процессе (без GUI-библиотек и сетевых
+    # модулей) и время первого запроса, который их загружает
+    result = Result("import")
+    runs = max(3, args.requests // 40)
+    firsts, loaded, errors = [], set(), set()
+    env = dict(os.environ, OPENWEATHER_API_KEY="benchmark", WEATHERAPI_KEY="", WEATHER_PROVIDERS=provider,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    if provider == "weatherapi":
+        env.update(OPENWEATHER_API_KEY="", WEATHERAPI_KEY="benchmark")
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(runs):
+            run_started = time.perf_counter()
+            completed = None
+            try:
+                completed = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, args.cities[0]], cwd=tmp, env=env,
+                                           capture_output=True, text=True, encoding="utf-8", timeout=60)
+                data = json.loads(completed.stdout.strip().splitlines()[-1])
+            except Exception:
+                result.add(time.perf_counter() - run_started, True)
+                stderr = completed.stderr.strip() if completed is not None else ""
+                errors.add(stderr.splitlines()[-1] if stderr else "нет вывода")
+                continue
+            if "error" in data:
+                errors.add(data["error"])
+            result.add(data["import"], "error" in data)
+            firsts.append(data["first"])
+            loaded.update(data["loaded"])
+    result.wall_time = time.perf_counter() - started
+
+    firsts.sort()
+    result.extra["первый_запрос_p50"] = f"{percentile(firsts, 0.5) * 1000:.1f}мс"
+    result.extra["загружено_при_импорте"] = ",".join(sorted(loaded)) or "-"
+    for error in sorted(errors):
+        result.extra.setdefault("ошибка", error)
+    return result
+
+
+SCENARIOS = {
+    "single": bench_single,
+    "multi": bench_multi,
+    "cache": bench_cache,
+    "hedge": bench_hedge,
+    "bulk": bench_bulk,
+    "forecast": bench_forecast,
+    "nearby": bench_nearby,
+    "startup": bench_startup,
+    "import": bench_import,
+}
+
+
+def load_cities(path):
+    if not path:
+        return list(DEFAULT_CITIES)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры задержки и пропускной способности")
+    parser.add_argument("scenarios", nargs="*", help=f"сценарии: {', '.join(SCENARIOS)}")
+    parser.add_argument("--provider", choices=["openweather", "weatherapi"], default="openweather")
+    parser.add_argument("--requests", type=int, default=200, help="число запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--cities", dest="cities_file", help="файл со списком городов")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка заглушки, с")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов заглушки")
+    parser.add_argument("--slow-delay", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    args.cities = load_cities(args.cities_file)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    import weather_client
+
+    server = stub_server.StubServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay
+    ).start()
+    args.server = server
+    # Запросы к заглушке не расходуют лимиты настоящих ключей
+    os.environ["WEATHER_QUOTA_DISABLED"] = "1"
+    os.environ["OPENWEATHER_URL"] = server.openweather_url
+    os.environ["WEATHERAPI_URL"] = server.weatherapi_url
+    os.environ["OPENWEATHER_FORECAST_URL"] = server.openweather_forecast_url
+    os.environ["WEATHERAPI_FORECAST_URL"] = server.weatherapi_forecast_url
+    weather_client.POOL_MAXSIZE = max(weather_client.POOL_MAXSIZE, args.concurrency)
+
+    def fetch(city):
+        return weather_client.fetch_weather(args.provider, city, "benchmark")
+
+    print(f"Заглушка: {server.url}, задержка {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс, "
+          f"провайдер {args.provider}")
+    try:
+        for name in args.scenarios or list(SCENARIOS):
+            result = SCENARIOS[name](args, args.provider, fetch)
+            print(result.report())
+        print(f"Запросов к заглушке: {server.requests}")
+    finally:
+        server.stop()
+        weather_client.close_session()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+# Сколько городов провайдер принимает в одном пакетном запросе
+MAX_BATCH = {
+    "openweather": 20,
+    "weatherapi": 50,
+}
+# Сколько ждать остальные города, прежде чем отправить пакет (секунды)
+DEFAULT_WINDOW = 0.03
+
+
+class BulkBatcher:
+    # Собирает запросы, пришедшие в течение window секунд, и отправляет их
+    # одним пакетным запросом. send({ключ: элемент}) возвращает
+    # {ключ: данные или исключение}; ключ, которого нет в ответе,
+    # завершается KeyError
+    def __init__(self, send, max_batch, window=DEFAULT_WINDOW):
+        self.send = send
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.items = 0
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, key, item):
+        batch = None
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None:
+                # Тот же город уже ждет в текущем пакете
+                return entry[0]
+            future = Future()
+            self._pending[key] = (future, item)
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            # Полный пакет отправляем сразу, в потоке вызывающего
+            self._send(batch)
+        return future
+
+    def fetch(self, key, item):
+        return self.submit(key, item).result()
+
+    def stats(self):
+        with self._lock:
+            return {"batches": self.batches, "items": self.items, "pending": len(self._pending)}
+
+    def _take(self):
+        batch = self._pending
+        self._pending = {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if batch:
+            self.batches += 1
+            self.items += len(batch)
+            if metrics.enabled:
+                metrics.inc("weather_bulk_batches_total")
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            results = self.send({key: item for key, (_, item) in batch.items()})
+        except BaseException as e:
+            for future, _ in batch.values():
+                future.set_exception(e)
+            return
+        for key, (future, _) in batch.items():
+            result = results.get(key)
+            if result is None:
+                future.set_exception(KeyError(key))
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
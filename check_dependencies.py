@@ -1,22 +1,72 @@
 import sys
 import subprocess
 import os
+import socket
+import ssl
+import time
+import urllib.parse
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+# Проверка окружения: пакеты из requirements.txt (без их импорта - только
+# поиск модуля), ключи API обоих провайдеров и короткий замер задержки до
+# провайдера или локальной заглушки. Проверки выполняются параллельно.
+#   python check_dependencies.py [--no-install] [--no-probe]
+
+REQUIREMENTS_FILE = "requirements.txt"
+# Имя пакета pip -> имя модуля, если они различаются
+MODULE_NAMES = {
+    "python-dotenv": "dotenv",
+    "pillow": "PIL",
+}
+
+API_KEY_VARIABLES = {
+    "openweather": "OPENWEATHER_API_KEY",
+    "weatherapi": "WEATHERAPI_KEY",
+}
+# Те же адреса, что в weather_client.py (без импорта requests)
+PROVIDER_URLS = {
+    "openweather": ("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather"),
+    "weatherapi": ("WEATHERAPI_URL", "https://api.weatherapi.com/v1/current.json"),
+}
+PROBE_TIMEOUT = 5
+# Пороги, после которых этап считается медленным (секунды)
+SLOW_PHASES = {"dns": 0.2, "connect": 0.3, "tls": 0.5, "ttfb": 1.0}
 
 def check_python_version():
     print(f"Версия Python: {sys.version}")
-    if sys.version_info < (3, 6):
-        print("ОШИБКА: Требуется Python 3.6 или выше")
+    # numpy 1.26 из requirements.txt устанавливается только на Python 3.9+
+    if sys.version_info < (3, 9):
+        print("ОШИБКА: Требуется Python 3.9 или выше")
         return False
     return True
 
+def read_requirements(path=REQUIREMENTS_FILE):
+    # [(имя пакета, строка требования)]
+    requirements = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    name = line.split(";", 1)[0]
+                    for separator in ("==", ">=", "<=", "~=", ">", "<", "["):
+                        name = name.split(separator, 1)[0]
+                    requirements.append((name.strip(), line))
+    except FileNotFoundError:
+        requirements = [("requests", "requests")]
+    return requirements
+
 def check_package(package_name):
+    # find_spec ищет модуль, не выполняя его: тяжелые GUI-библиотеки не загружаются
+    module = MODULE_NAMES.get(package_name.lower(), package_name.replace("-", "_"))
     try:
-        __import__(package_name)
-        print(f"✓ {package_name} установлен")
-        return True
-    except ImportError:
-        print(f"✗ {package_name} не установлен")
-        return False
+        found = importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        found = False
+    if found:
+        return True, f"✓ {package_name} установлен"
+    return False, f"✗ {package_name} не установлен"
 
 def install_package(package_name):
     print(f"Установка {package_name}...")
@@ -28,56 +78,162 @@ def install_package(package_name):
         print(f"✗ Ошибка при установке {package_name}")
         return False
 
-def check_env_file():
-    if os.path.exists(".env"):
-        print("✓ Файл .env найден")
-        with open(".env", "r", encoding="utf-8") as f:
-            content = f.read()
-            if "WEATHERAPI_KEY=" in content:
-                api_key = content.split("WEATHERAPI_KEY=", 1)[1].strip()
-                if api_key and api_key != "your_api_key_here":
-                    print("✓ API ключ установлен")
-                    return True
-                else:
-                    print("✗ API ключ не установлен или установлен placeholder")
-                    return False
+def read_env_file(path=".env"):
+    # Разбор .env без python-dotenv: KEY=value, комментарии, кавычки
+    values = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export "):].strip()
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
             else:
-                print("✗ В файле .env отсутствует WEATHERAPI_KEY")
-                return False
+                value = value.split(" #", 1)[0].strip()
+            values[key] = value
+    return values
+
+def load_settings():
+    # Как load_dotenv: переменные окружения важнее значений из .env
+    settings = {}
+    if os.path.exists(".env"):
+        settings.update(read_env_file())
+    settings.update(os.environ)
+    return settings
+
+def check_env_file(settings):
+    lines = []
+    if os.path.exists(".env"):
+        lines.append("✓ Файл .env найден")
     else:
-        print("✗ Файл .env не найден")
-        return False
+        lines.append("✗ Файл .env не найден (ключи берутся только из переменных окружения)")
+    configured = []
+    for provider, variable in API_KEY_VARIABLES.items():
+        api_key = settings.get(variable, "")
+        if api_key and api_key != "your_api_key_here":
+            lines.append(f"✓ {variable} установлен")
+            configured.append(provider)
+        elif api_key:
+            lines.append(f"✗ {variable}: установлен placeholder")
+        else:
+            lines.append(f"- {variable} не задан")
+    if not configured:
+        lines.append("✗ Не задан ключ ни одного провайдера: нужен OPENWEATHER_API_KEY или WEATHERAPI_KEY")
+    return bool(configured), lines
+
+def probe_latency(provider, url):
+    # Один запрос без ключа API (лимит не расходуется, ответ 401/400 ожидаем):
+    # DNS, TCP-подключение, TLS-рукопожатие и время до первого байта ответа
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    phases = {}
+    started = time.perf_counter()
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        phases["dns"] = time.perf_counter() - started
+        family, kind, proto, _, address = addresses[0]
+
+        started = time.perf_counter()
+        sock = socket.socket(family, kind, proto)
+        try:
+            sock.settimeout(PROBE_TIMEOUT)
+            sock.connect(address)
+            phases["connect"] = time.perf_counter() - started
+            if secure:
+                started = time.perf_counter()
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+                phases["tls"] = time.perf_counter() - started
+
+            request = (f"GET {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                       f"User-Agent: weather-doctor\r\nConnection: close\r\n\r\n")
+            started = time.perf_counter()
+            sock.sendall(request.encode("ascii"))
+            first = sock.recv(64)
+            phases["ttfb"] = time.perf_counter() - started
+        finally:
+            sock.close()
+    except (OSError, IndexError) as e:
+        done = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in phases.items())
+        stage = ("dns", "connect", "tls" if secure else "ttfb", "ttfb")[len(phases)]
+        return False, [f"✗ {provider} ({host}): ошибка на этапе {stage}: {str(e)}" + (f" ({done})" if done else "")]
+
+    status = first.split(b" ", 2)[1].decode("ascii", "replace") if first.count(b" ") >= 1 else "?"
+    timings = "  ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in phases.items())
+    slow = [name for name, seconds in phases.items() if seconds > SLOW_PHASES[name]]
+    mark = "!" if slow else "✓"
+    lines = [f"{mark} {provider} ({host}): {timings}  (HTTP {status})"]
+    if slow:
+        lines.append(f"  медленно: {', '.join(slow)}")
+    return True, lines
+
+def probe_targets(settings):
+    # Провайдеры с ключом и все, чей адрес переопределен (например, на заглушку);
+    # если таких нет - OpenWeather, чтобы проверить хотя бы доступность сети
+    targets = []
+    for provider, (variable, default) in PROVIDER_URLS.items():
+        api_key = settings.get(API_KEY_VARIABLES[provider], "")
+        url = settings.get(variable) or default
+        if (api_key and api_key != "your_api_key_here") or settings.get(variable):
+            targets.append((provider, url))
+    if not targets:
+        targets.append(("openweather", PROVIDER_URLS["openweather"][1]))
+    return targets
 
 def main():
     print("=== Проверка зависимостей ===")
-    
+
     # Проверка версии Python
     if not check_python_version():
-        return
-    
-    # Проверка необходимых пакетов
-    required_packages = ["requests"]
-    missing_packages = []
-    
-    for package in required_packages:
-        if not check_package(package):
-            missing_packages.append(package)
-    
+        return 1
+
+    settings = load_settings()
+    requirements = read_requirements()
+    probe = "--no-probe" not in sys.argv
+
+    # Все проверки сразу: пакеты, ключи, замер задержки до провайдеров
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        package_checks = [(requirement, executor.submit(check_package, name)) for name, requirement in requirements]
+        env_check = executor.submit(check_env_file, settings)
+        probes = [executor.submit(probe_latency, provider, url) for provider, url in probe_targets(settings)] if probe else []
+
+        missing_packages = []
+        for requirement, future in package_checks:
+            ok, line = future.result()
+            print(line)
+            if not ok:
+                missing_packages.append(requirement)
+
+        print("\n=== Ключи API ===")
+        keys_ok, lines = env_check.result()
+        print("\n".join(lines))
+
+        if probes:
+            print("\n=== Задержка до провайдеров ===")
+            for future in probes:
+                print("\n".join(future.result()[1]))
+
     # Установка отсутствующих пакетов
-    if missing_packages:
+    if missing_packages and "--no-install" not in sys.argv:
         print("\nУстановка отсутствующих пакетов...")
         for package in missing_packages:
             install_package(package)
-    
-    # Проверка файла .env
-    print("\n=== Проверка файла .env ===")
-    check_env_file()
-    
+
     print("\n=== Инструкции ===")
-    print("1. Зарегистрируйтесь на сайте https://www.weatherapi.com/ для получения бесплатного API ключа")
-    print("2. Убедитесь, что в файле .env указан правильный API ключ от WeatherAPI.com")
-    print("3. Запустите приложение командой: python minimal_weather_app.py")
+    print("1. Получите бесплатный ключ API: https://openweathermap.org/api (OPENWEATHER_API_KEY)")
+    print("   или https://www.weatherapi.com/ (WEATHERAPI_KEY)")
+    print("2. Укажите ключ в файле .env; при двух ключах второй провайдер используется как запасной")
+    print("3. Запустите приложение командой: python weather_app.py")
+    return 0 if keys_ok and not missing_packages else 1
 
 if __name__ == "__main__":
-    main()
-    input("\nНажмите Enter для выхода...") 
\ No newline at end of file
+    status = main()
+    if sys.stdin.isatty():
+        input("\nНажмите Enter для выхода...")
+    sys.exit(status)
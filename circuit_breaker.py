@@ -0,0 +1,141 @@
+import threading
+import time
+
+import metrics
+import quota
+
+# Автомат отключения провайдера. После FAILURE_THRESHOLD сбоев подряд
+# (сетевые ошибки, 5xx, 429) запросы к провайдеру не отправляются
+# RESET_TIMEOUT секунд ("open"); затем пропускается один пробный запрос
+# ("half_open"): успех возвращает обычный режим ("closed"), сбой снова
+# отключает провайдера, с удвоенной паузой (не больше MAX_RESET_TIMEOUT)
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30
+MAX_RESET_TIMEOUT = 600
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Один автомат на провайдера в процессе: исход каждого HTTP-запроса
+# учитывается в weather_client один раз, сколько бы вызывающих его ни ждали
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpen(Exception):
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = retry_after
+        super().__init__(f"Провайдер {provider} недоступен, следующая проверка через {retry_after:.0f} с")
+
+
+def is_provider_failure(error):
+    # Сбой провайдера, а не ответ о неизвестном городе, неверном ключе или
+    # исчерпанном локальном лимите
+    if isinstance(error, (KeyError, quota.QuotaExceeded)):
+        return False
+    # Локальная ошибка файла (учет лимита, кэш) - провайдер тут ни при чем;
+    # у сетевых ошибок requests имени файла нет
+    if isinstance(error, OSError) and error.filename is not None:
+        return False
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status >= 500 or status == 429
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 max_reset_timeout=MAX_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.timeout = reset_timeout
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # Можно ли отправить запрос; в half_open - только один пробный
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.timeout:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.timeout - time.monotonic())
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self.timeout = self.reset_timeout
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                # Пробный запрос не прошел - пауза дольше
+                self.timeout = min(self.max_reset_timeout, self.timeout * 2)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def release(self):
+        # Пробный запрос не дошел до провайдера (локальный лимит, ошибка
+        # файла) - состояние прежнее, следующий вызов может проверить снова
+        with self._lock:
+            self._probing = False
+
+    def record(self, error):
+        # Итог запроса: None - успех. Ошибка, ничего не говорящая о самом
+        # провайдере, состояние не меняет (half_open остается half_open)
+        if error is None:
+            self.record_success()
+        elif is_provider_failure(error):
+            self.record_failure()
+        else:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "timeout": self.timeout}
+
+    def _open(self):
+        self._probing = False
+        self.opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        if metrics.enabled:
+            metrics.inc("weather_circuit_transitions_total", provider=self.name, state=state)
+
+
+def get(name):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
@@ -0,0 +1,487 @@
+import argparse
+import bisect
+import gzip
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from collections import namedtuple
+
+import state_store
+
+# Локальный индекс городов: название -> ID города и координаты.
+# Строится один раз из выгрузки городов:
+#   - city.list.json(.gz) OpenWeather (http://bulk.openweathermap.org/sample/)
+#   - cities*.txt GeoNames (https://download.geonames.org/export/dump/),
+#     содержит альтернативные названия, в том числе русские
+#   python city_index.py build cities15000.txt
+#   python city_index.py lookup "Нижний Новгород"
+# Файл индекса отображается в память (mmap): загрузка мгновенная, поиск -
+# двоичный по отсортированным ключам, без чтения всего файла.
+# По умолчанию индекс хранится в каталоге настроек (state_store.config_dir),
+# другой путь задается переменной WEATHER_CITY_INDEX.
+
+DEFAULT_INDEX_FILE = "cities.idx"
+# Подсказки: для каждого префикса, с которого начинается больше SUGGEST_SCAN
+# ключей, при построении индекса сохраняются SUGGEST_TOP крупнейших городов.
+# Поэтому подсказка - это срез готового списка или обход не больше
+# SUGGEST_SCAN ключей, сколько бы городов ни было в индексе
+SUGGEST_TOP = 16
+SUGGEST_SCAN = 256
+
+MAGIC = b"WCIX"
+VERSION = 2
+# Флаги заголовка
+FLAG_OWM_IDS = 1
+
+# magic, версия, флаги, число городов, число ключей, смещения секций
+HEADER_V1 = struct.Struct("<4sHHIIIIII")
+# Версия 2: то же и таблица префиксов - число префиксов и смещения секций
+HEADER = struct.Struct("<4sHHIIIIIIIIIII")
+# id, широта, долгота, население, страна, длина и смещение названия
+RECORD = struct.Struct("<IffI2sHI")
+UINT32 = struct.Struct("<I")
+# Смещение поля "население" внутри RECORD
+POPULATION_OFFSET = 12
+
+CityRecord = namedtuple("CityRecord", "id name country lat lon population owm_id")
+
+
+class CityNotFound(KeyError):
+    # Наследник KeyError: окна уже показывают на KeyError "Город не найден"
+    pass
+
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "і": "i", "ї": "yi", "є": "ye", "ґ": "g", "ў": "u",
+}
+
+
+def _is_cyrillic(ch):
+    return "Ѐ" <= ch <= "ӿ"
+
+
+def has_cyrillic(text):
+    return any(_is_cyrillic(ch) for ch in text)
+
+
+def normalize_name(name):
+    # Регистр, ё/е, диакритика латиницы ("München" -> "munchen"),
+    # дефисы и знаки препинания -> пробелы
+    result = []
+    for ch in name.casefold():
+        if _is_cyrillic(ch):
+            result.append("е" if ch == "ё" else ch)
+            continue
+        for part in unicodedata.normalize("NFKD", ch):
+            if unicodedata.combining(part):
+                continue
+            result.append(part if part.isalnum() else " ")
+    return " ".join("".join(result).split())
+
+
+def transliterate(name):
+    return "".join(TRANSLIT.get(ch, ch) for ch in normalize_name(name))
+
+
+def name_keys(name):
+    key = normalize_name(name)
+    if not key:
+        return set()
+    keys = {key}
+    if has_cyrillic(key):
+        keys.add(transliterate(key))
+    return keys
+
+
+def display_name(record, matched_key, query):
+    # Для кириллического запроса показываем найденное русское название,
+    # иначе - основное название города из выгрузки
+    if has_cyrillic(query) and has_cyrillic(matched_key):
+        name = " ".join(word.capitalize() for word in matched_key.split())
+    else:
+        name = record.name
+    return f"{name}, {record.country}" if record.country else name
+
+
+def _read_owm_list(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for item in json.load(f):
+            yield {
+                "id": item["id"],
+                "name": item["name"],
+                "country": item.get("country", ""),
+                "lat": item["coord"]["lat"],
+                "lon": item["coord"]["lon"],
+                "population": 0,
+                "aliases": [],
+            }
+
+
+def _read_geonames(path):
+    # Формат GeoNames: geonameid, name, asciiname, alternatenames, lat, lon,
+    # feature class, feature code, country code, ..., population (15-й столбец)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 15:
+                continue
+            # Из альтернативных названий берем кириллические, остальные
+            # языки только раздувают индекс
+            aliases = [fields[2]] + [
+                alias for alias in fields[3].split(",") if alias and has_cyrillic(alias)
+            ]
+            yield {
+                "id": int(fields[0]),
+                "name": fields[1],
+                "country": fields[8],
+                "lat": float(fields[4]),
+                "lon": float(fields[5]),
+                "population": int(fields[14] or 0),
+                "aliases": aliases,
+            }
+
+
+def _top_prefixes(keys):
+    # [(префикс, [(город, его первый ключ в диапазоне)])] для префиксов, с
+    # которых начинается больше SUGGEST_SCAN ключей; города - по убыванию
+    # населения. Длинные префиксы проверяются только внутри широких коротких
+    prefixes = []
+    ranges = [(0, len(keys))]
+    depth = 0
+    while ranges:
+        depth += 1
+        wide = []
+        for start, end in ranges:
+            i = start
+            while i < end:
+                key = keys[i][0]
+                if len(key) < depth:
+                    i += 1
+                    continue
+                prefix = key[:depth]
+                j = i + 1
+                while j < end and keys[j][0][:depth] == prefix:
+                    j += 1
+                if j - i > SUGGEST_SCAN:
+                    wide.append((i, j))
+                i = j
+        for start, end in wide:
+            candidates = {}
+            for i in range(start, end):
+                candidates.setdefault(keys[i][2], (keys[i][1], i))
+            best = heapq.nsmallest(SUGGEST_TOP, candidates.items(), key=lambda item: item[1])
+            prefixes.append((keys[start][0][:depth], [(index, i) for index, (_, i) in best]))
+        ranges = wide
+    prefixes.sort()
+    return prefixes
+
+
+def build_index(source_path, out_path):
+    if source_path.endswith((".json", ".json.gz")):
+        cities, flags = _read_owm_list(source_path), FLAG_OWM_IDS
+    else:
+        cities, flags = _read_geonames(source_path), 0
+
+    records = []
+    names = bytearray()
+    keys = []
+    for city in cities:
+        index = len(records)
+        name_bytes = city["name"].encode("utf-8")[:0xFFFF]
+        records.append((city, len(name_bytes), len(names)))
+        names += name_bytes
+        city_keys = set()
+        for name in [city["name"]] + city["aliases"]:
+            city_keys |= name_keys(name)
+        for key in city_keys:
+            keys.append((key, -city["population"], index))
+
+    # Одинаковые названия - по убыванию населения: первым идет крупнейший город.
+    # Строки сортируются так же, как их UTF-8 байты в файле
+    keys.sort()
+    prefixes = _top_prefixes(keys)
+
+    key_blob = bytearray()
+    key_offsets = bytearray()
+    key_records = bytearray()
+    for key, _, index in keys:
+        key_offsets += UINT32.pack(len(key_blob))
+        key_blob += key.encode("utf-8")
+        key_records += UINT32.pack(index)
+    key_offsets += UINT32.pack(len(key_blob))
+
+    # Таблица префиксов: смещения префиксов в их блоке, начало списка городов
+    # каждого префикса и сами списки - пары (город, ключ)
+    prefix_blob = bytearray()
+    prefix_offsets = bytearray()
+    prefix_starts = bytearray()
+    prefix_entries = bytearray()
+    for prefix, best in prefixes:
+        prefix_offsets += UINT32.pack(len(prefix_blob))
+        prefix_blob += prefix.encode("utf-8")
+        prefix_starts += UINT32.pack(len(prefix_entries) // 8)
+        for index, key_index in best:
+            prefix_entries += UINT32.pack(index) + UINT32.pack(key_index)
+    prefix_offsets += UINT32.pack(len(prefix_blob))
+    prefix_starts += UINT32.pack(len(prefix_entries) // 8)
+
+    records_offset = HEADER.size
+    key_offsets_offset = records_offset + RECORD.size * len(records)
+    key_records_offset = key_offsets_offset + len(key_offsets)
+    prefix_offsets_offset = key_records_offset + len(key_records)
+    prefix_starts_offset = prefix_offsets_offset + len(prefix_offsets)
+    prefix_entries_offset = prefix_starts_offset + len(prefix_starts)
+    blob_offset = prefix_entries_offset + len(prefix_entries)
+    names_offset = len(key_blob)
+    prefix_blob_offset = blob_offset + names_offset + len(names)
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, flags, len(records), len(keys),
+            records_offset, key_offsets_offset, key_records_offset, blob_offset,
+            len(prefixes), prefix_offsets_offset, prefix_starts_offset, prefix_entries_offset, prefix_blob_offset
+        ))
+        for city, name_len, name_off in records:
+            f.write(RECORD.pack(
+                city["id"], city["lat"], city["lon"], min(city["population"], 0xFFFFFFFF),
+                city["country"].encode("ascii", "replace")[:2].ljust(2), name_len, names_offset + name_off
+            ))
+        f.write(key_offsets)
+        f.write(key_records)
+        f.write(prefix_offsets)
+        f.write(prefix_starts)
+        f.write(prefix_entries)
+        f.write(key_blob)
+        f.write(names)
+        f.write(prefix_blob)
+    os.replace(tmp_path, out_path)
+    return len(records), len(keys)
+
+
+class _KeyView:
+    # Последовательность ключей (или префиксов) поверх mmap для bisect без
+    # копирования индекса
+    def __init__(self, length, key_at):
+        self.length = length
+        self.key_at = key_at
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.key_at(i)
+
+
+class CityIndex:
+    def __init__(self, path=None):
+        path = path or default_index_path()
+        self.path = path
+        # Все поля, которые освобождает close(), - до первой проверки
+        self._file = self._mm = self._offsets = self._key_records = None
+        self._prefix_offsets = self._prefix_starts = self._prefix_entries = None
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self._mm) < HEADER.size:
+                raise ValueError(f"Неверный формат индекса городов: {path}")
+            magic, version = struct.unpack_from("<4sH", self._mm, 0)
+            if magic != MAGIC or version not in (1, VERSION) or \
+                    len(self._mm) < (HEADER if version == VERSION else HEADER_V1).size:
+                raise ValueError(f"Неверный формат индекса городов: {path}")
+            if version == VERSION:
+                (_, _, flags, self.n_records, self.n_keys, self.records_offset,
+                 self.key_offsets_offset, self.key_records_offset, self.blob_offset,
+                 self.n_prefixes, self.prefix_offsets_offset, self.prefix_starts_offset,
+                 self.prefix_entries_offset, self.prefix_blob_offset) = HEADER.unpack_from(self._mm, 0)
+            else:
+                # Индекс прежней версии, без таблицы префиксов: подсказки
+                # обходят весь диапазон ключей (python city_index.py build - перестроить)
+                (_, _, flags, self.n_records, self.n_keys, self.records_offset,
+                 self.key_offsets_offset, self.key_records_offset, self.blob_offset) = HEADER_V1.unpack_from(self._mm, 0)
+                self.n_prefixes = 0
+                self.prefix_offsets_offset = self.prefix_starts_offset = self.prefix_entries_offset = \
+                    self.prefix_blob_offset = self.blob_offset
+        except Exception:
+            self.close()
+            raise
+        self.owm_ids = bool(flags & FLAG_OWM_IDS)
+        self._keys = _KeyView(self.n_keys, self.key_at)
+        self._prefixes = _KeyView(self.n_prefixes, self._prefix_at)
+        # Массивы смещений читаются напрямую из mmap без struct на каждый
+        # элемент (секции выровнены по 4 байта, формат little-endian)
+        if sys.byteorder == "little":
+            view = memoryview(self._mm)
+            key_records_end = self.prefix_offsets_offset if version == VERSION else self.blob_offset
+            self._offsets = view[self.key_offsets_offset:self.key_records_offset].cast("I")
+            self._key_records = view[self.key_records_offset:key_records_end].cast("I")
+            self._prefix_offsets = view[self.prefix_offsets_offset:self.prefix_starts_offset].cast("I")
+            self._prefix_starts = view[self.prefix_starts_offset:self.prefix_entries_offset].cast("I")
+            self._prefix_entries = view[self.prefix_entries_offset:self.blob_offset].cast("I")
+            view.release()
+
+    def close(self):
+        # Допускает частично созданный объект (ошибка в __init__) и повторный вызов
+        for view in (self._offsets, self._key_records,
+                     self._prefix_offsets, self._prefix_starts, self._prefix_entries):
+            if view is not None:
+                view.release()
+        self._offsets = self._key_records = None
+        self._prefix_offsets = self._prefix_starts = self._prefix_entries = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def key_at(self, i):
+        if self._offsets is not None:
+            start, end = self._offsets[i], self._offsets[i + 1]
+        else:
+            start, end = struct.unpack_from("<II", self._mm, self.key_offsets_offset + 4 * i)
+        return self._mm[self.blob_offset + start:self.blob_offset + end]
+
+    def _prefix_at(self, i):
+        if self._prefix_offsets is not None:
+            start, end = self._prefix_offsets[i], self._prefix_offsets[i + 1]
+        else:
+            start, end = struct.unpack_from("<II", self._mm, self.prefix_offsets_offset + 4 * i)
+        return self._mm[self.prefix_blob_offset + start:self.prefix_blob_offset + end]
+
+    def _prefix_top(self, i):
+        # [(город, ключ)] префикса i по убыванию населения
+        if self._prefix_starts is not None:
+            start, end = self._prefix_starts[i], self._prefix_starts[i + 1]
+            entries = self._prefix_entries[2 * start:2 * end]
+        else:
+            start, end = struct.unpack_from("<II", self._mm, self.prefix_starts_offset + 4 * i)
+            entries = struct.unpack_from(f"<{2 * (end - start)}I", self._mm, self.prefix_entries_offset + 8 * start)
+        return list(zip(entries[0::2], entries[1::2]))
+
+    def record(self, i):
+        city_id, lat, lon, population, country, name_len, name_off = RECORD.unpack_from(
+            self._mm, self.records_offset + RECORD.size * i
+        )
+        name_start = self.blob_offset + name_off
+        name = self._mm[name_start:name_start + name_len].decode("utf-8")
+        return CityRecord(city_id, name, country.decode("ascii").strip(), lat, lon, population, self.owm_ids)
+
+    def _record_for_key(self, i):
+        return self.record(self._record_index(i))
+
+    def _exact(self, key):
+        key_bytes = key.encode("utf-8")
+        i = bisect.bisect_left(self._keys, key_bytes)
+        result = []
+        while i < self.n_keys and self.key_at(i) == key_bytes:
+            result.append(self._record_for_key(i))
+            i += 1
+        return result
+
+    def lookup(self, name):
+        key = normalize_name(name)
+        if not key:
+            return []
+        found = self._exact(key)
+        if not found and has_cyrillic(key):
+            found = self._exact(transliterate(key))
+        return found
+
+    def resolve(self, name):
+        found = self.lookup(name)
+        return found[0] if found else None
+
+    def __contains__(self, name):
+        return self.resolve(name) is not None
+
+    def _record_index(self, i):
+        if self._key_records is not None:
+            return self._key_records[i]
+        return UINT32.unpack_from(self._mm, self.key_records_offset + 4 * i)[0]
+
+    def _population(self, index):
+        return UINT32.unpack_from(self._mm, self.records_offset + RECORD.size * index + POPULATION_OFFSET)[0]
+
+    def suggest(self, prefix, limit=10):
+        # Подсказки по началу названия - крупнейшие города, а не первые по
+        # алфавиту. Для широкого префикса список готов в таблице префиксов,
+        # иначе ключей с этим префиксом не больше SUGGEST_SCAN и они
+        # обходятся все (их границы находятся двоичным поиском)
+        key = normalize_name(prefix)
+        if not key:
+            return []
+        prefix_bytes = key.encode("utf-8")
+
+        i = bisect.bisect_left(self._prefixes, prefix_bytes)
+        if limit <= SUGGEST_TOP and i < self.n_prefixes and self._prefix_at(i) == prefix_bytes:
+            best = self._prefix_top(i)[:limit]
+        else:
+            start = bisect.bisect_left(self._keys, prefix_bytes)
+            # Байт 0xFF не встречается в UTF-8: все ключи с префиксом меньше этой границы
+            end = bisect.bisect_left(self._keys, prefix_bytes + b"\xff", start)
+            # город -> первый его ключ в диапазоне (для отображаемого названия)
+            candidates = {}
+            for i in range(start, end):
+                candidates.setdefault(self._record_index(i), i)
+            # Полные записи читаем только для лучших
+            best = [(index, candidates[index]) for index in heapq.nlargest(limit, candidates, key=self._population)]
+
+        result = []
+        for index, key_index in best:
+            record = self.record(index)
+            result.append((record, display_name(record, self.key_at(key_index).decode("utf-8"), key)))
+        return result
+
+
+def default_index_path():
+    return os.getenv("WEATHER_CITY_INDEX") or state_store.config_path(DEFAULT_INDEX_FILE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный индекс городов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="построить индекс из выгрузки городов")
+    build.add_argument("source", help="city.list.json(.gz) OpenWeather или cities*.txt GeoNames")
+    build.add_argument("output", nargs="?", default=None)
+    lookup = commands.add_parser("lookup", help="найти город в индексе")
+    lookup.add_argument("name")
+    lookup.add_argument("--index", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        args.output = args.output or default_index_path()
+        n_records, n_keys = build_index(args.source, args.output)
+        size = os.path.getsize(args.output)
+        print(f"Индекс {args.output}: городов {n_records}, ключей {n_keys}, {size / 1024 / 1024:.1f} МБ")
+        return 0
+
+    with CityIndex(args.index or default_index_path()) as index:
+        found = index.lookup(args.name)
+        if not found:
+            print("Город не найден")
+            return 1
+        for city in found:
+            print(f"{city.id}\t{city.name}\t{city.country}\t{city.lat:.4f},{city.lon:.4f}\t{city.population}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+
+import metrics
+
+# Как часто главный поток Tk забирает готовые результаты (мс)
+POLL_INTERVAL = 50
+DEFAULT_WORKERS = 4
+
+
+class FetchWorker:
+    # Сетевые запросы выполняются в фоновых потоках, а обратные вызовы -
+    # только в главном потоке Tk через root.after: виджеты Tk нельзя
+    # трогать из других потоков
+    def __init__(self, root, workers=DEFAULT_WORKERS, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._stopped = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"fetch-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._poll_id = self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, func, on_done, on_error=None):
+        # func вызывается в фоновом потоке, on_done/on_error - в потоке Tk
+        if self._stopped:
+            return
+        self._jobs.put((func, on_done, on_error))
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    def stop(self):
+        self._stopped = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        if self._poll_id is not None:
+            try:
+                self.root.after_cancel(self._poll_id)
+            except Exception:
+                pass
+            self._poll_id = None
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            func, on_done, on_error = job
+            try:
+                result = func()
+            except Exception as e:
+                self._results.put((on_error, e, True))
+            else:
+                self._results.put((on_done, result, False))
+
+    def _poll(self):
+        while True:
+            try:
+                callback, value, failed = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if callback is None:
+                if failed:
+                    print(f"Ошибка фонового запроса: {str(value)}")
+                continue
+            started = time.perf_counter() if metrics.enabled else None
+            try:
+                callback(value)
+            except Exception as e:
+                print(f"Ошибка обработки результата запроса: {str(e)}")
+            if started is not None:
+                # Время обновления окна по результату запроса
+                metrics.observe("weather_phase_seconds", time.perf_counter() - started, phase="render")
+        if not self._stopped:
+            self._poll_id = self.root.after(self.poll_interval, self._poll)
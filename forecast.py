@@ -0,0 +1,201 @@
+import calendar
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+import providers
+import quota
+import state_store
+import weather_cache
+
+# Прогноз на 5 дней, сведенный по суткам (в местном времени города):
+# минимум, максимум и средняя температура, сумма осадков (мм) и
+# преобладающие погодные условия. Ответы провайдеров сокращаются до
+# четырех столбцов и кэшируются отдельно от текущей погоды, со своим
+# временем жизни (WEATHER_FORECAST_TTL, секунды): OpenWeather обновляет
+# прогноз раз в 3 часа
+DEFAULT_TTL = 60 * 60
+DEFAULT_CACHE_FILE = "forecast_cache.json"
+DEFAULT_WORKERS = 8
+DAY = 24 * 60 * 60
+
+# samples - сколько точек прогноза попало в сутки (первые и последние
+# сутки обычно неполные)
+DailyForecast = namedtuple(
+    "DailyForecast",
+    "date temp_min temp_max temp_mean precipitation condition_code samples"
+)
+
+
+def weatherapi_utc_offset(location):
+    # Смещение местного времени: WeatherAPI.com присылает местное время
+    # строкой и то же время в unix time
+    try:
+        local = calendar.timegm(time.strptime(location["localtime"], "%Y-%m-%d %H:%M"))
+        offset = local - int(location["localtime_epoch"])
+    except (KeyError, TypeError, ValueError):
+        return 0
+    # Округление до 15 минут: строка местного времени без секунд
+    return int(round(offset / 900)) * 900
+
+
+def forecast_series(provider, data):
+    # Столбцы прогноза: время (unix time), температура, осадки, код условий
+    if provider == "weatherapi":
+        points = [hour for day in data["forecast"]["forecastday"] for hour in day["hour"]]
+        return {
+            "timezone": weatherapi_utc_offset(data.get("location", {})),
+            "dt": [point["time_epoch"] for point in points],
+            "temp": [point["temp_c"] for point in points],
+            "precip": [point.get("precip_mm") or 0.0 for point in points],
+            "code": [point["condition"]["code"] for point in points],
+        }
+    points = data["list"]
+    return {
+        "timezone": data.get("city", {}).get("timezone", 0),
+        "dt": [point["dt"] for point in points],
+        "temp": [point["main"]["temp"] for point in points],
+        "precip": [point.get("rain", {}).get("3h", 0.0) + point.get("snow", {}).get("3h", 0.0) for point in points],
+        "code": [point["weather"][0]["id"] for point in points],
+    }
+
+
+def aggregate_daily(series_list):
+    # Сводка по суткам сразу для всех городов: точки всех прогнозов
+    # складываются в общие массивы, сутки каждого города - группа,
+    # и все величины считаются групповыми операциями NumPy
+    counts = [len(series["dt"]) for series in series_list]
+    if not sum(counts):
+        return [[] for _ in series_list]
+    city = np.repeat(np.arange(len(series_list)), counts)
+    offsets = np.repeat(np.array([series["timezone"] for series in series_list], dtype=np.int64), counts)
+    dt = np.concatenate([np.asarray(series["dt"], dtype=np.int64) for series in series_list])
+    temp = np.concatenate([np.asarray(series["temp"], dtype=np.float64) for series in series_list])
+    precip = np.concatenate([np.asarray(series["precip"], dtype=np.float64) for series in series_list])
+    code = np.concatenate([np.asarray(series["code"], dtype=np.int64) for series in series_list])
+
+    # Группа = (город, местные сутки)
+    day = (dt + offsets) // DAY
+    first_day = day.min()
+    day_span = day.max() - first_day + 1
+    groups, group = np.unique(city * day_span + (day - first_day), return_inverse=True)
+    group = group.ravel()
+    samples = np.bincount(group)
+
+    temp_min = np.full(len(groups), np.inf)
+    np.minimum.at(temp_min, group, temp)
+    temp_max = np.full(len(groups), -np.inf)
+    np.maximum.at(temp_max, group, temp)
+    temp_mean = np.bincount(group, weights=temp) / samples
+    precipitation = np.bincount(group, weights=precip)
+
+    # Преобладающие условия: число точек для каждой пары (сутки, код),
+    # в каждых сутках берется самая частая пара (при равенстве - меньший код)
+    codes, code_index = np.unique(code, return_inverse=True)
+    pairs, pair_counts = np.unique(group * len(codes) + code_index.ravel(), return_counts=True)
+    pair_group = pairs // len(codes)
+    order = np.lexsort((-pair_counts, pair_group))
+    _, first = np.unique(pair_group[order], return_index=True)
+    dominant = codes[pairs[order[first]] % len(codes)]
+
+    group_city = groups // day_span
+    dates = (groups % day_span + first_day).astype("datetime64[D]").astype(str)
+    rows = list(zip(dates.tolist(), temp_min.tolist(), temp_max.tolist(), temp_mean.tolist(),
+                    precipitation.tolist(), dominant.tolist(), samples.tolist()))
+    bounds = np.searchsorted(group_city, np.arange(len(series_list) + 1)).tolist()
+    return [[DailyForecast(*row) for row in rows[lo:hi]] for lo, hi in zip(bounds, bounds[1:])]
+
+
+def default_cache():
+    return weather_cache.WeatherCache(
+        ttl=int(os.getenv("WEATHER_FORECAST_TTL", DEFAULT_TTL)),
+        path=os.getenv("WEATHER_FORECAST_CACHE") or state_store.config_path(DEFAULT_CACHE_FILE)
+    )
+
+
+class ForecastClient:
+    # Прогнозы для списка городов: запросы параллельно (с кэшем и переходом
+    # на следующего провайдера при ошибке), сводка по суткам - одним проходом
+    def __init__(self, providers, cache=None, max_workers=DEFAULT_WORKERS):
+        if not providers:
+            raise ValueError("Не задан ни один провайдер погоды")
+        self.providers = list(providers)
+        self.cache = cache if cache is not None else default_cache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="forecast")
+
+    def series(self, city):
+        import weather_client
+        error = None
+        for provider in self.providers:
+            try:
+                return self.cache.get_or_fetch(provider.name, city, lambda: forecast_series(
+                    provider.name, weather_client.fetch_forecast(provider.name, city, provider.api_key)
+                ))
+            except Exception as e:
+                # Ошибка основного провайдера важнее ошибок запасных
+                error = error or e
+        if isinstance(error, quota.QuotaExceeded):
+            # Лимит исчерпан: прежний прогноз лучше, чем никакого
+            for provider in self.providers:
+                stale = self.cache.get_stale(provider.name, city)
+                if stale is not None:
+                    return stale
+        raise error
+
+    def daily(self, cities):
+        # {город: [DailyForecast, ...] или исключение}
+        futures = [(city, self._executor.submit(self.series, city)) for city in cities]
+        result = {}
+        loaded = []
+        for city, future in futures:
+            try:
+                loaded.append((city, future.result()))
+            except Exception as e:
+                result[city] = e
+        for (city, _), days in zip(loaded, aggregate_daily([series for _, series in loaded])):
+            result[city] = days
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def main():
+    # python forecast.py Москва [Казань ...] - прогноз по суткам
+    from dotenv import load_dotenv
+    load_dotenv()
+    metrics.configure()
+    cities = sys.argv[1:]
+    if not cities:
+        print("Использование: python forecast.py город [город ...]")
+        return 2
+    configured = providers.configured_providers()
+    if not configured:
+        print("Не задан ключ API ни одного провайдера")
+        return 1
+    client = ForecastClient(configured)
+    try:
+        result = client.daily(cities)
+    finally:
+        client.close()
+    status = 0
+    for city in cities:
+        days = result[city]
+        print(city)
+        if isinstance(days, Exception):
+            print(f"  Ошибка: {str(days)}")
+            status = 1
+            continue
+        for day in days:
+            print(f"  {day.date}  {day.temp_min:6.1f}..{day.temp_max:5.1f}°C  "
+                  f"среднее {day.temp_mean:5.1f}°C  осадки {day.precipitation:5.1f} мм  код {day.condition_code}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
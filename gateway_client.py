@@ -0,0 +1,162 @@
+import json
+import os
+import queue
+import socket
+import threading
+
+import city_index
+import providers
+import quota
+from weather_cache import normalize_location
+
+# Подключение окна к локальному шлюзу погоды (weather_gateway.py). Шлюз
+# сам запрашивает провайдера и присылает каждое новое наблюдение всем
+# подписанным окнам. Адрес: WEATHER_GATEWAY_SOCKET (Unix-сокет) или
+# 127.0.0.1:WEATHER_GATEWAY_PORT; WEATHER_GATEWAY=0 - не подключаться
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+CONNECT_TIMEOUT = 0.3
+# Как часто поток Tk забирает пришедшие сообщения (мс)
+POLL_INTERVAL = 50
+
+
+class GatewayError(Exception):
+    # Ошибка получения погоды на стороне шлюза (текст уже без ключей API)
+    pass
+
+
+def gateway_address():
+    path = os.getenv("WEATHER_GATEWAY_SOCKET")
+    if path:
+        return path
+    return (os.getenv("WEATHER_GATEWAY_HOST", DEFAULT_HOST), int(os.getenv("WEATHER_GATEWAY_PORT", DEFAULT_PORT)))
+
+
+def encode(message):
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def connect(root, on_observation, on_error, on_disconnect=None):
+    # Клиент шлюза или None, если шлюз не запущен
+    if os.getenv("WEATHER_GATEWAY", "1") == "0":
+        return None
+    try:
+        return GatewayClient(root, on_observation, on_error, on_disconnect)
+    except OSError:
+        return None
+
+
+class GatewayClient:
+    # on_observation(город, Observation), on_error(город, исключение) и
+    # on_disconnect() вызываются в потоке Tk
+    def __init__(self, root, on_observation, on_error, on_disconnect=None):
+        self.root = root
+        self.on_observation = on_observation
+        self.on_error = on_error
+        self.on_disconnect = on_disconnect
+        address = gateway_address()
+        if isinstance(address, str):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(CONNECT_TIMEOUT)
+            try:
+                self._sock.connect(address)
+            except OSError:
+                self._sock.close()
+                raise
+        else:
+            self._sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+        self._sock.settimeout(None)
+        self.connected = True
+        # нормализованное название -> название, как его ввел пользователь
+        self._cities = {}
+        self._events = queue.Queue()
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._read, name="gateway-client", daemon=True).start()
+        self._poll_id = self.root.after(POLL_INTERVAL, self._poll)
+
+    def watch(self, cities):
+        # Подписка ровно на эти города. Повторная подписка не создает
+        # запросов к провайдеру: шлюз сразу присылает последнее наблюдение
+        wanted = {normalize_location(city): city for city in cities}
+        for key, city in list(self._cities.items()):
+            if key not in wanted:
+                self._send({"op": "unsubscribe", "city": city})
+        self._cities = wanted
+        for city in wanted.values():
+            self._send({"op": "subscribe", "city": city})
+
+    def close(self):
+        self.connected = False
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        if self._poll_id is not None:
+            try:
+                self.root.after_cancel(self._poll_id)
+            except Exception:
+                pass
+            self._poll_id = None
+
+    def _send(self, message):
+        if not self.connected:
+            return
+        try:
+            with self._send_lock:
+                self._sock.sendall(encode(message))
+        except OSError:
+            # Разрыв обработает поток чтения
+            pass
+
+    def _read(self):
+        try:
+            with self._sock.makefile("rb") as stream:
+                for line in stream:
+                    try:
+                        self._events.put(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        self._events.put(None)
+
+    def _poll(self):
+        self._poll_id = None
+        while True:
+            try:
+                message = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                self._lost()
+                return
+            try:
+                self._dispatch(message)
+            except Exception as e:
+                print(f"Ошибка обработки сообщения шлюза: {str(e)}")
+        if self.connected:
+            self._poll_id = self.root.after(POLL_INTERVAL, self._poll)
+
+    def _dispatch(self, message):
+        city = self._cities.get(normalize_location(message.get("city", "")))
+        if city is None:
+            # Ответ по городу, от которого окно уже отписалось
+            return
+        if message.get("type") == "observation":
+            observation = providers.parse(message["provider"], message["data"])
+            self.on_observation(city, observation._replace(stale=bool(message.get("stale"))))
+        elif message.get("type") == "error":
+            kind = message.get("kind")
+            if kind == "not_found":
+                error = city_index.CityNotFound(message.get("error", city))
+            elif kind == "quota":
+                error = quota.QuotaExceeded(message.get("retry_after", 0))
+            else:
+                error = GatewayError(message.get("error", ""))
+            self.on_error(city, error)
+
+    def _lost(self):
+        was_connected = self.connected
+        self.close()
+        if was_connected and self.on_disconnect is not None:
+            self.on_disconnect()
@@ -0,0 +1,278 @@
+import atexit
+import bisect
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote, unquote
+
+import refresh_scheduler
+import state_store
+import weather_cache
+
+# История наблюдений: по каталогу на город, в нем по файлу на уровень
+# детализации. Запись фиксированной длины - время (unix time), температура,
+# влажность, код погодных условий провайдера; файлы только дописываются.
+RECORD = struct.Struct("<IfHH")
+RECORD_SIZE = RECORD.size
+
+# (имя, шаг в секундах, сколько хранить в секундах). Завершенные часы
+# сворачиваются в "hourly", завершенные сутки - в "daily"; старые записи
+# подробных уровней удаляются, когда уже есть в более грубом
+TIERS = (
+    ("raw", 0, 14 * 24 * 60 * 60),
+    ("hourly", 60 * 60, 180 * 24 * 60 * 60),
+    ("daily", 24 * 60 * 60, None),
+)
+# Файл переписывается не на каждой записи, а когда накопится сутки лишнего
+COMPACT_SLACK = 24 * 60 * 60
+
+HISTORY_DIR = "history"
+LOCK_FILE = "lock"
+# Пауза перед записью: наблюдения всех городов дашборда за одно обновление
+# дописываются одним проходом (секунды)
+WRITE_DELAY = 1.0
+
+
+def observation_record(provider, data):
+    # (время, температура, влажность, код условий) из ответа провайдера или None
+    try:
+        if provider == "weatherapi":
+            current = data["current"]
+            values = (current["temp_c"], current["humidity"], current["condition"]["code"])
+        else:
+            values = (data["main"]["temp"], data["main"]["humidity"], data["weather"][0]["id"])
+    except (KeyError, IndexError, TypeError):
+        return None
+    observed_at = refresh_scheduler.observation_time(provider, data)
+    if not observed_at:
+        return None
+    return (int(observed_at),) + values
+
+
+class Columns:
+    # Столбцы поверх байтов файла без распаковки каждой записи:
+    # memoryview с шагом в одну запись (12 байт)
+    def __init__(self, data):
+        data = data[:len(data) - len(data) % RECORD_SIZE]
+        view = memoryview(data)
+        self.timestamps = view.cast("I")[0::3]
+        self.temps = view.cast("f")[1::3]
+        self.humidity = view.cast("H")[4::6]
+        self.codes = view.cast("H")[5::6]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def range(self, start, end):
+        return (bisect.bisect_left(self.timestamps, start), bisect.bisect_left(self.timestamps, end))
+
+    def records(self, lo, hi):
+        return [(self.timestamps[i], self.temps[i], self.humidity[i], self.codes[i]) for i in range(lo, hi)]
+
+
+class HistoryStore:
+    # Как в StateStore: append() только ставит запись в очередь, файлы
+    # дописывает фоновый поток - пачкой по каждому городу под одной
+    # блокировкой, со сворачиванием уровней один раз на пачку
+    def __init__(self, path=None, delay=WRITE_DELAY):
+        self.path = path or os.getenv("WEATHER_HISTORY_DIR") or state_store.config_path(HISTORY_DIR)
+        os.makedirs(self.path, exist_ok=True)
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Event()
+        # каталог города -> записи, еще не записанные на диск (по возрастанию времени)
+        self._pending = {}
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def city_dir(self, city):
+        return os.path.join(self.path, quote(weather_cache.normalize_city(city), safe=""))
+
+    def cities(self):
+        return sorted(unquote(name) for name in os.listdir(self.path)
+                      if os.path.isdir(os.path.join(self.path, name)))
+
+    def append(self, city, timestamp, temp, humidity, code):
+        # Повтор того же наблюдения (ответ из кэша, частое обновление) не пишется
+        record = (int(timestamp), temp, max(0, min(65535, int(humidity))), int(code) & 0xFFFF)
+        with self._lock:
+            pending = self._pending.setdefault(self.city_dir(city), [])
+            if pending and record[0] <= pending[-1][0]:
+                return False
+            pending.append(record)
+        self._changed.set()
+        return True
+
+    def append_observation(self, city, provider, data):
+        record = observation_record(provider, data)
+        if record is None:
+            return False
+        return self.append(city, *record)
+
+    def flush(self):
+        # Синхронная запись всех отложенных наблюдений (при выходе)
+        with self._write_lock:
+            with self._lock:
+                batches, self._pending = self._pending, {}
+            for directory, records in batches.items():
+                try:
+                    self._write(directory, records)
+                except Exception as e:
+                    print(f"Ошибка записи истории: {str(e)}")
+                    with self._lock:
+                        # Повторим при следующей записи, перед более новыми наблюдениями
+                        self._pending[directory] = records + self._pending.get(directory, [])
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            # Короткая пауза собирает наблюдения нескольких городов в одну запись
+            time.sleep(self.delay)
+            self._changed.clear()
+            self.flush()
+
+    def _write(self, directory, records):
+        os.makedirs(directory, exist_ok=True)
+        with state_store.file_lock(os.path.join(directory, LOCK_FILE)):
+            raw_path = os.path.join(directory, "raw.bin")
+            # Наблюдения, уже записанные другим окном, пропускаются
+            last = self._last_timestamp(raw_path)
+            records = [record for record in records if last is None or record[0] > last]
+            if not records:
+                return
+            with open(raw_path, "ab") as f:
+                f.write(b"".join(RECORD.pack(*record) for record in records))
+            self._rollup(directory, records[-1][0])
+            self._compact(directory, records[-1][0])
+
+    def query(self, city, start, end=None, tier=None):
+        # Записи в [start, end). Без tier старый участок берется из грубых
+        # уровней, свежий - из подробных
+        end = end if end is not None else time.time() + 1
+        directory = self.city_dir(city)
+        if tier is not None:
+            columns = self._columns(os.path.join(directory, f"{tier}.bin"))
+            records = columns.records(*columns.range(start, end))
+            if tier == "raw":
+                records += self._pending_records(directory, start, end, records)
+            return records
+
+        result = []
+        until = end
+        for name, _, _ in TIERS:
+            if end <= start:
+                break
+            columns = self._columns(os.path.join(directory, f"{name}.bin"))
+            if not len(columns):
+                continue
+            lo, hi = columns.range(start, end)
+            result[:0] = columns.records(lo, hi)
+            end = min(end, columns.timestamps[0])
+        return result + self._pending_records(directory, start, until, result)
+
+    def temperatures(self, city, seconds, now=None):
+        # Температуры за последние seconds секунд - для спарклайна
+        now = now or time.time()
+        return [record[1] for record in self.query(city, now - seconds, now + 1)]
+
+    def stats(self, city):
+        directory = self.city_dir(city)
+        result = {}
+        for name, _, _ in TIERS:
+            path = os.path.join(directory, f"{name}.bin")
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            result[name] = {"records": size // RECORD_SIZE, "bytes": size}
+        return result
+
+    def _rollup(self, directory, now):
+        # Сворачиваем в следующий уровень все завершенные интервалы, которых там еще нет
+        for (source, _, _), (target, step, _) in zip(TIERS, TIERS[1:]):
+            target_path = os.path.join(directory, f"{target}.bin")
+            boundary = now // step * step
+            last = self._last_timestamp(target_path)
+            start = last + step if last is not None else 0
+            if start >= boundary:
+                break
+            columns = self._columns(os.path.join(directory, f"{source}.bin"))
+            lo, hi = columns.range(start, boundary)
+            if lo == hi:
+                break
+            buckets = {}
+            for i in range(lo, hi):
+                buckets.setdefault(columns.timestamps[i] // step * step, []).append(i)
+            with open(target_path, "ab") as f:
+                for bucket, indexes in sorted(buckets.items()):
+                    temp = sum(columns.temps[i] for i in indexes) / len(indexes)
+                    humidity = round(sum(columns.humidity[i] for i in indexes) / len(indexes))
+                    code = Counter(columns.codes[i] for i in indexes).most_common(1)[0][0]
+                    f.write(RECORD.pack(bucket, temp, humidity, code))
+
+    def _compact(self, directory, now):
+        for name, _, retention in TIERS:
+            if retention is None:
+                continue
+            path = os.path.join(directory, f"{name}.bin")
+            columns = self._columns(path)
+            if not len(columns) or columns.timestamps[0] >= now - retention - COMPACT_SLACK:
+                continue
+            lo = bisect.bisect_left(columns.timestamps, now - retention)
+            with open(path, "rb") as f:
+                data = f.read()
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data[lo * RECORD_SIZE:len(columns) * RECORD_SIZE])
+            os.replace(tmp_path, path)
+
+    def _pending_records(self, directory, start, end, written):
+        # Еще не записанные наблюдения из [start, end), новее уже прочитанных
+        after = written[-1][0] if written else None
+        with self._lock:
+            return [record for record in self._pending.get(directory, ())
+                    if start <= record[0] < end and (after is None or record[0] > after)]
+
+    def _columns(self, path):
+        try:
+            with open(path, "rb") as f:
+                return Columns(f.read())
+        except FileNotFoundError:
+            return Columns(b"")
+
+    def _last_timestamp(self, path):
+        try:
+            with open(path, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                size -= size % RECORD_SIZE
+                if not size:
+                    return None
+                f.seek(size - RECORD_SIZE)
+                return RECORD.unpack(f.read(RECORD_SIZE))[0]
+        except FileNotFoundError:
+            return None
+
+
+def main():
+    # python history_store.py [город] - объем истории по городам или наблюдения за сутки
+    store = HistoryStore()
+    if len(sys.argv) > 1:
+        city = " ".join(sys.argv[1:])
+        for timestamp, temp, humidity, code in store.query(city, time.time() - 24 * 60 * 60):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))}  {temp:6.1f}°C  {humidity:3d}%  {code}")
+        return 0
+    cities = store.cities()
+    if not cities:
+        print("История пока пуста")
+    for city in cities:
+        stats = store.stats(city)
+        parts = ", ".join(f"{name} {entry['records']}" for name, entry in stats.items())
+        total = sum(entry["bytes"] for entry in stats.values())
+        print(f"{city}: {parts} ({total / 1024:.1f} КБ)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import io
+import os
+from collections import OrderedDict
+
+import customtkinter as ctk
+
+import fetch_worker
+import state_store
+
+# Иконки погодных условий. Файлы иконок хранятся на диске (каталог
+# WEATHER_ICON_DIR, по умолчанию icons в каталоге настроек) и скачиваются
+# один раз; готовые к показу CTkImage - в памяти, ключ (провайдер, иконка,
+# размер, тема). Загрузка и декодирование идут в отдельном фоновом потоке,
+# чтобы не задерживать запросы погоды
+ICON_DIR = "icons"
+DEFAULT_SIZE = 48
+DEFAULT_MAX_IMAGES = 64
+TIMEOUT = 10
+
+OPENWEATHER_ICON_URL = "https://openweathermap.org/img/wn/{icon}@2x.png"
+WEATHERAPI_ICON_URL = "//cdn.weatherapi.com/weather/64x64/{period}/{code}.png"
+
+# Известные иконки провайдеров - их заранее загружает prefetch()
+OPENWEATHER_ICONS = tuple(f"{code}{period}" for code in ("01", "02", "03", "04", "09", "10", "11", "13", "50")
+                          for period in ("d", "n"))
+WEATHERAPI_CODES = (
+    113, 116, 119, 122, 143, 176, 179, 182, 185, 200, 227, 230, 248, 260, 263, 266,
+    281, 284, 293, 296, 299, 302, 305, 308, 311, 314, 317, 320, 323, 326, 329, 332,
+    335, 338, 350, 353, 356, 359, 362, 365, 368, 371, 374, 377, 386, 389, 392, 395,
+)
+WEATHERAPI_ICONS = tuple(WEATHERAPI_ICON_URL.format(period=period, code=code)
+                         for code in WEATHERAPI_CODES for period in ("day", "night"))
+KNOWN_ICONS = {
+    "openweather": OPENWEATHER_ICONS,
+    "weatherapi": WEATHERAPI_ICONS,
+}
+
+
+def icon_url(provider, icon):
+    # OpenWeather присылает код ("10d"), WeatherAPI.com - адрес без схемы
+    if provider == "weatherapi":
+        return f"https:{icon}" if icon.startswith("//") else icon
+    return OPENWEATHER_ICON_URL.format(icon=icon)
+
+
+def icon_filename(provider, icon):
+    # "weatherapi-day-113.png", "openweather-10d.png"
+    if provider == "weatherapi":
+        parts = icon.rstrip("/").split("/")
+        return f"{provider}-{parts[-2]}-{parts[-1]}"
+    return f"{provider}-{icon}.png"
+
+
+class IconCache:
+    def __init__(self, root, path=None, max_images=DEFAULT_MAX_IMAGES):
+        self.root = root
+        self.path = path or os.getenv("WEATHER_ICON_DIR") or state_store.config_path(ICON_DIR)
+        self.max_images = max_images
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        # ключ -> CTkImage; порядок = порядок использования
+        self._images = OrderedDict()
+        # ключ -> обратные вызовы, ждущие загрузки
+        self._waiting = {}
+        self._worker = None
+
+    def key(self, provider, icon, size):
+        # Тема входит в ключ: после смены оформления картинки готовятся заново
+        return (provider, icon, size, ctk.get_appearance_mode())
+
+    def get(self, provider, icon, on_ready, size=DEFAULT_SIZE):
+        # Готовая картинка возвращается сразу; иначе on_ready(картинка)
+        # вызывается в потоке Tk после загрузки, а пока возвращается None
+        key = self.key(provider, icon, size)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+        self.misses += 1
+        self._load(key, on_ready)
+        return None
+
+    def prefetch(self, provider, size=DEFAULT_SIZE):
+        # Загрузка всех известных иконок провайдера. Вызывается, когда окно
+        # простаивает; если иконок больше, чем помещается в память,
+        # заранее только скачиваются файлы
+        icons = KNOWN_ICONS.get(provider, ())
+        decode = len(icons) <= self.max_images
+        for icon in icons:
+            if decode:
+                key = self.key(provider, icon, size)
+                if key not in self._images:
+                    self._load(key, None)
+            elif not os.path.exists(self._file(provider, icon)):
+                self._submit(lambda icon=icon: self._read(provider, icon), None)
+
+    def stats(self):
+        return {"images": len(self._images), "hits": self.hits, "misses": self.misses,
+                "downloads": self.downloads}
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.stop()
+
+    def _load(self, key, on_ready):
+        callbacks = self._waiting.get(key)
+        if callbacks is not None:
+            # Эта иконка уже загружается
+            if on_ready is not None:
+                callbacks.append(on_ready)
+            return
+        self._waiting[key] = [on_ready] if on_ready is not None else []
+        provider, icon, size, _ = key
+        self._submit(
+            lambda: self._decode(self._read(provider, icon), size),
+            lambda image: self._loaded(key, image),
+            lambda error: self._failed(key, error)
+        )
+
+    def _submit(self, func, on_done, on_error=None):
+        # Свой поток, чтобы иконки не занимали потоки запросов погоды
+        if self._worker is None:
+            self._worker = fetch_worker.FetchWorker(self.root, workers=1)
+        self._worker.submit(func, on_done, on_error)
+
+    def _file(self, provider, icon):
+        return os.path.join(self.path, icon_filename(provider, icon))
+
+    def _read(self, provider, icon):
+        # Фоновый поток: файл с диска, при отсутствии - из сети
+        path = self._file(provider, icon)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        import weather_client
+        response = weather_client.get_session().get(icon_url(provider, icon), timeout=TIMEOUT)
+        response.raise_for_status()
+        data = response.content
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.downloads += 1
+        return data
+
+    def _decode(self, data, size):
+        # Фоновый поток: декодирование и масштабирование
+        from PIL import Image
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        image = image.convert("RGBA")
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.LANCZOS)
+        return image
+
+    def _loaded(self, key, image):
+        # Поток Tk: CTkImage создается только здесь
+        size = key[2]
+        image = ctk.CTkImage(light_image=image, dark_image=image, size=(size, size))
+        self._images[key] = image
+        self._images.move_to_end(key)
+        while len(self._images) > self.max_images:
+            self._images.popitem(last=False)
+        for on_ready in self._waiting.pop(key, []):
+            try:
+                on_ready(image)
+            except Exception as e:
+                print(f"Ошибка отображения иконки: {str(e)}")
+
+    def _failed(self, key, error):
+        # Без иконки виджет работает как раньше; следующий запрос попробует снова
+        self._waiting.pop(key, None)
+        print(f"Ошибка загрузки иконки {key[1]}: {str(error)}")
@@ -0,0 +1,300 @@
+import atexit
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+
+# Встроенные метрики и трассировка запросов. Включаются переменными окружения:
+#   WEATHER_METRICS_FILE=weather_metrics.prom - файл в текстовом формате Prometheus
+#                                               (перезаписывается раз в WEATHER_METRICS_INTERVAL с)
+#   WEATHER_METRICS_PORT=9109                 - http://127.0.0.1:9109/metrics
+#   WEATHER_TRACE=1                           - этапы каждого запроса в stderr (ключи API скрыты)
+# Настройки читаются при импорте и еще раз - после загрузки .env (configure()
+# вызывают точки входа сразу после load_dotenv)
+# Когда все выключено, точки измерения сводятся к проверке metrics.enabled:
+#   if metrics.enabled:
+#       metrics.inc("weather_cache_requests_total", result="hit")
+
+enabled = False
+trace_enabled = False
+
+DEFAULT_INTERVAL = 15
+# Границы корзин гистограмм задержек (секунды)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "weather_requests_total": ("counter", "HTTP-запросы к API погоды"),
+    "weather_errors_total": ("counter", "Ошибки получения погоды по типам"),
+    "weather_retries_total": ("counter", "Повторные и дополнительные запросы (запасной провайдер, ожидание лимита)"),
+    "weather_cache_requests_total": ("counter", "Обращения к кэшу ответов"),
+    "weather_bulk_batches_total": ("counter", "Пакетные запросы"),
+    "weather_circuit_transitions_total": ("counter", "Переходы автомата отключения провайдера"),
+    "weather_request_seconds": ("histogram", "Полное время HTTP-запроса"),
+    "weather_phase_seconds": ("histogram", "Этапы запроса: dns, connect, tls, ttfb, parse, render"),
+}
+
+# Параметры URL с ключами API
+SECRET_PARAMS = re.compile(r"((?:appid|key)=)[^&\s\"')]+")
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_local = threading.local()
+_exporter = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # счетчики корзин, затем сумма и общее число
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def redact(url):
+    return SECRET_PARAMS.sub(r"\1***", url)
+
+
+def error_type(error):
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None):
+        return f"http_{response.status_code}"
+    return type(error).__name__
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def render():
+    # Текстовый формат Prometheus (exposition format 0.0.4)
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    lines = []
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+class RequestTrace:
+    # Этапы одного HTTP-запроса. DNS и установка соединения замеряются
+    # в потоке запроса (см. instrument_adapter), поэтому собираются здесь же
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.endpoint = urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1]
+        self.started = time.perf_counter()
+        self.phases = {}
+        _local.trace = self
+
+    def phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self, status):
+        total = time.perf_counter() - self.started
+        _local.trace = None
+        inc("weather_requests_total", endpoint=self.endpoint, status=status)
+        observe("weather_request_seconds", total, endpoint=self.endpoint)
+        for name, seconds in self.phases.items():
+            observe("weather_phase_seconds", seconds, phase=name)
+        if trace_enabled:
+            phases = " ".join(f"{name}={seconds * 1000:.1f}мс" for name, seconds in self.phases.items())
+            print(f"[trace] {self.method} {redact(self.url)} -> {status} за {total * 1000:.1f}мс {phases}",
+                  file=sys.stderr)
+
+
+def _current_trace():
+    return getattr(_local, "trace", None)
+
+
+def _traced_getaddrinfo(*args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return _original_getaddrinfo(*args, **kwargs)
+    finally:
+        trace = _current_trace()
+        if trace is not None:
+            trace.phase("dns", time.perf_counter() - started)
+
+
+_original_getaddrinfo = socket.getaddrinfo
+
+
+def instrument_adapter(adapter):
+    # Пулы соединений с замером DNS, TCP-подключения и TLS-рукопожатия.
+    # Вызывается только при включенных метриках
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def traced_new_conn(base):
+        def _new_conn(self):
+            trace = _current_trace()
+            dns_before = trace.phases.get("dns", 0.0) if trace is not None else 0.0
+            started = time.perf_counter()
+            try:
+                return base._new_conn(self)
+            finally:
+                if trace is not None:
+                    dns = trace.phases.get("dns", 0.0) - dns_before
+                    trace.phase("connect", time.perf_counter() - started - dns)
+        return _new_conn
+
+    class TracedHTTPConnection(HTTPConnection):
+        _new_conn = traced_new_conn(HTTPConnection)
+
+    class TracedHTTPSConnection(HTTPSConnection):
+        _new_conn = traced_new_conn(HTTPSConnection)
+
+        def connect(self):
+            trace = _current_trace()
+            before = dict(trace.phases) if trace is not None else {}
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                if trace is not None:
+                    spent = sum(trace.phases.get(name, 0.0) - before.get(name, 0.0) for name in ("dns", "connect"))
+                    trace.phase("tls", time.perf_counter() - started - spent)
+
+    class TracedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    adapter.poolmanager.pool_classes_by_scheme = {
+        "http": TracedHTTPConnectionPool,
+        "https": TracedHTTPSConnectionPool,
+    }
+    return adapter
+
+
+def _metrics_server(port):
+    # http.server импортируется только при включенном экспорте по HTTP:
+    # модуль metrics загружается при любом запросе погоды
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    return server
+
+
+class Exporter:
+    def __init__(self, path=None, port=None, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+        if port:
+            self.server = _metrics_server(port)
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        if path:
+            threading.Thread(target=self._run, name="metrics-file", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        if not self.path:
+            return
+        try:
+            write(self.path)
+        except Exception as e:
+            print(f"Ошибка записи метрик: {str(e)}", file=sys.stderr)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def configure(path=None, port=None, trace=None):
+    # Чтение настроек из окружения; повторный вызов применяет новые значения
+    global enabled, trace_enabled, _exporter
+    path = path or os.getenv("WEATHER_METRICS_FILE")
+    port = port or int(os.getenv("WEATHER_METRICS_PORT", "0") or 0)
+    trace_enabled = trace if trace is not None else os.getenv("WEATHER_TRACE", "0") not in ("", "0")
+    enabled = bool(path or port or trace_enabled)
+    socket.getaddrinfo = _traced_getaddrinfo if enabled else _original_getaddrinfo
+    if (path or port) and _exporter is None:
+        try:
+            _exporter = Exporter(path, port, int(os.getenv("WEATHER_METRICS_INTERVAL", DEFAULT_INTERVAL)))
+        except OSError as e:
+            print(f"Не удалось запустить экспорт метрик: {str(e)}", file=sys.stderr)
+    return enabled
+
+
+configure()
@@ -3,14 +3,17 @@ from tkinter import messagebox
 import requests
 import os
 import json
-import urllib.parse
+
+import fetch_worker
+import providers
+import quota
 
 # Загрузка API ключа из файла .env
-def load_api_key():
+def load_api_key(variable="WEATHERAPI_KEY"):
     try:
         with open(".env", "r", encoding="utf-8") as f:
             for line in f:
-                if line.startswith("WEATHERAPI_KEY="):
+                if line.startswith(f"{variable}="):
                     return line.strip().split("=", 1)[1]
     except Exception as e:
         print(f"Ошибка загрузки API ключа: {e}")
@@ -22,13 +25,23 @@ class WeatherApp:
         self.root.title("Погода")
         self.root.geometry("300x400")
         
-        # API конфигурация
-        self.api_key = load_api_key()
-        if not self.api_key or self.api_key == "your_api_key_here":
+        # API конфигурация: WeatherAPI.com, при медленном ответе или ошибке -
+        # OpenWeather, если задан и его ключ
+        self.providers = [
+            provider for provider in (
+                providers.WeatherApiProvider(load_api_key("WEATHERAPI_KEY")),
+                providers.OpenWeatherProvider(load_api_key("OPENWEATHER_API_KEY")),
+            ) if provider.available()
+        ]
+        if not self.providers:
             messagebox.showerror("Ошибка", "Пожалуйста, установите правильный WEATHERAPI_KEY в файле .env")
             root.destroy()
             return
+        self.client = providers.HedgedClient(self.providers)
             
+        # Фоновые запросы: результаты возвращаются в поток Tk
+        self.fetcher = fetch_worker.FetchWorker(self.root)
+        
         # Создание интерфейса
         self.create_widgets()
         
@@ -79,33 +92,37 @@ class WeatherApp:
             messagebox.showwarning("Предупреждение", "Пожалуйста, введите название города")
             return
             
-        # Кодируем название города для URL
-        encoded_city = urllib.parse.quote(city)
+        # Отключаем кнопку поиска на время запроса
+        self.search_button.configure(state="disabled")
         
-        try:
-            # Отключаем кнопку поиска на время запроса
-            self.search_button.configure(state="disabled")
-            
-            # Запрос к API WeatherAPI.com
-            url = f"http://api.weatherapi.com/v1/current.json?key={self.api_key}&q={encoded_city}&lang=ru"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Обновляем метки с информацией
-            self.temp_label.config(text=f"Температура: {data['current']['temp_c']:.1f}°C")
-            self.humidity_label.config(text=f"Влажность: {data['current']['humidity']}%")
-            self.desc_label.config(text=f"Описание: {data['current']['condition']['text'].capitalize()}")
+        # Запрос к API уходит в фоновый поток
+        self.fetcher.submit(
+            lambda: self.client.fetch(city),
+            self.show_weather,
+            self.show_error
+        )
+        
+    def show_weather(self, observation):
+        # Обновляем метки с информацией
+        self.temp_label.config(text=f"Температура: {observation.temp:.1f}°C")
+        self.humidity_label.config(text=f"Влажность: {observation.humidity}%")
+        self.desc_label.config(text=f"Описание: {observation.description}")
+        
+        # Включаем кнопку поиска обратно
+        self.search_button.configure(state="normal")
             
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("Ошибка", f"Не удалось получить данные о погоде: {str(e)}")
-        except KeyError:
+    def show_error(self, error):
+        # Включаем кнопку поиска обратно
+        self.search_button.configure(state="normal")
+        
+        if isinstance(error, requests.exceptions.RequestException):
+            messagebox.showerror("Ошибка", f"Не удалось получить данные о погоде: {str(error)}")
+        elif isinstance(error, quota.QuotaExceeded):
+            messagebox.showerror("Ошибка", str(error))
+        elif isinstance(error, KeyError):
             messagebox.showerror("Ошибка", "Город не найден")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Произошла неизвестная ошибка: {str(e)}")
-        finally:
-            # Включаем кнопку поиска обратно
-            self.search_button.configure(state="normal")
+        else:
+            messagebox.showerror("Ошибка", f"Произошла неизвестная ошибка: {str(error)}")
 
 if __name__ == "__main__":
     root = tk.Tk()
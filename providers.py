@@ -0,0 +1,260 @@
+import math
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import circuit_breaker
+import metrics
+import quota
+
+# Единое представление текущей погоды независимо от провайдера.
+# temp/feels_like - °C, wind - м/с, observed_at - unix time наблюдения,
+# raw - исходный ответ провайдера (для кэша, истории и отладки),
+# stale - провайдер недоступен и показаны последние сохраненные данные
+Observation = namedtuple(
+    "Observation",
+    "provider city temp feels_like humidity pressure wind description condition_code icon observed_at raw stale",
+    defaults=(False,)
+)
+
+# Порядок провайдеров: первый доступный - основной, следующий - запасной
+# (переменная WEATHER_PROVIDERS, через запятую)
+DEFAULT_ORDER = "openweather,weatherapi"
+
+# Запасной провайдер запрашивается, если основной не ответил за p95 своих
+# последних ответов; пока замеров мало - через HEDGE_DEFAULT_DELAY секунд
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.05
+HEDGE_MAX_DELAY = 5.0
+HEDGE_MIN_SAMPLES = 10
+LATENCY_WINDOW = 100
+
+
+def describe_age(observation, now=None):
+    # "5 мин", "3 ч" - сколько прошло с момента наблюдения
+    if not observation.observed_at:
+        return None
+    minutes = max(0, int(((now or time.time()) - observation.observed_at) // 60))
+    if minutes < 60:
+        return f"{minutes} мин"
+    if minutes < 48 * 60:
+        return f"{minutes // 60} ч"
+    return f"{minutes // (24 * 60)} дн"
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class Provider:
+    name = None
+    api_key_variable = None
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key if api_key is not None else os.getenv(self.api_key_variable)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.breaker = circuit_breaker.get(self.name)
+
+    def available(self):
+        return bool(self.api_key) and self.api_key != "your_api_key_here"
+
+    def fetch_raw(self, city, units="metric", lang="ru"):
+        # Время замеряется только для сетевых запросов, попадания в кэш
+        # занизили бы p95 и запасной провайдер запрашивался бы слишком часто
+        import weather_client
+        # Пока провайдер отключен, запрос не отправляется (см. circuit_breaker.py).
+        # Исход запроса автомат получает от weather_client - один раз на HTTP-запрос,
+        # даже если его результат делят несколько вызывающих
+        self.breaker.check()
+        started = time.perf_counter()
+        try:
+            data = weather_client.fetch_weather(self.name, city, self.api_key, units=units, lang=lang)
+        finally:
+            self.breaker.release()
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+        return data
+
+    def fetch(self, city, cache=None):
+        if cache is None:
+            data = self.fetch_raw(city)
+        else:
+            data = cache.get_or_fetch(self.name, city, lambda: self.fetch_raw(city))
+        return self.parse(data)
+
+    def hedge_delay(self):
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_DELAY
+            delay = _percentile(self._latencies, 0.95)
+        return max(HEDGE_MIN_DELAY, min(HEDGE_MAX_DELAY, delay))
+
+    def parse(self, data):
+        raise NotImplementedError
+
+
+class OpenWeatherProvider(Provider):
+    name = "openweather"
+    api_key_variable = "OPENWEATHER_API_KEY"
+
+    def parse(self, data):
+        weather = data["weather"][0]
+        return Observation(
+            provider=self.name,
+            city=data.get("name", ""),
+            temp=data["main"]["temp"],
+            feels_like=data["main"].get("feels_like"),
+            humidity=data["main"]["humidity"],
+            pressure=data["main"].get("pressure"),
+            wind=data.get("wind", {}).get("speed"),
+            description=weather["description"].capitalize(),
+            condition_code=weather.get("id"),
+            icon=weather.get("icon"),
+            observed_at=data.get("dt"),
+            raw=data,
+        )
+
+
+class WeatherApiProvider(Provider):
+    name = "weatherapi"
+    api_key_variable = "WEATHERAPI_KEY"
+
+    def parse(self, data):
+        current = data["current"]
+        wind_kph = current.get("wind_kph")
+        return Observation(
+            provider=self.name,
+            city=data.get("location", {}).get("name", ""),
+            temp=current["temp_c"],
+            feels_like=current.get("feelslike_c"),
+            humidity=current["humidity"],
+            pressure=current.get("pressure_mb"),
+            wind=round(wind_kph / 3.6, 1) if wind_kph is not None else None,
+            description=current["condition"]["text"].capitalize(),
+            condition_code=current["condition"].get("code"),
+            icon=current["condition"].get("icon"),
+            observed_at=current.get("last_updated_epoch"),
+            raw=data,
+        )
+
+
+PROVIDERS = {
+    "openweather": OpenWeatherProvider,
+    "weatherapi": WeatherApiProvider,
+}
+
+
+def parse(provider, data):
+    return PROVIDERS[provider]().parse(data)
+
+
+def configured_providers(order=None):
+    # Провайдеры с заданным ключом в порядке WEATHER_PROVIDERS
+    order = order or os.getenv("WEATHER_PROVIDERS", DEFAULT_ORDER)
+    result = []
+    for name in order.split(","):
+        name = name.strip()
+        if name in PROVIDERS:
+            provider = PROVIDERS[name]()
+            if provider.available():
+                result.append(provider)
+    return result
+
+
+class HedgedClient:
+    # Запрос к основному провайдеру; если он не ответил за свой p95 -
+    # параллельный запрос к запасному, берется первый успешный ответ.
+    # Ошибка основного сразу переключает на запасной (WEATHER_HEDGE=0
+    # оставляет только переключение при ошибке). Если недоступны все
+    # провайдеры, возвращаются последние данные из кэша с stale=True
+    def __init__(self, providers, cache=None, hedge=None, max_workers=32):
+        if not providers:
+            raise ValueError("Не задан ни один провайдер погоды")
+        self.providers = list(providers)
+        self.cache = cache
+        self.hedge = hedge if hedge is not None else os.getenv("WEATHER_HEDGE", "1") != "0"
+        self.hedged = 0
+        self.failovers = 0
+        self.stale = 0
+        self.wins = {provider.name: 0 for provider in self.providers}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+
+    @property
+    def primary(self):
+        return self.providers[0]
+
+    def fetch(self, city):
+        try:
+            return self._fetch(city)
+        except Exception as e:
+            observation = self._stale(city, e)
+            if observation is None:
+                raise
+            self._count("stale")
+            return observation
+
+    def _fetch(self, city):
+        primary = self.primary
+        if len(self.providers) == 1:
+            return primary.fetch(city, self.cache)
+
+        secondary = self.providers[1]
+        futures = {self._executor.submit(primary.fetch, city, self.cache): primary}
+        done, _ = wait(futures, timeout=primary.hedge_delay() if self.hedge else None)
+        if not done:
+            self._count("hedged")
+        elif next(iter(done)).exception() is None:
+            return self._win(next(iter(done)), futures)
+        else:
+            self._count("failovers")
+        futures[self._executor.submit(secondary.fetch, city, self.cache)] = secondary
+
+        # Первый успешный ответ; если ошиблись оба - ошибка основного
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return self._win(future, futures)
+        for future, provider in futures.items():
+            if provider is primary:
+                raise future.exception()
+
+    def stats(self):
+        with self._lock:
+            return {"hedged": self.hedged, "failovers": self.failovers, "stale": self.stale,
+                    "wins": dict(self.wins),
+                    "circuits": {provider.name: provider.breaker.state for provider in self.providers}}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _stale(self, city, error):
+        # Устаревшие данные - только когда недоступен провайдер, а не для неизвестного города
+        if self.cache is None:
+            return None
+        if not (circuit_breaker.is_provider_failure(error) or isinstance(error, quota.QuotaExceeded)):
+            return None
+        for provider in self.providers:
+            data = self.cache.get_stale(provider.name, city)
+            if data is not None:
+                return provider.parse(data)._replace(stale=True)
+        return None
+
+    def _win(self, future, futures):
+        with self._lock:
+            self.wins[futures[future].name] += 1
+        return future.result()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        # Выдача устаревших данных уже учтена кэшем (result="stale")
+        if metrics.enabled and name != "stale":
+            metrics.inc("weather_retries_total", reason=name)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sys
+import time
+
+import state_store
+from state_store import file_lock
+
+# Общий для всех процессов пользователя учет запросов к API. Состояние
+# хранится в файле, доступ к нему защищен файловой блокировкой, поэтому
+# несколько виджетов с одним ключом из .env не превысят лимит тарифа.
+
+# Лимиты бесплатных тарифов; переопределяются переменными окружения
+# WEATHER_QUOTA_PER_MINUTE и WEATHER_QUOTA_PER_MONTH (0 - без ограничения)
+PROVIDER_LIMITS = {
+    "openweather": {"per_minute": 60, "per_month": 1000000},
+    "weatherapi": {"per_minute": 60, "per_month": 1000000},
+}
+
+# Файл учета - в каталоге настроек пользователя (WEATHER_QUOTA_FILE - свой путь):
+# общий временный каталог на многопользовательской машине недоступен на
+# запись второму пользователю, да и ключи API у пользователей свои
+DEFAULT_QUOTA_FILE = "weather_quota.json"
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        if retry_after == float("inf"):
+            message = "Исчерпан месячный лимит запросов к API"
+        else:
+            message = f"Превышен лимит запросов к API, повтор через {retry_after:.0f} с"
+        super().__init__(message)
+
+
+def key_id(provider, api_key):
+    # Сам ключ в файл состояния не попадает, только его отпечаток
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"{provider}:{digest}"
+
+
+def default_quota_path():
+    return os.getenv("WEATHER_QUOTA_FILE") or state_store.config_path(DEFAULT_QUOTA_FILE)
+
+
+def current_month(now):
+    return time.strftime("%Y-%m", time.gmtime(now))
+
+
+def _env_limit(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class QuotaManager:
+    def __init__(self, path=None, limits=None):
+        self.path = path or default_quota_path()
+        self.lock_path = f"{self.path}.lock"
+        self.limits = limits or PROVIDER_LIMITS
+
+    def limits_for(self, provider):
+        limits = self.limits.get(provider, {"per_minute": 0, "per_month": 0})
+        return (
+            _env_limit("WEATHER_QUOTA_PER_MINUTE", limits["per_minute"]),
+            _env_limit("WEATHER_QUOTA_PER_MONTH", limits["per_month"]),
+        )
+
+    def try_acquire(self, provider, api_key, now=None):
+        # Возвращает 0, если запрос разрешен (и списывает его), иначе -
+        # сколько секунд ждать следующего токена (inf - до конца месяца)
+        now = now or time.time()
+        per_minute, per_month = self.limits_for(provider)
+        key = key_id(provider, api_key)
+        with file_lock(self.lock_path):
+            state = self._read()
+            entry = self._refresh(state.setdefault("keys", {}).get(key), per_minute, now)
+            state["keys"][key] = entry
+
+            if per_month and entry["month_count"] >= per_month:
+                entry["denied"] += 1
+                self._write(state)
+                return float("inf")
+            if per_minute and entry["tokens"] < 1:
+                entry["denied"] += 1
+                self._write(state)
+                return (1 - entry["tokens"]) * 60.0 / per_minute
+
+            if per_minute:
+                entry["tokens"] -= 1
+            entry["month_count"] += 1
+            entry["total"] += 1
+            self._write(state)
+            return 0.0
+
+    def usage(self, provider=None, api_key=None, now=None):
+        now = now or time.time()
+        with file_lock(self.lock_path):
+            keys = self._read().get("keys", {})
+        result = {}
+        for key, entry in keys.items():
+            entry_provider = key.split(":", 1)[0]
+            if provider and entry_provider != provider:
+                continue
+            # Без provider ключ API ищется у всех провайдеров
+            if api_key and key != key_id(entry_provider, api_key):
+                continue
+            per_minute, per_month = self.limits_for(entry_provider)
+            entry = self._refresh(entry, per_minute, now)
+            result[key] = {
+                "month": entry["month"],
+                "month_count": entry["month_count"],
+                "month_limit": per_month,
+                "tokens": round(entry["tokens"], 2),
+                "minute_limit": per_minute,
+                "total": entry["total"],
+                "denied": entry["denied"],
+            }
+        return result
+
+    def _refresh(self, entry, per_minute, now):
+        # Пополнение ведра токенов и сброс месячного счетчика
+        month = current_month(now)
+        if entry is None:
+            entry = {"month": month, "month_count": 0, "tokens": float(per_minute),
+                     "updated": now, "total": 0, "denied": 0}
+        entry = dict(entry)
+        if entry["month"] != month:
+            entry["month"] = month
+            entry["month_count"] = 0
+        elapsed = max(0.0, now - entry["updated"])
+        entry["tokens"] = min(float(per_minute), entry["tokens"] + elapsed * per_minute / 60.0)
+        entry["updated"] = now
+        return entry
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+def main():
+    # python quota.py - показать расход лимитов по всем ключам
+    manager = QuotaManager()
+    usage = manager.usage()
+    if not usage:
+        print("Запросов пока не было")
+    for key, entry in usage.items():
+        month_limit = entry["month_limit"] or "∞"
+        minute_limit = entry["minute_limit"] or "∞"
+        print(
+            f"{key}: за {entry['month']} {entry['month_count']}/{month_limit}, "
+            f"токенов {entry['tokens']}/{minute_limit}, всего {entry['total']}, отказов {entry['denied']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
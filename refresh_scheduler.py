@@ -0,0 +1,79 @@
+import random
+import time
+
+# Как часто провайдеры обновляют текущую погоду (секунды): запрашивать
+# чаще бессмысленно - придут те же данные
+PROVIDER_CADENCE = {
+    "openweather": 600,
+    "weatherapi": 900,
+}
+
+DEFAULT_INTERVAL = 300
+MIN_INTERVAL = 60
+MAX_INTERVAL = 3600
+# Свернутое или неактивное окно обновляется реже
+IDLE_FACTOR = 4
+# Разброс интервала +-10%, чтобы одновременно запущенные виджеты
+# не обращались к API синхронно
+JITTER = 0.1
+# Провайдер публикует новое наблюдение с небольшой задержкой
+UPDATE_MARGIN = 30
+
+
+def observation_time(provider, data):
+    # Время наблюдения по данным провайдера (unix time) или None
+    try:
+        if provider == "weatherapi":
+            return data["current"]["last_updated_epoch"]
+        return data["dt"]
+    except (KeyError, TypeError):
+        return None
+
+
+class RefreshScheduler:
+    def __init__(self, provider="openweather", interval=DEFAULT_INTERVAL, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, idle_factor=IDLE_FACTOR, jitter=JITTER):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_factor = idle_factor
+        self.jitter = jitter
+        self.cadence = PROVIDER_CADENCE.get(provider, interval)
+        self.failures = 0
+        self.observed_at = None
+        # Когда обновление было бы нужно активному окну
+        self.due_at = None
+
+    def record_success(self, observed_at=None):
+        self.failures = 0
+        self.observed_at = observed_at
+
+    def record_failure(self):
+        self.failures += 1
+
+    def base_delay(self, now=None):
+        now = now or time.time()
+        if self.failures:
+            # Экспоненциальная пауза после ошибок: 1, 2, 4, 8... минут
+            return min(self.max_interval, self.min_interval * 2 ** (self.failures - 1))
+        if self.observed_at:
+            # Следующее наблюдение появится примерно через cadence после текущего
+            delay = self.observed_at + self.cadence + UPDATE_MARGIN - now
+        else:
+            delay = self.interval
+        return max(self.min_interval, min(self.max_interval, delay))
+
+    def next_delay(self, idle=False, now=None):
+        now = now or time.time()
+        delay = self.base_delay(now)
+        self.due_at = now + delay
+        if idle:
+            delay = min(self.max_interval, delay * self.idle_factor)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_delay_ms(self, idle=False):
+        return int(self.next_delay(idle) * 1000)
+
+    def is_overdue(self, now=None):
+        now = now or time.time()
+        return self.due_at is not None and now >= self.due_at
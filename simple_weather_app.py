@@ -3,14 +3,26 @@ from tkinter import ttk, messagebox
 import requests
 import os
 from dotenv import load_dotenv
-import json
-import urllib.parse
-import threading
 import time
 import traceback
 
+import circuit_breaker
+import fetch_worker
+import gateway_client
+import metrics
+import providers
+import quota
+import refresh_scheduler
+import state_store
+import weather_cache
+
 # Загрузка переменных окружения
 load_dotenv()
+metrics.configure()
+
+STATUS_COLOR = "gray40"
+STALE_COLOR = "#b07d1a"
+ERROR_COLOR = "#c0392b"
 
 class WeatherApp:
     def __init__(self, root):
@@ -18,13 +30,37 @@ class WeatherApp:
         self.root.title("Погода")
         self.root.geometry("300x400")
         
-        # API конфигурация
-        self.api_key = os.getenv("OPENWEATHER_API_KEY")
-        if not self.api_key or self.api_key == "your_api_key_here":
-            messagebox.showerror("Ошибка", "Пожалуйста, установите правильный OPENWEATHER_API_KEY в файле .env")
+        # API конфигурация: провайдеры с заданными ключами (см. providers.py)
+        self.providers = providers.configured_providers()
+        if not self.providers:
+            messagebox.showerror("Ошибка", "Пожалуйста, установите правильный OPENWEATHER_API_KEY или WEATHERAPI_KEY в файле .env")
             root.destroy()
             return
             
+        # Кэш ответов: повторный запрос того же города не уходит в сеть
+        self.cache = weather_cache.WeatherCache(
+            ttl=int(os.getenv("WEATHER_CACHE_TTL", weather_cache.DEFAULT_TTL))
+        )
+        
+        # Основной провайдер, при медленном ответе или ошибке - запасной
+        self.client = providers.HedgedClient(self.providers, cache=self.cache)
+        
+        # Фоновые запросы: результаты возвращаются в поток Tk
+        self.fetcher = fetch_worker.FetchWorker(self.root)
+        
+        # Локальный шлюз (weather_gateway.py), если запущен: он сам опрашивает
+        # провайдера и присылает новые наблюдения; без него - прямые запросы
+        self.gateway = gateway_client.connect(
+            self.root, self.on_gateway_observation, self.on_gateway_error, self.on_gateway_lost
+        )
+        
+        # Планировщик автообновления: график провайдера, разброс, пауза после ошибок
+        self.scheduler = refresh_scheduler.RefreshScheduler(self.providers[0].name)
+        self.update_job = None
+        
+        # Состояние приложения в каталоге настроек; запись - в фоне и только при изменениях
+        self.state_store = state_store.StateStore()
+        
         # Загрузка последнего использованного города
         self.last_city = self.load_last_city()
         
@@ -32,8 +68,11 @@ class WeatherApp:
         self.create_widgets()
         
         # Запуск автообновления
-        self.update_thread = threading.Thread(target=self.auto_update, daemon=True)
-        self.update_thread.start()
+        self.schedule_update()
+        
+        # При разворачивании или активации окна догоняем пропущенное обновление
+        self.root.bind('<Map>', self.on_activate, add="+")
+        self.root.bind('<FocusIn>', self.on_activate, add="+")
         
     def create_widgets(self):
         # Основной фрейм
@@ -82,6 +121,15 @@ class WeatherApp:
         )
         self.desc_label.pack(anchor=tk.W, pady=5)
         
+        # Строка состояния: время обновления, устаревшие данные, ошибки
+        self.status_label = ttk.Label(
+            self.main_frame,
+            text="",
+            foreground=STATUS_COLOR,
+            wraplength=270
+        )
+        self.status_label.pack(anchor=tk.W)
+        
         # Если есть сохраненный город, загружаем его погоду
         if self.last_city:
             self.city_entry.insert(0, self.last_city)
@@ -93,64 +141,129 @@ class WeatherApp:
             messagebox.showwarning("Предупреждение", "Пожалуйста, введите название города")
             return
             
-        # Кодируем название города для URL
-        encoded_city = urllib.parse.quote(city)
+        # Отключаем кнопку поиска на время запроса
+        self.search_button.configure(state="disabled")
+        
+        # Через шлюз: подписка на город, ответ и дальнейшие обновления придут сами
+        if self.gateway is not None:
+            self.gateway.watch([city])
+            return
+        
+        # Запрос к API уходит в фоновый поток (сначала проверяем кэш)
+        self.fetcher.submit(
+            lambda: self.client.fetch(city),
+            lambda observation: self.show_weather(city, observation),
+            self.show_error
+        )
+        
+    def on_gateway_observation(self, city, observation):
+        self.show_weather(city, observation)
         
+    def on_gateway_error(self, city, error):
+        self.show_error(error)
+        
+    def on_gateway_lost(self):
+        # Шлюз остановлен - дальше окно запрашивает погоду само
+        print("Шлюз погоды недоступен, переход на прямые запросы")
+        self.gateway = None
+        self.search_button.configure(state="normal")
+        self.auto_update()
+        
+    def show_weather(self, city, observation):
         try:
-            # Отключаем кнопку поиска на время запроса
-            self.search_button.configure(state="disabled")
-            
-            # Запрос к API
-            url = f"http://api.openweathermap.org/data/2.5/weather?q={encoded_city}&appid={self.api_key}&units=metric&lang=ru"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
             # Обновляем метки с информацией
-            self.temp_label.config(text=f"Температура: {data['main']['temp']:.1f}°C")
-            self.humidity_label.config(text=f"Влажность: {data['main']['humidity']}%")
-            self.desc_label.config(text=f"Описание: {data['weather'][0]['description'].capitalize()}")
+            self.temp_label.config(text=f"Температура: {observation.temp:.1f}°C")
+            self.humidity_label.config(text=f"Влажность: {observation.humidity}%")
+            self.desc_label.config(text=f"Описание: {observation.description}")
+            if observation.stale:
+                # Провайдер недоступен - последние данные с указанием возраста
+                age = providers.describe_age(observation)
+                self.set_status(f"Нет связи с провайдером, данные {age} назад" if age else
+                                "Нет связи с провайдером, показаны сохраненные данные", STALE_COLOR)
+                self.scheduler.record_failure()
+            else:
+                self.set_status(f"Обновлено в {time.strftime('%H:%M')}")
+                self.scheduler.record_success(observation.observed_at)
             
-            # Сохраняем город
+            # Сохраняем город и наблюдение
             self.save_last_city(city)
+            self.save_observation(city, observation)
             
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("Ошибка", f"Не удалось получить данные о погоде: {str(e)}")
         except KeyError:
-            messagebox.showerror("Ошибка", "Город не найден")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Произошла неизвестная ошибка: {str(e)}\n\n{traceback.format_exc()}")
+            self.scheduler.record_failure()
+            self.set_status("Город не найден", ERROR_COLOR)
         finally:
             # Включаем кнопку поиска обратно
             self.search_button.configure(state="normal")
+            self.schedule_update()
+            
+    def show_error(self, error):
+        # Включаем кнопку поиска обратно
+        self.search_button.configure(state="normal")
+        self.scheduler.record_failure()
+        self.schedule_update()
+        
+        # Ошибка - в строку состояния, показанные данные остаются на месте
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None \
+                and error.response.status_code == 404:
+            message = "Город не найден"
+        elif isinstance(error, (requests.exceptions.RequestException, gateway_client.GatewayError)):
+            message = "Нет связи с сервером погоды"
+        elif isinstance(error, (quota.QuotaExceeded, circuit_breaker.CircuitOpen)):
+            message = str(error)
+        elif isinstance(error, KeyError):
+            message = "Город не найден"
+        else:
+            print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+            message = f"Ошибка: {str(error)}"
+        self.set_status(f"{message} ({time.strftime('%H:%M')})", ERROR_COLOR)
+        
+    def set_status(self, text, color=STATUS_COLOR):
+        self.status_label.config(text=text, foreground=color)
             
     def save_last_city(self, city):
-        try:
-            with open("last_city.json", "w", encoding="utf-8") as f:
-                json.dump({"city": city}, f)
-        except Exception as e:
-            print(f"Ошибка сохранения города: {str(e)}")
+        self.state_store.set("city", city)
+        
+    def save_observation(self, city, observation):
+        # Последнее наблюдение для мгновенного показа при следующем запуске
+        last = self.state_store.get("last_observation") or {}
+        if last.get("city") != city or last.get("data") != observation.raw:
+            self.state_store.set("last_observation", {
+                "city": city,
+                "provider": observation.provider,
+                "data": observation.raw,
+                "saved_at": time.time(),
+            })
             
     def load_last_city(self):
-        try:
-            with open("last_city.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("city", "")
-        except (FileNotFoundError, json.JSONDecodeError):
-            return ""
-        except Exception as e:
-            print(f"Ошибка загрузки города: {str(e)}")
-            return ""
+        return self.state_store.get("city", "")
             
     def auto_update(self):
-        while True:
-            try:
-                if self.city_entry.get():
-                    self.get_weather()
-                time.sleep(300)  # Обновление каждые 5 минут
-            except Exception as e:
-                print(f"Ошибка автообновления: {str(e)}")
-                time.sleep(60)  # При ошибке ждем минуту перед повторной попыткой
+        self.update_job = None
+        try:
+            if self.city_entry.get():
+                # Следующее обновление планируется по результату запроса
+                self.get_weather()
+                return
+        except Exception as e:
+            print(f"Ошибка автообновления: {str(e)}")
+        self.schedule_update()
+        
+    def schedule_update(self):
+        if self.update_job is not None:
+            self.root.after_cancel(self.update_job)
+            self.update_job = None
+        # Через шлюз обновления приходят сами
+        if self.gateway is not None:
+            return
+        # Свернутое или неактивное окно обновляется реже
+        idle = self.root.state() == "iconic" or self.root.focus_displayof() is None
+        self.update_job = self.root.after(self.scheduler.next_delay_ms(idle=idle), self.auto_update)
+        
+    def on_activate(self, event=None):
+        if self.update_job is not None and self.scheduler.is_overdue():
+            self.root.after_cancel(self.update_job)
+            self.auto_update()
 
 if __name__ == "__main__":
     try:
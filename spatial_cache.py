@@ -0,0 +1,125 @@
+import math
+import os
+import re
+from collections import namedtuple
+
+# Погода по координатам: вместо названия города передается "55.7558,37.6173"
+# (широта и долгота через запятую, точку с запятой или пробел). Провайдер
+# отдает погоду по ячейке своей сетки, поэтому координаты привязываются к
+# сетке WEATHER_GRID градусов (по умолчанию 0.01, около 1 км): соседние точки
+# дают один ключ кэша и один запрос. Если своей ячейки в кэше нет, отдается
+# свежее наблюдение не дальше WEATHER_NEARBY_KM километров (0 - не искать).
+DEFAULT_GRID = 0.01
+DEFAULT_RADIUS_KM = 2.0
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+# Дальше от экватора градус долготы короче; у полюсов ограничиваем число ячеек
+MAX_LON_CELLS = 16
+
+Point = namedtuple("Point", "lat lon")
+
+_POINT_PATTERN = re.compile(r"^\s*([-+]?\d+(?:\.\d+)?)\s*[,;\s]\s*([-+]?\d+(?:\.\d+)?)\s*$")
+
+
+def parse_point(text):
+    # Point или None, если это название города, а не координаты
+    if isinstance(text, Point):
+        return text
+    if not isinstance(text, str):
+        return None
+    match = _POINT_PATTERN.match(text)
+    if match is None:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return Point(lat, lon)
+
+
+def grid_step():
+    return float(os.getenv("WEATHER_GRID", DEFAULT_GRID))
+
+
+def nearby_radius():
+    return float(os.getenv("WEATHER_NEARBY_KM", DEFAULT_RADIUS_KM))
+
+
+def snap(point, step=None):
+    # Центр ячейки сетки, в которую попадает точка
+    step = grid_step() if step is None else step
+    if step <= 0:
+        return point
+    return Point(round(round(point.lat / step) * step, 6), round(round(point.lon / step) * step, 6))
+
+
+def format_point(point):
+    # 4 знака после запятой - около 10 м, как в запросах по индексу городов
+    return f"{point.lat:.4f},{point.lon:.4f}"
+
+
+def distance_km(a, b):
+    # Расстояние по большому кругу (формула гаверсинусов)
+    lat1, lat2 = math.radians(a.lat), math.radians(b.lat)
+    dlat = lat2 - lat1
+    dlon = math.radians(b.lon - a.lon)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+class NearbyIndex:
+    # Точки раскладываются по ячейкам размером с радиус поиска, поэтому
+    # поиск проверяет только соседние ячейки, а не все записи кэша.
+    # group - провайдер: ответ одного провайдера не подменяет другой.
+    # Синхронизация - на стороне владельца (WeatherCache под своей блокировкой)
+    def __init__(self, radius_km=None):
+        self.radius_km = nearby_radius() if radius_km is None else radius_km
+        self._cell = max(self.radius_km, 0.1) / KM_PER_DEGREE
+        # (группа, строка, столбец) -> {ключ: Point}
+        self._cells = {}
+        # ключ -> (группа, строка, столбец)
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, group, point):
+        self.remove(key)
+        cell = (group, *self._cell_of(point))
+        self._cells.setdefault(cell, {})[key] = point
+        self._keys[key] = cell
+
+    def remove(self, key):
+        cell = self._keys.pop(key, None)
+        if cell is None:
+            return
+        points = self._cells[cell]
+        del points[key]
+        if not points:
+            del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._keys.clear()
+
+    def nearest(self, group, point, accept=None):
+        # (ключ, расстояние в км) ближайшей точки в радиусе, для которой
+        # accept(ключ) истинно, или None
+        if self.radius_km <= 0 or not self._keys:
+            return None
+        row, col = self._cell_of(point)
+        scale = math.cos(math.radians(point.lat))
+        spread = MAX_LON_CELLS if scale <= 1 / MAX_LON_CELLS else math.ceil(1 / scale)
+        candidates = []
+        for r in range(row - 1, row + 2):
+            for c in range(col - spread, col + spread + 1):
+                for key, other in self._cells.get((group, r, c), {}).items():
+                    distance = distance_km(point, other)
+                    if distance <= self.radius_km:
+                        candidates.append((distance, key))
+        for distance, key in sorted(candidates):
+            if accept is None or accept(key):
+                return key, distance
+        return None
+
+    def _cell_of(self, point):
+        return math.floor(point.lat / self._cell), math.floor(point.lon / self._cell)
@@ -0,0 +1,200 @@
+import atexit
+import contextlib
+import copy
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+APP_NAME = "weather-widget"
+STATE_FILE = "state.json"
+# Изменения, пришедшие за это время, записываются одним файлом (секунды)
+WRITE_DELAY = 0.5
+# Файлы прежних версий, лежавшие в текущем каталоге
+LEGACY_CITY_FILE = "last_city.json"
+LEGACY_CITIES_FILE = "cities.json"
+
+
+def config_dir():
+    # Каталог настроек пользователя, а не текущий каталог запуска;
+    # WEATHER_CONFIG_DIR позволяет указать свой
+    path = os.getenv("WEATHER_CONFIG_DIR")
+    if not path:
+        if sys.platform == "win32":
+            base = os.getenv("APPDATA") or os.path.expanduser("~")
+        elif sys.platform == "darwin":
+            base = os.path.expanduser("~/Library/Application Support")
+        else:
+            base = os.getenv("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+        path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def config_path(name):
+    return os.path.join(config_dir(), name)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    # Межпроцессная блокировка на отдельном файле
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+
+def atomic_write_json(path, data):
+    # Пишем во временный файл рядом и подменяем целиком: при сбое посреди
+    # записи на диске остается прежняя целая версия. Имя временного файла
+    # уникально, чтобы одновременные записи разных процессов не смешивались
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class StateStore:
+    # Состояние приложения (город, список городов, положение окна, последнее
+    # наблюдение) в одном файле. set() только меняет данные в памяти, запись
+    # на диск выполняет фоновый поток и лишь при реальных изменениях.
+    # Файл общий для всех окон: при записи он перечитывается под файловой
+    # блокировкой и в нем заменяются только ключи, измененные этим процессом
+    def __init__(self, path=None, delay=WRITE_DELAY):
+        self.path = path or config_path(STATE_FILE)
+        self.lock_path = f"{self.path}.lock"
+        self.delay = delay
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Event()
+        # Ключи, измененные с последней записи
+        self._dirty = set()
+        self._state = self._load()
+        self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return copy.deepcopy(self._state.get(key, default))
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._state and self._state[key] == value:
+                return
+            self._state[key] = copy.deepcopy(value)
+            self._dirty.add(key)
+        self._changed.set()
+
+    def update(self, **values):
+        for key, value in values.items():
+            self.set(key, value)
+
+    def flush(self):
+        # Синхронная запись несохраненных изменений (при выходе)
+        self._write()
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            # Короткая пауза собирает несколько изменений в одну запись
+            time.sleep(self.delay)
+            self._changed.clear()
+            self._write()
+
+    def _write(self):
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                changes = {key: copy.deepcopy(self._state[key]) for key in self._dirty}
+                self._dirty.clear()
+            try:
+                with file_lock(self.lock_path):
+                    try:
+                        state = self._read()
+                    except (FileNotFoundError, ValueError):
+                        state = {}
+                    state.update(changes)
+                    atomic_write_json(self.path, state)
+            except Exception as e:
+                print(f"Ошибка сохранения состояния: {str(e)}")
+                with self._lock:
+                    # Повторим при следующей записи, если ключ не изменился снова
+                    for key in changes:
+                        self._dirty.add(key)
+                return
+            with self._lock:
+                # Заодно подхватываем ключи, сохраненные другими окнами
+                for key, value in state.items():
+                    if key not in self._dirty:
+                        self._state[key] = value
+                self.writes += 1
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if not isinstance(state, dict):
+            raise ValueError("неверный формат")
+        return state
+
+    def _load(self):
+        try:
+            return self._read()
+        except FileNotFoundError:
+            return self._load_legacy()
+        except ValueError as e:
+            print(f"Файл состояния {self.path} поврежден ({str(e)}), используются значения по умолчанию")
+        except Exception as e:
+            print(f"Ошибка загрузки состояния: {str(e)}")
+        return {}
+
+    def _load_legacy(self):
+        # Перенос last_city.json и cities.json прежних версий
+        state = {}
+        for name, key, field in ((LEGACY_CITY_FILE, "city", "city"), (LEGACY_CITIES_FILE, "cities", "cities")):
+            try:
+                with open(name, "r", encoding="utf-8") as f:
+                    value = json.load(f).get(field)
+                if value:
+                    state[key] = value
+            except (OSError, ValueError, AttributeError):
+                pass
+        # Перенесенные значения записываются в state.json при первой же записи:
+        # иначе при следующем запуске (старые файлы уже не читаются) они пропадут
+        self._dirty.update(state)
+        if state:
+            self._changed.set()
+        return state
@@ -0,0 +1,377 @@
+import argparse
+import gzip
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка API погоды для замеров без обращения к настоящим сервисам:
+#   python stub_server.py --port 8765 --latency 0.08 --jitter 0.04 --error-rate 0.01
+# Отвечает в формате OpenWeather (/data/2.5/weather, /data/2.5/group,
+# /data/2.5/forecast) и WeatherAPI.com (/v1/current.json, в том числе пакетный
+# POST с q=bulk, и /v1/forecast.json).
+# Город "notfound" всегда дает 404, "ratelimit" - 429. --slow-rate задает долю
+# ответов с дополнительной задержкой --slow-delay (хвост распределения задержек).
+
+CONDITIONS = [
+    # (код OpenWeather, иконка, код WeatherAPI.com, описание)
+    (800, "01d", 1000, "ясно"),
+    (801, "02d", 1003, "небольшая облачность"),
+    (803, "04d", 1006, "облачно с прояснениями"),
+    (804, "04d", 1009, "пасмурно"),
+    (500, "10d", 1063, "небольшой дождь"),
+    (501, "10d", 1189, "дождь"),
+    (600, "13d", 1213, "небольшой снег"),
+    (701, "50d", 1030, "туман"),
+]
+
+
+def _city_seed(city):
+    return zlib.crc32(city.strip().casefold().encode("utf-8"))
+
+
+def make_observation(city):
+    # Для одного и того же города данные стабильны, для разных - различаются
+    rng = random.Random(_city_seed(city))
+    owm_code, icon, wapi_code, text = rng.choice(CONDITIONS)
+    return {
+        "city": city.strip(),
+        "id": _city_seed(city) % 10000000,
+        "lat": round(rng.uniform(-60, 70), 4),
+        "lon": round(rng.uniform(-180, 180), 4),
+        "temp": round(rng.uniform(-25, 35), 2),
+        "feels_like": round(rng.uniform(-30, 35), 2),
+        "humidity": rng.randint(20, 100),
+        "pressure": rng.randint(980, 1040),
+        "wind": round(rng.uniform(0, 15), 1),
+        "owm_code": owm_code,
+        "icon": icon,
+        "wapi_code": wapi_code,
+        "text": text,
+        "dt": int(time.time()) // 600 * 600,
+    }
+
+
+def openweather_payload(obs):
+    return {
+        "coord": {"lon": obs["lon"], "lat": obs["lat"]},
+        "weather": [{"id": obs["owm_code"], "main": "", "description": obs["text"], "icon": obs["icon"]}],
+        "base": "stations",
+        "main": {
+            "temp": obs["temp"],
+            "feels_like": obs["feels_like"],
+            "temp_min": obs["temp"] - 1,
+            "temp_max": obs["temp"] + 1,
+            "pressure": obs["pressure"],
+            "humidity": obs["humidity"],
+        },
+        "visibility": 10000,
+        "wind": {"speed": obs["wind"], "deg": 180},
+        "clouds": {"all": 40},
+        "dt": obs["dt"],
+        "sys": {"country": "RU", "sunrise": obs["dt"] - 20000, "sunset": obs["dt"] + 20000},
+        "timezone": 10800,
+        "id": obs["id"],
+        "name": obs["city"],
+        "cod": 200,
+    }
+
+
+def weatherapi_payload(obs):
+    return {
+        "location": {
+            "name": obs["city"],
+            "region": "",
+            "country": "Russia",
+            "lat": obs["lat"],
+            "lon": obs["lon"],
+            "tz_id": "Europe/Moscow",
+            "localtime_epoch": obs["dt"],
+        },
+        "current": {
+            "last_updated_epoch": obs["dt"],
+            "temp_c": obs["temp"],
+            "temp_f": round(obs["temp"] * 9 / 5 + 32, 1),
+            "is_day": 1,
+            "condition": {
+                "text": obs["text"],
+                "icon": f"//cdn.weatherapi.com/weather/64x64/day/{obs['wapi_code']}.png",
+                "code": obs["wapi_code"],
+            },
+            "wind_kph": round(obs["wind"] * 3.6, 1),
+            "pressure_mb": obs["pressure"],
+            "humidity": obs["humidity"],
+            "feelslike_c": obs["feels_like"],
+        },
+    }
+
+
+def forecast_points(obs, step, count):
+    # Прогноз с суточным ходом температуры; для одного города стабилен
+    rng = random.Random(obs["id"])
+    start = obs["dt"] // step * step + step
+    points = []
+    for i in range(count):
+        dt = start + i * step
+        hour = (dt + 10800) % 86400 / 3600
+        owm_code, icon, wapi_code, text = rng.choice(CONDITIONS)
+        points.append({
+            "dt": dt,
+            "temp": round(obs["temp"] + 6 * math.sin((hour - 9) / 24 * 2 * math.pi) + rng.uniform(-1, 1), 2),
+            "humidity": rng.randint(20, 100),
+            "precip": round(rng.uniform(0, 3), 2) if owm_code in (500, 501, 600) else 0.0,
+            "owm_code": owm_code,
+            "icon": icon,
+            "wapi_code": wapi_code,
+            "text": text,
+        })
+    return points
+
+
+def openweather_forecast_payload(obs):
+    entries = []
+    for point in forecast_points(obs, 3 * 3600, 40):
+        entry = {
+            "dt": point["dt"],
+            "main": {"temp": point["temp"], "temp_min": point["temp"], "temp_max": point["temp"],
+                     "humidity": point["humidity"]},
+            "weather": [{"id": point["owm_code"], "main": "", "description": point["text"], "icon": point["icon"]}],
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(point["dt"])),
+        }
+        if point["precip"]:
+            entry["snow" if point["owm_code"] == 600 else "rain"] = {"3h": point["precip"]}
+        entries.append(entry)
+    return {
+        "cod": "200",
+        "cnt": len(entries),
+        "list": entries,
+        "city": {"id": obs["id"], "name": obs["city"], "coord": {"lat": obs["lat"], "lon": obs["lon"]},
+                 "country": "RU", "timezone": 10800},
+    }
+
+
+def weatherapi_forecast_payload(obs):
+    payload = weatherapi_payload(obs)
+    payload["location"]["localtime"] = time.strftime("%Y-%m-%d %H:%M", time.gmtime(obs["dt"] + 10800))
+    days = {}
+    for point in forecast_points(obs, 3600, 5 * 24):
+        date = time.strftime("%Y-%m-%d", time.gmtime(point["dt"] + 10800))
+        days.setdefault(date, []).append({
+            "time_epoch": point["dt"],
+            "time": time.strftime("%Y-%m-%d %H:%M", time.gmtime(point["dt"] + 10800)),
+            "temp_c": point["temp"],
+            "humidity": point["humidity"],
+            "precip_mm": point["precip"],
+            "condition": {
+                "text": point["text"],
+                "icon": f"//cdn.weatherapi.com/weather/64x64/day/{point['wapi_code']}.png",
+                "code": point["wapi_code"],
+            },
+        })
+    payload["forecast"] = {"forecastday": [{"date": date, "hour": hours} for date, hours in days.items()]}
+    return payload
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 + Content-Length, чтобы клиент мог переиспользовать соединения
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело пишутся отдельно: без TCP_NODELAY Nagle + delayed ACK
+    # добавляют к каждому ответу ~40 мс
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(parsed.query)
+        city = params.get("q", [""])[0] or params.get("id", [""])[0]
+        if not city and "lat" in params and "lon" in params:
+            city = f"{params['lat'][0]},{params['lon'][0]}"
+        server = self.server
+        self._wait()
+
+        if parsed.path.endswith("/data/2.5/group"):
+            return self._send_group(params.get("id", [""])[0])
+        if parsed.path.endswith("/data/2.5/weather"):
+            render = openweather_payload
+        elif parsed.path.endswith("/v1/current.json"):
+            render = weatherapi_payload
+        elif parsed.path.endswith("/data/2.5/forecast"):
+            render = openweather_forecast_payload
+        elif parsed.path.endswith("/v1/forecast.json"):
+            render = weatherapi_forecast_payload
+        else:
+            return self._send(404, {"message": "unknown endpoint"})
+
+        if not city:
+            return self._send(400, {"cod": "400", "message": "Nothing to geocode"})
+        if city.casefold() == "ratelimit" or random.random() < server.throttle_rate:
+            return self._send(429, {"cod": 429, "message": "Too many requests"}, {"Retry-After": "1"})
+        if random.random() < server.error_rate:
+            return self._send(500, {"cod": 500, "message": "Internal error"})
+        if city.casefold() == "notfound":
+            return self._send(404, {"cod": "404", "message": "city not found"})
+
+        payload = render(make_observation(city))
+        if params.get("id", [""])[0].isdigit() and "id" in payload:
+            payload["id"] = int(params["id"][0])
+        self._send(200, payload)
+
+    def do_POST(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(parsed.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        self._wait()
+        if not parsed.path.endswith("/v1/current.json") or params.get("q", [""])[0] != "bulk":
+            return self._send(404, {"message": "unknown endpoint"})
+        try:
+            locations = json.loads(body or b"{}").get("locations", [])
+        except ValueError:
+            return self._send(400, {"error": {"code": 1001, "message": "Invalid body"}})
+        if random.random() < self.server.error_rate:
+            return self._send(500, {"error": {"code": 9999, "message": "Internal error"}})
+        bulk = []
+        for location in locations[:50]:
+            query = {"custom_id": location.get("custom_id"), "q": location.get("q", "")}
+            if query["q"].casefold() == "notfound":
+                query["error"] = {"code": 1006, "message": "No matching location found."}
+            else:
+                query.update(weatherapi_payload(make_observation(query["q"])))
+            bulk.append({"query": query})
+        self._send(200, {"bulk": bulk})
+
+    def _wait(self):
+        server = self.server
+        server.count_request()
+        delay = server.latency + random.uniform(0, server.jitter)
+        if random.random() < server.slow_rate:
+            delay += server.slow_delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def _send_group(self, ids):
+        city_ids = [city_id for city_id in ids.split(",") if city_id.isdigit()]
+        if not city_ids or len(city_ids) > 20:
+            return self._send(400, {"cod": "400", "message": "Invalid id list"})
+        if random.random() < self.server.error_rate:
+            return self._send(500, {"cod": 500, "message": "Internal error"})
+        entries = []
+        for city_id in city_ids:
+            payload = openweather_payload(make_observation(city_id))
+            payload["id"] = int(city_id)
+            entries.append(payload)
+        self._send(200, {"cnt": len(entries), "list": entries})
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, throttle_rate=0.0, verbose=False, slow_rate=0.0, slow_delay=1.0):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.verbose = verbose
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openweather_url(self):
+        return f"{self.url}/data/2.5/weather"
+
+    @property
+    def weatherapi_url(self):
+        return f"{self.url}/v1/current.json"
+
+    @property
+    def openweather_forecast_url(self):
+        return f"{self.url}/data/2.5/forecast"
+
+    @property
+    def weatherapi_forecast_url(self):
+        return f"{self.url}/v1/forecast.json"
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная заглушка API погоды")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="добавка к задержке медленных ответов, с")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        args.host, args.port, args.latency, args.jitter,
+        args.error_rate, args.throttle_rate, args.verbose,
+        args.slow_rate, args.slow_delay
+    )
+    print(f"Заглушка запущена: {server.url}")
+    print(f"  OPENWEATHER_URL={server.openweather_url}")
+    print(f"  WEATHERAPI_URL={server.weatherapi_url}")
+    print(f"  OPENWEATHER_FORECAST_URL={server.openweather_forecast_url}")
+    print(f"  WEATHERAPI_FORECAST_URL={server.weatherapi_forecast_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+
+# Длительность кадра (мс): изменения виджетов применяются не чаще раза за
+# кадр; WEATHER_FRAME_MS позволяет подстроить под частоту дисплея
+FRAME_MS = 16
+
+_MISSING = object()
+
+
+class UiScheduler:
+    # Отложенные изменения виджетов. configure() только запоминает новые
+    # параметры, flush() раз за кадр применяет их, пропуская те, что не
+    # отличаются от уже показанных; call() с одним ключом за кадр
+    # выполняется один раз (последний вариант) - например, перемещение окна
+    def __init__(self, root, frame_ms=None):
+        self.root = root
+        self.frame_ms = frame_ms or int(os.getenv("WEATHER_FRAME_MS", FRAME_MS))
+        self.flushes = 0
+        self.applied = 0
+        self.skipped = 0
+        self._pending = {}
+        self._calls = {}
+        self._shown = {}
+        self._job = None
+
+    def configure(self, widget, **options):
+        self._pending.setdefault(widget, {}).update(options)
+        self._schedule()
+
+    def call(self, key, func):
+        self._calls[key] = func
+        self._schedule()
+
+    def forget(self, widget):
+        # Виджет удален или изменен в обход планировщика
+        self._pending.pop(widget, None)
+        self._shown.pop(widget, None)
+
+    def flush(self):
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None
+        pending, self._pending = self._pending, {}
+        calls, self._calls = self._calls, {}
+
+        for widget, options in pending.items():
+            shown = self._shown.setdefault(widget, {})
+            changed = {name: value for name, value in options.items() if shown.get(name, _MISSING) != value}
+            self.skipped += len(options) - len(changed)
+            if not changed:
+                continue
+            try:
+                widget.configure(**changed)
+            except Exception:
+                # Виджет уже уничтожен
+                self._shown.pop(widget, None)
+                continue
+            shown.update(changed)
+            self.applied += 1
+
+        for func in calls.values():
+            try:
+                func()
+            except Exception as e:
+                print(f"Ошибка обновления окна: {str(e)}")
+        self.flushes += 1
+
+    def stats(self):
+        return {"flushes": self.flushes, "applied": self.applied, "skipped": self.skipped}
+
+    def _schedule(self):
+        if self._job is None:
+            self._job = self.root.after(self.frame_ms, self._on_frame)
+
+    def _on_frame(self):
+        self._job = None
+        self.flush()
@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+
+# Программный интерфейс без графических библиотек - для скриптов и сервисов:
+#   import weather_api
+#   observation = weather_api.get_current("Москва")         # providers.Observation
+#   observation = weather_api.get_at(55.7558, 37.6173)      # по координатам
+#   results = weather_api.get_many(["Москва", "Казань"])    # {город: Observation или исключение}
+#   observation = await weather_api.get_current_async("Москва")
+# Импорт модуля ничего не читает и не загружает: .env, ключи API,
+# провайдеры, кэш и сетевые модули (requests) инициализируются при первом
+# запросе. Настройки те же, что у виджета (OPENWEATHER_API_KEY, WEATHERAPI_KEY,
+# WEATHER_PROVIDERS, WEATHER_CACHE_TTL...), либо явно через configure().
+
+DEFAULT_WORKERS = 16
+
+_client = None
+_lock = threading.Lock()
+
+
+def _load_env():
+    # Без python-dotenv ключи берутся только из переменных окружения
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+    # Настройки метрик из .env (модуль metrics мог прочитать окружение раньше)
+    import metrics
+    metrics.configure()
+
+
+def _build(api_keys=None, cache=None, hedge=None):
+    import providers
+    import weather_cache
+
+    if api_keys is None:
+        _load_env()
+        configured = providers.configured_providers()
+    else:
+        configured = [providers.PROVIDERS[name](key) for name, key in api_keys.items()]
+        configured = [provider for provider in configured if provider.available()]
+    if cache is None:
+        # Кэш в памяти; файл - только если задан WEATHER_CACHE_FILE
+        cache = weather_cache.WeatherCache(
+            ttl=int(os.getenv("WEATHER_CACHE_TTL", weather_cache.DEFAULT_TTL)),
+            path=os.getenv("WEATHER_CACHE_FILE") or None
+        )
+    return providers.HedgedClient(configured, cache=cache, hedge=hedge)
+
+
+def configure(api_keys=None, cache=None, hedge=None):
+    # api_keys - {"openweather": ключ, "weatherapi": ключ} в порядке
+    # предпочтения; без него провайдеры берутся из окружения
+    global _client
+    client = _build(api_keys, cache, hedge)
+    with _lock:
+        previous, _client = _client, client
+    if previous is not None:
+        previous.close()
+    return client
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build()
+    return _client
+
+
+def get_current(city):
+    # Текущая погода: кэш, основной провайдер, при задержке или ошибке - запасной
+    return get_client().fetch(city)
+
+
+def get_at(lat, lon):
+    # По координатам: соседние точки обслуживаются одним запросом (см. spatial_cache.py)
+    import spatial_cache
+    return get_current(spatial_cache.format_point(spatial_cache.Point(lat, lon)))
+
+
+def get_many(cities, max_workers=DEFAULT_WORKERS):
+    # {город: Observation или исключение}; одинаковые города запрашиваются один раз
+    from concurrent.futures import ThreadPoolExecutor
+    cities = list(dict.fromkeys(cities))
+    client = get_client()
+    result = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cities) or 1))) as executor:
+        futures = [(city, executor.submit(client.fetch, city)) for city in cities]
+        for city, future in futures:
+            try:
+                result[city] = future.result()
+            except Exception as e:
+                result[city] = e
+    return result
+
+
+async def get_current_async(city):
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(None, get_current, city)
+
+
+async def get_many_async(cities):
+    import asyncio
+    cities = list(dict.fromkeys(cities))
+    results = await asyncio.gather(*(get_current_async(city) for city in cities), return_exceptions=True)
+    return dict(zip(cities, results))
+
+
+def close():
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+    # Сессию закрываем, только если сетевой модуль вообще загружался
+    if "weather_client" in sys.modules:
+        sys.modules["weather_client"].close_session()
@@ -1,19 +1,64 @@
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
-import requests
 import os
 import sys
 from dotenv import load_dotenv
-import json
-from PIL import Image
-import urllib.parse
-import threading
 import time
 import traceback
 
+import autocomplete
+import circuit_breaker
+import fetch_worker
+import gateway_client
+import history_store
+import icon_cache
+import metrics
+import providers
+import quota
+import refresh_scheduler
+import state_store
+import ui_scheduler
+import weather_cache
+
+# weather_client (а с ним requests) импортируется при первом запросе в фоновом
+# потоке: окно рисуется сразу, не дожидаясь загрузки сетевых модулей
+
 # Загрузка переменных окружения
 load_dotenv()
+metrics.configure()
+
+# График температуры под показаниями: за сколько секунд, высота и цвет линии
+SPARKLINE_PERIOD = 24 * 60 * 60
+SPARKLINE_HEIGHT = 40
+SPARKLINE_COLOR = "#3a8fd6"
+# Подсказки городов подключаются после первой отрисовки окна (мс)
+AUTOCOMPLETE_DELAY = 500
+# Одновременных запросов в дашборде по умолчанию - как размер пула соединений
+# (weather_client.POOL_MAXSIZE; сам модуль при запуске не импортируется)
+DEFAULT_MAX_CONCURRENCY = 16
+# Иконки погодных условий: размер в виджете и в строке дашборда; известные
+# иконки загружаются заранее, через ICON_PREFETCH_DELAY мс после запуска
+ICON_SIZE = 48
+ROW_ICON_SIZE = 24
+ICON_PREFETCH_DELAY = 3000
+
+# Цвета строки состояния: обычный, устаревшие данные, ошибка
+STATUS_COLOR = "gray60"
+STALE_COLOR = "#d9a441"
+ERROR_COLOR = "#e0605a"
+
+# Сообщение, если не задан ключ ни одного провайдера
+NO_PROVIDER_MESSAGE = "Пожалуйста, установите правильный OPENWEATHER_API_KEY или WEATHERAPI_KEY в файле .env"
+
+def load_city_index():
+    # Выполняется в FetchWorker: импорт weather_client (с requests) и открытие
+    # индекса городов не задерживают поток Tk
+    import weather_client
+    return weather_client.get_city_index()
+
+def on_city_index_error(error):
+    print(f"Ошибка загрузки индекса городов: {str(error)}")
 
 class WeatherWidget(ctk.CTk):
     def __init__(self):
@@ -26,26 +71,67 @@ class WeatherWidget(ctk.CTk):
             self.attributes('-topmost', True)  # Окно всегда поверх других
             self.overrideredirect(True)  # Убираем стандартную рамку окна
             
-            # API конфигурация
-            self.api_key = os.getenv("OPENWEATHER_API_KEY")
-            if not self.api_key or self.api_key == "your_api_key_here":
-                messagebox.showerror("Ошибка", "Пожалуйста, установите правильный OPENWEATHER_API_KEY в файле .env")
+            # API конфигурация: провайдеры с заданными ключами (см. providers.py)
+            self.providers = providers.configured_providers()
+            if not self.providers:
+                messagebox.showerror("Ошибка", NO_PROVIDER_MESSAGE)
                 self.destroy()
                 return
                 
-            # Загрузка последнего использованного города
+            # Кэш ответов: повторный запрос того же города не уходит в сеть
+            self.cache = weather_cache.WeatherCache(
+                ttl=int(os.getenv("WEATHER_CACHE_TTL", weather_cache.DEFAULT_TTL))
+            )
+            
+            # Основной провайдер, при медленном ответе или ошибке - запасной
+            self.client = providers.HedgedClient(self.providers, cache=self.cache)
+            
+            # Фоновые запросы: результаты возвращаются в поток Tk
+            self.fetcher = fetch_worker.FetchWorker(self)
+            
+            # Локальный шлюз (weather_gateway.py), если запущен: он сам опрашивает
+            # провайдера и присылает новые наблюдения; без него - прямые запросы
+            self.gateway = gateway_client.connect(
+                self, self.on_gateway_observation, self.on_gateway_error, self.on_gateway_lost
+            )
+            
+            # Планировщик автообновления: график провайдера, разброс, пауза после ошибок
+            self.scheduler = refresh_scheduler.RefreshScheduler(self.providers[0].name)
+            self.update_job = None
+            
+            # Состояние приложения в каталоге настроек; запись - в фоне и только при изменениях
+            self.state_store = state_store.StateStore()
+            
+            # История наблюдений для графика температуры
+            self.history = history_store.HistoryStore()
+            
+            # Обновления меток и перемещения окна - не чаще раза за кадр
+            self.ui = ui_scheduler.UiScheduler(self)
+            
+            # Иконки погодных условий: файлы на диске, картинки в памяти
+            self.icons = icon_cache.IconCache(self)
+            self.icon_key = None
+            
+            # Загрузка последнего использованного города и положения окна
             self.last_city = self.load_last_city()
+            position = self.state_store.get("window_position")
+            if position:
+                self.geometry(f"+{position[0]}+{position[1]}")
             
             # Создание интерфейса
             self.create_widgets()
             
             # Запуск автообновления
-            self.update_thread = threading.Thread(target=self.auto_update, daemon=True)
-            self.update_thread.start()
+            self.schedule_update()
+            
+            # При разворачивании или активации окна догоняем пропущенное обновление
+            self.bind('<Map>', self.on_activate, add="+")
+            self.bind('<FocusIn>', self.on_activate, add="+")
             
             # Добавление возможности перетаскивания окна
             self.bind('<Button-1>', self.start_move)
             self.bind('<B1-Motion>', self.on_move)
+            self.bind('<ButtonRelease-1>', self.end_move)
             
         except Exception as e:
             messagebox.showerror("Ошибка инициализации", f"Произошла ошибка: {str(e)}\n\n{traceback.format_exc()}")
@@ -77,6 +163,12 @@ class WeatherWidget(ctk.CTk):
             )
             self.city_entry.pack(side=tk.LEFT, padx=5)
             
+            # Подсказки по мере ввода из локального индекса городов (если он построен)
+            self.after(AUTOCOMPLETE_DELAY, self.attach_autocomplete)
+            
+            # Иконки заранее, пока окно простаивает: при обновлении они уже в памяти
+            self.after(ICON_PREFETCH_DELAY, lambda: self.icons.prefetch(self.providers[0].name, ICON_SIZE))
+            
             self.search_button = ctk.CTkButton(
                 self.city_frame,
                 text="Поиск",
@@ -89,6 +181,15 @@ class WeatherWidget(ctk.CTk):
             self.weather_frame = ctk.CTkFrame(self.main_frame)
             self.weather_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
             
+            # Иконка погодных условий
+            self.icon_label = ctk.CTkLabel(
+                self.weather_frame,
+                text="",
+                width=ICON_SIZE,
+                height=ICON_SIZE
+            )
+            self.icon_label.pack(pady=(5, 0))
+            
             # Метки с информацией о погоде
             self.temp_label = ctk.CTkLabel(
                 self.weather_frame,
@@ -111,101 +212,611 @@ class WeatherWidget(ctk.CTk):
             )
             self.desc_label.pack(pady=5)
             
-            # Если есть сохраненный город, загружаем его погоду
+            # Строка состояния: время наблюдения, возраст устаревших данных, ошибки
+            self.status_label = ctk.CTkLabel(
+                self.weather_frame,
+                text="",
+                font=("Arial", 11),
+                text_color=STATUS_COLOR,
+                wraplength=250
+            )
+            self.status_label.pack(pady=(0, 5))
+            
+            # Температура за последние сутки из истории наблюдений
+            self.sparkline = tk.Canvas(
+                self.weather_frame,
+                height=SPARKLINE_HEIGHT,
+                highlightthickness=0,
+                bg=self._apply_appearance_mode(ctk.ThemeManager.theme["CTkFrame"]["top_fg_color"])
+            )
+            self.sparkline.pack(fill=tk.X, padx=10, pady=5)
+            self.sparkline_values = []
+            self.sparkline.bind('<Configure>', lambda event: self.draw_sparkline(self.sparkline_values))
+            if self.last_city:
+                self.sparkline_values = self.history.temperatures(self.last_city, SPARKLINE_PERIOD)
+            
+            # Если есть сохраненный город, сразу показываем последнее сохраненное
+            # наблюдение, а свежие данные запрашиваем в фоне после отрисовки окна
             if self.last_city:
                 self.city_entry.insert(0, self.last_city)
-                self.get_weather()
+                self.show_saved_observation()
+                self.after_idle(self.get_weather)
                 
         except Exception as e:
             messagebox.showerror("Ошибка создания интерфейса", f"Произошла ошибка: {str(e)}\n\n{traceback.format_exc()}")
             self.destroy()
             
+    def attach_autocomplete(self):
+        # Индекс открывается в фоновом потоке, подсказки подключаются в потоке Tk
+        self.fetcher.submit(load_city_index, self.on_city_index, on_city_index_error)
+            
+    def on_city_index(self, index):
+        if index is not None:
+            self.autocomplete = autocomplete.CityAutocomplete(self.city_entry, index, on_select=self.get_weather)
+            
+    def show_saved_observation(self):
+        saved = self.state_store.get("last_observation")
+        if not saved or weather_cache.normalize_city(saved.get("city", "")) != weather_cache.normalize_city(self.last_city):
+            return
+        try:
+            self.render_observation(providers.parse(saved.get("provider", "openweather"), saved["data"]))
+        except (KeyError, IndexError, TypeError):
+            return
+        saved_at = time.strftime("%H:%M", time.localtime(saved.get("saved_at", 0)))
+        self.set_status(f"Данные от {saved_at}, обновление...")
+        # Сохраненные данные должны попасть уже в первый кадр
+        self.ui.flush()
+        
+    def render_observation(self, observation):
+        # Неизменившиеся метки не перерисовываются
+        self.ui.configure(self.temp_label, text=f"Температура: {observation.temp:.1f}°C")
+        self.ui.configure(self.humidity_label, text=f"Влажность: {observation.humidity}%")
+        self.ui.configure(self.desc_label, text=f"Описание: {observation.description}")
+        self.show_icon(observation)
+        
+    def show_icon(self, observation):
+        if not observation.icon:
+            return
+        key = self.icon_key = (observation.provider, observation.icon)
+        image = self.icons.get(observation.provider, observation.icon,
+                               lambda image: self.on_icon_loaded(key, image), ICON_SIZE)
+        if image is not None:
+            self.ui.configure(self.icon_label, image=image)
+            
+    def on_icon_loaded(self, key, image):
+        # Пока иконка загружалась, могли прийти данные с другой
+        if key == self.icon_key:
+            self.ui.configure(self.icon_label, image=image)
+        
     def get_weather(self):
         city = self.city_entry.get()
         if not city:
             messagebox.showwarning("Предупреждение", "Пожалуйста, введите название города")
             return
             
-        # Кодируем название города для URL
-        encoded_city = urllib.parse.quote(city)
+        # Отключаем кнопку поиска на время запроса
+        self.search_button.configure(state="disabled")
+        
+        # Через шлюз: подписка на город, ответ и дальнейшие обновления придут сами
+        if self.gateway is not None:
+            self.gateway.watch([city])
+            return
+        
+        # Запрос к API уходит в фоновый поток (сначала проверяем кэш)
+        self.fetcher.submit(
+            lambda: self.client.fetch(city),
+            lambda observation: self.show_weather(city, observation),
+            self.show_error
+        )
+        
+    def on_gateway_observation(self, city, observation):
+        self.show_weather(city, observation)
+        
+    def on_gateway_error(self, city, error):
+        self.show_error(error)
+        
+    def on_gateway_lost(self):
+        # Шлюз остановлен - дальше окно запрашивает погоду само
+        print("Шлюз погоды недоступен, переход на прямые запросы")
+        self.gateway = None
+        self.search_button.configure(state="normal")
+        self.auto_update()
         
+    def show_weather(self, city, observation):
         try:
-            # Отключаем кнопку поиска на время запроса
-            self.search_button.configure(state="disabled")
-            
-            # Запрос к API
-            url = f"http://api.openweathermap.org/data/2.5/weather?q={encoded_city}&appid={self.api_key}&units=metric&lang=ru"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
             # Обновляем метки с информацией
-            self.temp_label.configure(text=f"Температура: {data['main']['temp']:.1f}°C")
-            self.humidity_label.configure(text=f"Влажность: {data['main']['humidity']}%")
-            self.desc_label.configure(text=f"Описание: {data['weather'][0]['description'].capitalize()}")
+            self.render_observation(observation)
+            if observation.stale:
+                # Провайдер недоступен: последние данные с указанием их возраста,
+                # восстановление проверяет один пробный запрос (см. circuit_breaker.py)
+                age = providers.describe_age(observation)
+                self.set_status(f"Нет связи с провайдером, данные {age} назад" if age else
+                                "Нет связи с провайдером, показаны сохраненные данные", STALE_COLOR)
+                self.scheduler.record_failure()
+            else:
+                self.set_status(f"Обновлено в {time.strftime('%H:%M')}")
+                self.scheduler.record_success(observation.observed_at)
             
-            # Сохраняем город
+            # Сохраняем город и наблюдение
             self.save_last_city(city)
+            self.save_observation(city, observation)
+            self.record_history(city, observation)
             
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("Ошибка", f"Не удалось получить данные о погоде: {str(e)}")
         except KeyError:
-            messagebox.showerror("Ошибка", "Город не найден")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Произошла неизвестная ошибка: {str(e)}\n\n{traceback.format_exc()}")
+            self.scheduler.record_failure()
+            self.set_status("Город не найден", ERROR_COLOR)
         finally:
             # Включаем кнопку поиска обратно
             self.search_button.configure(state="normal")
+            self.schedule_update()
+            
+    def show_error(self, error):
+        # Включаем кнопку поиска обратно
+        self.search_button.configure(state="normal")
+        self.scheduler.record_failure()
+        self.schedule_update()
+        
+        # Ошибка - в строку состояния, а не в модальное окно: при недоступном
+        # провайдере автообновление не должно плодить диалоги. Показанные
+        # данные остаются на месте
+        import requests
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None \
+                and error.response.status_code == 404:
+            message = "Город не найден"
+        elif isinstance(error, (requests.exceptions.RequestException, gateway_client.GatewayError)):
+            message = "Нет связи с сервером погоды"
+        elif isinstance(error, (quota.QuotaExceeded, circuit_breaker.CircuitOpen)):
+            message = str(error)
+        elif isinstance(error, KeyError):
+            message = "Город не найден"
+        else:
+            print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+            message = f"Ошибка: {str(error)}"
+        self.set_status(f"{message} ({time.strftime('%H:%M')})", ERROR_COLOR)
+        
+    def set_status(self, text, color=STATUS_COLOR):
+        self.ui.configure(self.status_label, text=text, text_color=color)
             
     def save_last_city(self, city):
-        try:
-            with open("last_city.json", "w", encoding="utf-8") as f:
-                json.dump({"city": city}, f)
-        except Exception as e:
-            print(f"Ошибка сохранения города: {str(e)}")
+        self.state_store.set("city", city)
+        
+    def save_observation(self, city, observation):
+        # Последнее наблюдение для мгновенного показа при следующем запуске
+        last = self.state_store.get("last_observation") or {}
+        if last.get("city") != city or last.get("data") != observation.raw:
+            self.state_store.set("last_observation", {
+                "city": city,
+                "provider": observation.provider,
+                "data": observation.raw,
+                "saved_at": time.time(),
+            })
             
     def load_last_city(self):
+        return self.state_store.get("city", "")
+        
+    def record_history(self, city, observation):
         try:
-            with open("last_city.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("city", "")
-        except (FileNotFoundError, json.JSONDecodeError):
-            return ""
+            self.history.append_observation(city, observation.provider, observation.raw)
+            self.draw_sparkline(self.history.temperatures(city, SPARKLINE_PERIOD))
         except Exception as e:
-            print(f"Ошибка загрузки города: {str(e)}")
-            return ""
+            print(f"Ошибка записи истории: {str(e)}")
+            
+    def draw_sparkline(self, values):
+        self.sparkline_values = values
+        canvas = self.sparkline
+        canvas.delete("all")
+        width = canvas.winfo_width()
+        height = SPARKLINE_HEIGHT
+        if len(values) < 2 or width < 10:
+            return
+        # Точек не больше, чем пикселей по ширине
+        step = max(1, len(values) // width)
+        values = values[::step]
+        low, high = min(values), max(values)
+        span = (high - low) or 1
+        pad = 4
+        points = []
+        for i, value in enumerate(values):
+            points.append(pad + i * (width - 2 * pad) / (len(values) - 1))
+            points.append(height - pad - (value - low) / span * (height - 2 * pad))
+        canvas.create_line(*points, fill=SPARKLINE_COLOR, width=2)
+        canvas.create_text(width - pad, pad, text=f"{high:.0f}°", anchor="ne", fill="gray60", font=("Arial", 9))
+        canvas.create_text(width - pad, height - pad, text=f"{low:.0f}°", anchor="se", fill="gray60", font=("Arial", 9))
             
     def auto_update(self):
-        while True:
-            try:
-                if self.city_entry.get():
-                    self.get_weather()
-                time.sleep(300)  # Обновление каждые 5 минут
-            except Exception as e:
-                print(f"Ошибка автообновления: {str(e)}")
-                time.sleep(60)  # При ошибке ждем минуту перед повторной попыткой
+        self.update_job = None
+        try:
+            if self.city_entry.get():
+                # Следующее обновление планируется по результату запроса
+                self.get_weather()
+                return
+        except Exception as e:
+            print(f"Ошибка автообновления: {str(e)}")
+        self.schedule_update()
+        
+    def schedule_update(self):
+        if self.update_job is not None:
+            self.after_cancel(self.update_job)
+            self.update_job = None
+        # Через шлюз обновления приходят сами
+        if self.gateway is not None:
+            return
+        # Свернутое или неактивное окно обновляется реже
+        idle = self.state() == "iconic" or self.focus_displayof() is None
+        self.update_job = self.after(self.scheduler.next_delay_ms(idle=idle), self.auto_update)
+        
+    def on_activate(self, event=None):
+        if self.update_job is not None and self.scheduler.is_overdue():
+            self.after_cancel(self.update_job)
+            self.auto_update()
             
     def start_move(self, event):
-        self.x = event.x
-        self.y = event.y
+        # Смещение указателя относительно угла окна запоминается один раз,
+        # дальше положение считается по экранным координатам события
+        self.drag_offset = (event.x_root - self.winfo_x(), event.y_root - self.winfo_y())
+        self.drag_position = None
         
     def on_move(self, event):
-        deltax = event.x - self.x
-        deltay = event.y - self.y
-        x = self.winfo_x() + deltax
-        y = self.winfo_y() + deltay
-        self.geometry(f"+{x}+{y}")
+        x = event.x_root - self.drag_offset[0]
+        y = event.y_root - self.drag_offset[1]
+        self.drag_position = (x, y)
+        # Мышь может присылать сотни событий в секунду - окно двигается раз за кадр
+        self.ui.call("move", lambda: self.geometry(f"+{x}+{y}"))
+        
+    def end_move(self, event):
+        # Положение сохраняется один раз после перетаскивания, а не на каждое движение
+        if getattr(self, "drag_position", None) is None:
+            return
+        self.ui.flush()
+        self.state_store.set("window_position", list(self.drag_position))
+        self.drag_position = None
         
     def minimize_window(self):
         self.iconify()  # Сворачиваем окно
         
+class CityRow(ctk.CTkFrame):
+    # Строка дашборда: город и его текущая погода
+    def __init__(self, master, city, on_remove, ui, icons):
+        super().__init__(master)
+        self.city = city
+        self.ui = ui
+        self.icons = icons
+        self.icon_key = None
+        self.loaded = False
+        
+        self.city_label = ctk.CTkLabel(self, text=city, width=120, anchor="w", font=("Arial", 14))
+        self.city_label.grid(row=0, column=0, padx=5, sticky="w")
+        
+        self.temp_label = ctk.CTkLabel(self, text="--°C", width=70, font=("Arial", 14))
+        self.temp_label.grid(row=0, column=1, padx=5)
+        
+        self.humidity_label = ctk.CTkLabel(self, text="--%", width=50, font=("Arial", 14))
+        self.humidity_label.grid(row=0, column=2, padx=5)
+        
+        self.icon_label = ctk.CTkLabel(self, text="", width=ROW_ICON_SIZE, height=ROW_ICON_SIZE)
+        self.icon_label.grid(row=0, column=3)
+        
+        self.desc_label = ctk.CTkLabel(self, text="--", anchor="w", font=("Arial", 14))
+        self.desc_label.grid(row=0, column=4, padx=5, sticky="w")
+        
+        self.remove_button = ctk.CTkButton(
+            self,
+            text="×",
+            width=20,
+            command=lambda: on_remove(self.city)
+        )
+        self.remove_button.grid(row=0, column=5, padx=5)
+        self.grid_columnconfigure(4, weight=1)
+        
+    def show_loading(self):
+        # Строка с данными при обновлении не мигает, "Обновление..." - только для новой
+        if not self.loaded:
+            self.ui.configure(self.desc_label, text="Обновление...")
+        
+    def show_weather(self, observation):
+        # Перерисовываются только изменившиеся метки
+        self.loaded = True
+        self.ui.configure(self.temp_label, text=f"{observation.temp:.1f}°C")
+        self.ui.configure(self.humidity_label, text=f"{observation.humidity}%")
+        description = observation.description
+        if observation.stale:
+            # Провайдер недоступен - последние данные с их возрастом
+            age = providers.describe_age(observation)
+            description = f"{description} ({age} назад)" if age else f"{description} (устарело)"
+        self.ui.configure(self.desc_label, text=description)
+        if observation.icon:
+            key = self.icon_key = (observation.provider, observation.icon)
+            image = self.icons.get(observation.provider, observation.icon,
+                                   lambda image: self.show_icon(key, image), ROW_ICON_SIZE)
+            if image is not None:
+                self.show_icon(key, image)
+                
+    def show_icon(self, key, image):
+        if key == self.icon_key and self.winfo_exists():
+            self.ui.configure(self.icon_label, image=image)
+            
+    def show_error(self, message):
+        # Последние показанные значения остаются, меняется только описание
+        if not self.loaded:
+            self.ui.configure(self.temp_label, text="--°C")
+            self.ui.configure(self.humidity_label, text="--%")
+        self.ui.configure(self.desc_label, text=message)
+        
+    def destroy(self):
+        for label in (self.icon_label, self.temp_label, self.humidity_label, self.desc_label):
+            self.ui.forget(label)
+        super().destroy()
+
+class MultiCityWidget(ctk.CTk):
+    def __init__(self):
+        try:
+            super().__init__()
+            
+            # Настройка окна
+            self.title("Погода: несколько городов")
+            self.geometry("520x600")
+            
+            # API конфигурация: провайдеры с заданными ключами (см. providers.py)
+            self.providers = providers.configured_providers()
+            if not self.providers:
+                messagebox.showerror("Ошибка", NO_PROVIDER_MESSAGE)
+                self.destroy()
+                return
+                
+            # Кэш ответов: повторный запрос того же города не уходит в сеть
+            self.cache = weather_cache.WeatherCache(
+                ttl=int(os.getenv("WEATHER_CACHE_TTL", weather_cache.DEFAULT_TTL))
+            )
+            
+            # Все города обновляются параллельно, но не больше заданного числа
+            # одновременных запросов (по умолчанию - размер пула соединений)
+            workers = int(os.getenv("WEATHER_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+            self.fetcher = fetch_worker.FetchWorker(self, workers=workers)
+            
+            # Локальный шлюз погоды, если запущен, сам присылает обновления городов
+            self.gateway = gateway_client.connect(
+                self, self.on_gateway_observation, self.on_gateway_error, self.on_gateway_lost
+            )
+            
+            # Основной провайдер, при медленном ответе или ошибке - запасной
+            self.client = providers.HedgedClient(self.providers, cache=self.cache, max_workers=2 * workers)
+            
+            # Планировщик автообновления: разброс, пауза после ошибок, реже в фоне
+            self.scheduler = refresh_scheduler.RefreshScheduler(self.providers[0].name)
+            self.update_job = None
+            self.round_id = 0
+            self.round_pending = 0
+            self.round_ok = False
+            
+            self.state_store = state_store.StateStore()
+            self.history = history_store.HistoryStore()
+            self.ui = ui_scheduler.UiScheduler(self)
+            self.icons = icon_cache.IconCache(self)
+            self.rows = {}
+            self.cities = self.load_cities()
+            
+            # Создание интерфейса
+            self.create_widgets()
+            
+            # Первое обновление - сразу после отрисовки окна, следующие - по планировщику
+            self.after_idle(self.auto_update)
+            self.bind('<Map>', self.on_activate, add="+")
+            self.bind('<FocusIn>', self.on_activate, add="+")
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка инициализации", f"Произошла ошибка: {str(e)}\n\n{traceback.format_exc()}")
+            self.destroy()
+            
+    def create_widgets(self):
+        # Поле добавления города
+        self.city_frame = ctk.CTkFrame(self)
+        self.city_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.city_entry = ctk.CTkEntry(
+            self.city_frame,
+            placeholder_text="Введите город",
+            width=250
+        )
+        self.city_entry.pack(side=tk.LEFT, padx=5)
+        self.city_entry.bind('<Return>', lambda event: self.add_city())
+        
+        # Подсказки из индекса городов - после первой отрисовки, как в WeatherWidget
+        self.after(AUTOCOMPLETE_DELAY, self.attach_autocomplete)
+        
+        self.add_button = ctk.CTkButton(
+            self.city_frame,
+            text="Добавить",
+            width=80,
+            command=self.add_city
+        )
+        self.add_button.pack(side=tk.LEFT, padx=5)
+        
+        self.refresh_button = ctk.CTkButton(
+            self.city_frame,
+            text="Обновить",
+            width=80,
+            command=self.auto_update
+        )
+        self.refresh_button.pack(side=tk.LEFT, padx=5)
+        
+        # Список городов
+        self.rows_frame = ctk.CTkScrollableFrame(self)
+        self.rows_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        for city in self.cities:
+            self.add_row(city)
+            
+        self.after(ICON_PREFETCH_DELAY, lambda: self.icons.prefetch(self.providers[0].name, ROW_ICON_SIZE))
+            
+    def attach_autocomplete(self):
+        # Индекс открывается в фоновом потоке, подсказки подключаются в потоке Tk
+        self.fetcher.submit(load_city_index, self.on_city_index, on_city_index_error)
+            
+    def on_city_index(self, index):
+        if index is not None:
+            self.autocomplete = autocomplete.CityAutocomplete(self.city_entry, index, on_select=self.add_city)
+            
+    def add_row(self, city):
+        row = CityRow(self.rows_frame, city, self.remove_city, self.ui, self.icons)
+        row.pack(fill=tk.X, pady=2)
+        self.rows[weather_cache.normalize_city(city)] = row
+        return row
+        
+    def add_city(self):
+        city = self.city_entry.get().strip()
+        if not city:
+            messagebox.showwarning("Предупреждение", "Пожалуйста, введите название города")
+            return
+        if weather_cache.normalize_city(city) in self.rows:
+            return
+            
+        self.city_entry.delete(0, tk.END)
+        self.cities.append(city)
+        self.save_cities()
+        self.refresh_city(self.add_row(city))
+        
+    def remove_city(self, city):
+        row = self.rows.pop(weather_cache.normalize_city(city), None)
+        if row is not None:
+            row.destroy()
+        self.cities = [c for c in self.cities if weather_cache.normalize_city(c) != weather_cache.normalize_city(city)]
+        self.save_cities()
+        if self.gateway is not None:
+            self.gateway.watch(self.cities)
+        
+    def refresh_city(self, row, round_id=None):
+        city = row.city
+        row.show_loading()
+        if self.gateway is not None:
+            self.gateway.watch(self.cities)
+            return
+        self.fetcher.submit(
+            lambda: self.client.fetch(city),
+            lambda observation: self.show_result(row, observation, round_id),
+            lambda error: self.show_row_error(row, error, round_id)
+        )
+        
+    def refresh_all(self):
+        # Строки обновляются по мере прихода ответов, а не после всех запросов
+        rows = list(self.rows.values())
+        if self.gateway is not None:
+            # Шлюз сразу присылает последние наблюдения, дальше - по мере обновления
+            for row in rows:
+                row.show_loading()
+            self.gateway.watch(self.cities)
+            return
+        self.round_id += 1
+        self.round_pending = len(rows)
+        self.round_ok = False
+        for row in rows:
+            self.refresh_city(row, self.round_id)
+        if not rows:
+            self.schedule_update()
+            
+    def finish_round_row(self, round_id, ok):
+        # Ответы предыдущих раундов (после ручного "Обновить") не учитываем
+        if round_id != self.round_id:
+            return
+        self.round_ok = self.round_ok or ok
+        self.round_pending -= 1
+        if self.round_pending > 0:
+            return
+        # Пауза увеличивается, только если не ответил ни один город
+        if self.round_ok:
+            self.scheduler.record_success()
+        else:
+            self.scheduler.record_failure()
+        self.schedule_update()
+        
+    def show_result(self, row, observation, round_id=None):
+        if round_id is not None:
+            # Устаревшие данные вместо ответа - для планировщика это сбой
+            self.finish_round_row(round_id, not observation.stale)
+        try:
+            self.history.append_observation(row.city, observation.provider, observation.raw)
+        except Exception as e:
+            print(f"Ошибка записи истории: {str(e)}")
+        if row.winfo_exists():
+            row.show_weather(observation)
+            
+    def on_gateway_observation(self, city, observation):
+        row = self.rows.get(weather_cache.normalize_city(city))
+        if row is not None:
+            self.show_result(row, observation)
+            
+    def on_gateway_error(self, city, error):
+        row = self.rows.get(weather_cache.normalize_city(city))
+        if row is not None:
+            self.show_row_error(row, error)
+            
+    def on_gateway_lost(self):
+        print("Шлюз погоды недоступен, переход на прямые запросы")
+        self.gateway = None
+        self.auto_update()
+            
+    def show_row_error(self, row, error, round_id=None):
+        if round_id is not None:
+            self.finish_round_row(round_id, False)
+        if not row.winfo_exists():
+            return
+        import requests
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None \
+                and error.response.status_code == 404:
+            row.show_error("Город не найден")
+        elif isinstance(error, (requests.exceptions.RequestException, gateway_client.GatewayError)):
+            row.show_error("Нет связи с сервером")
+        elif isinstance(error, quota.QuotaExceeded):
+            row.show_error("Лимит запросов исчерпан")
+        elif isinstance(error, circuit_breaker.CircuitOpen):
+            row.show_error("Провайдер недоступен")
+        elif isinstance(error, KeyError):
+            row.show_error("Город не найден")
+        else:
+            row.show_error(f"Ошибка: {str(error)}")
+            
+    def save_cities(self):
+        self.state_store.set("cities", self.cities)
+            
+    def load_cities(self):
+        return list(self.state_store.get("cities", []))
+            
+    def auto_update(self):
+        if self.update_job is not None:
+            self.after_cancel(self.update_job)
+            self.update_job = None
+        try:
+            # Следующее обновление планируется, когда ответят все города
+            self.refresh_all()
+        except Exception as e:
+            print(f"Ошибка автообновления: {str(e)}")
+            self.schedule_update()
+            
+    def schedule_update(self):
+        if self.update_job is not None:
+            self.after_cancel(self.update_job)
+            self.update_job = None
+        # Через шлюз обновления приходят сами
+        if self.gateway is not None:
+            return
+        idle = self.state() == "iconic" or self.focus_displayof() is None
+        self.update_job = self.after(self.scheduler.next_delay_ms(idle=idle), self.auto_update)
+        
+    def on_activate(self, event=None):
+        if self.update_job is not None and self.scheduler.is_overdue():
+            self.after_cancel(self.update_job)
+            self.auto_update()
+        
 if __name__ == "__main__":
     try:
         # Устанавливаем тему
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
         
-        app = WeatherWidget()
+        # python weather_app.py --multi - дашборд на несколько городов
+        if "--multi" in sys.argv:
+            app = MultiCityWidget()
+        else:
+            app = WeatherWidget()
         app.mainloop()
     except Exception as e:
         print(f"Критическая ошибка: {str(e)}")
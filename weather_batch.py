@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import requests
+
+import metrics
+import weather_client
+
+# Пакетный режим без графического интерфейса:
+#   python weather_batch.py cities.txt > weather.jsonl
+#   cat cities.txt | python weather_batch.py --provider weatherapi
+# На каждый город в stdout выводится одна строка JSON сразу после получения ответа.
+
+API_KEY_VARIABLES = {
+    "openweather": "OPENWEATHER_API_KEY",
+    "weatherapi": "WEATHERAPI_KEY",
+}
+
+# Как часто выводить прогресс в stderr (секунды)
+PROGRESS_INTERVAL = 2.0
+# Сколько ждать свободного токена лимита API (секунды)
+QUOTA_MAX_WAIT = 120
+
+
+def load_api_key(provider):
+    variable = API_KEY_VARIABLES[provider]
+    api_key = os.getenv(variable)
+    if not api_key:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+            metrics.configure()
+            api_key = os.getenv(variable)
+        except ImportError:
+            pass
+    if not api_key or api_key == "your_api_key_here":
+        return None
+    return api_key
+
+
+def read_cities(stream):
+    # Читаем построчно, не загружая весь файл в память
+    for line in stream:
+        city = line.strip()
+        if city and not city.startswith("#"):
+            yield city
+
+
+def fetch_city(provider, city, api_key, units, lang):
+    started = time.perf_counter()
+    try:
+        # При исчерпанном поминутном лимите запрос откладывается, а не теряется
+        data = weather_client.fetch_weather(provider, city, api_key, units=units, lang=lang, max_wait=QUOTA_MAX_WAIT)
+        record = {"city": city, "ok": True, "data": data}
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        record = {"city": city, "ok": False, "error": str(e), "status": status}
+    except Exception as e:
+        record = {"city": city, "ok": False, "error": str(e)}
+    record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+class Progress:
+    def __init__(self, stream, interval=PROGRESS_INTERVAL):
+        self.stream = stream
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.done = 0
+        self.errors = 0
+
+    def update(self, record, force=False):
+        self.done += 1
+        if not record["ok"]:
+            self.errors += 1
+        now = time.perf_counter()
+        if force or now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now=None):
+        now = now or time.perf_counter()
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Обработано: {self.done}, ошибок: {self.errors}, "
+            f"{rate:.1f} городов/с, прошло {elapsed:.1f} с",
+            file=self.stream,
+            flush=True
+        )
+
+
+def run(cities, provider, api_key, workers, units="metric", lang="ru", out=sys.stdout, err=sys.stderr):
+    progress = Progress(err)
+    write_lock = threading.Lock()
+
+    def emit(record):
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            progress.update(record)
+
+    # В работе держим не больше 2 * workers задач: входной поток читается
+    # по мере освобождения мест, поэтому память не растет с размером входа
+    max_pending = workers * 2
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for city in cities:
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    emit(future.result())
+            pending.add(executor.submit(fetch_city, provider, city, api_key, units, lang))
+        for future in as_completed(pending):
+            emit(future.result())
+
+    progress.report()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетное получение погоды в формате JSONL")
+    parser.add_argument("input", nargs="?", help="файл со списком городов (по одному в строке), по умолчанию stdin")
+    parser.add_argument("--provider", choices=sorted(API_KEY_VARIABLES), default="openweather")
+    parser.add_argument("--workers", type=int, default=weather_client.POOL_MAXSIZE, help="число одновременных запросов")
+    parser.add_argument("--units", default="metric")
+    parser.add_argument("--lang", default="ru")
+    args = parser.parse_args(argv)
+
+    api_key = load_api_key(args.provider)
+    if api_key is None:
+        print(f"Ошибка: установите {API_KEY_VARIABLES[args.provider]} в окружении или в файле .env", file=sys.stderr)
+        return 2
+
+    # Названия городов в выводе - в UTF-8 независимо от кодировки консоли
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8")
+
+    # Пул соединений должен вмещать все рабочие потоки
+    weather_client.POOL_MAXSIZE = max(weather_client.POOL_MAXSIZE, args.workers)
+
+    if args.input and args.input != "-":
+        with open(args.input, "r", encoding="utf-8") as f:
+            progress = run(read_cities(f), args.provider, api_key, args.workers, args.units, args.lang)
+    else:
+        progress = run(read_cities(sys.stdin), args.provider, api_key, args.workers, args.units, args.lang)
+    return 1 if progress.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
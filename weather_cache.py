@@ -0,0 +1,225 @@
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import spatial_cache
+import state_store
+
+# Время жизни записи по умолчанию: провайдеры обновляют текущую погоду
+# примерно раз в 10 минут, чаще запрашивать один и тот же город смысла нет
+DEFAULT_TTL = 600
+DEFAULT_MAX_ENTRIES = 128
+# Файл кэша по умолчанию - в каталоге настроек пользователя, рядом с state.json
+DEFAULT_CACHE_FILE = "weather_cache.json"
+# Ответы, пришедшие за это время, записываются на диск одним файлом (секунды)
+WRITE_DELAY = 1.0
+# Устаревшие записи хранятся еще столько секунд и отдаются (с пометкой
+# stale), когда провайдер недоступен или лимит запросов к API исчерпан
+DEFAULT_MAX_STALE = 6 * 60 * 60
+
+
+def normalize_city(city):
+    # "  Санкт-петербург " и "санкт-Петербург" должны давать один ключ
+    return " ".join(city.split()).casefold().replace("ё", "е")
+
+
+def normalize_location(city):
+    # Координаты - по ячейке сетки ("@55.7600,37.6200"), названия - как есть
+    point = spatial_cache.parse_point(city)
+    if point is not None:
+        return "@" + spatial_cache.format_point(spatial_cache.snap(point))
+    return normalize_city(city)
+
+
+def make_key(provider, city):
+    return f"{provider}:{normalize_location(city)}"
+
+
+def key_point(key):
+    # Point ячейки для ключа запроса по координатам, иначе None
+    location = key.split(":", 1)[-1]
+    if not location.startswith("@"):
+        return None
+    return spatial_cache.parse_point(location[1:])
+
+
+class WeatherCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, path=DEFAULT_CACHE_FILE,
+                 max_stale=DEFAULT_MAX_STALE, nearby_km=None, delay=WRITE_DELAY):
+        # path=None - только память
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.path = state_store.config_path(path) if path == DEFAULT_CACHE_FILE else path
+        self.delay = delay
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.nearby_hits = 0
+        # ключ -> (время получения, данные); порядок = порядок использования
+        self._entries = OrderedDict()
+        # Записи, запрошенные по координатам (см. spatial_cache.py)
+        self._nearby = spatial_cache.NearbyIndex(nearby_km)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Как в StateStore: put() только помечает кэш измененным, файл
+        # перезаписывает фоновый поток - один раз за пачку ответов
+        self._dirty = False
+        self._changed = threading.Event()
+        self._load()
+        if self.path:
+            threading.Thread(target=self._run, name="cache-writer", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _is_fresh(self, stored_at, now):
+        return now - stored_at < self.ttl
+
+    def get(self, provider, city):
+        key = make_key(provider, city)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry[0], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if metrics.enabled:
+                    metrics.inc("weather_cache_requests_total", result="hit")
+                return entry[1]
+            # Своей ячейки нет - свежее наблюдение по соседней точке
+            entry = self._find_nearby(provider, city, lambda stored_at: self._is_fresh(stored_at, now))
+            if entry is not None:
+                self.hits += 1
+                self.nearby_hits += 1
+                if metrics.enabled:
+                    metrics.inc("weather_cache_requests_total", result="nearby")
+                return entry[1]
+            self.misses += 1
+            if metrics.enabled:
+                metrics.inc("weather_cache_requests_total", result="miss")
+            return None
+
+    def get_stale(self, provider, city):
+        # Последние известные данные независимо от TTL (но не старше max_stale)
+        key = make_key(provider, city)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self.max_stale:
+                entry = self._find_nearby(provider, city, lambda stored_at: now - stored_at < self.max_stale)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            if metrics.enabled:
+                metrics.inc("weather_cache_requests_total", result="stale")
+            return entry[1]
+
+    def put(self, provider, city, data):
+        key = make_key(provider, city)
+        with self._lock:
+            self._entries[key] = (time.time(), data)
+            self._entries.move_to_end(key)
+            self._index(key)
+            while len(self._entries) > self.max_entries:
+                self._nearby.remove(self._entries.popitem(last=False)[0])
+            self._dirty = True
+        self._changed.set()
+
+    def get_or_fetch(self, provider, city, fetch):
+        # Ошибки (в том числе исчерпанный лимит) не скрываются: устаревшие
+        # данные с пометкой stale отдает вызывающий (HedgedClient)
+        data = self.get(provider, city)
+        if data is None:
+            data = fetch()
+            self.put(provider, city, data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nearby.clear()
+            self._dirty = True
+        self._changed.set()
+
+    def flush(self):
+        # Синхронная запись несохраненных изменений (при выходе)
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = [[key, stored_at, data] for key, (stored_at, data) in self._entries.items()]
+                self._dirty = False
+            try:
+                state_store.atomic_write_json(self.path, {"entries": entries})
+            except Exception as e:
+                print(f"Ошибка сохранения кэша погоды: {str(e)}")
+                with self._lock:
+                    self._dirty = True
+                return
+            with self._lock:
+                self.writes += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "nearby_hits": self.nearby_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        except Exception as e:
+            print(f"Ошибка загрузки кэша погоды: {str(e)}")
+            return
+
+        # Поднимаем с диска записи не старше max_stale: свежие отдаются как
+        # обычно, устаревшие - только при недоступном провайдере или лимите
+        now = time.time()
+        for key, stored_at, data in stored.get("entries", []):
+            if now - stored_at < self.max_stale:
+                self._entries[key] = (stored_at, data)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        for key in self._entries:
+            self._index(key)
+
+    def _index(self, key):
+        point = key_point(key)
+        if point is not None:
+            self._nearby.add(key, key.split(":", 1)[0], point)
+
+    def _find_nearby(self, provider, city, usable):
+        # Ближайшая запись того же провайдера в радиусе, время получения
+        # которой подходит (usable); вызывается под self._lock
+        point = spatial_cache.parse_point(city)
+        if point is None or not len(self._nearby):
+            return None
+        found = self._nearby.nearest(provider, point, lambda key: usable(self._entries[key][0]))
+        if found is None:
+            return None
+        self._entries.move_to_end(found[0])
+        return self._entries[found[0]]
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            # Короткая пауза собирает ответы целого обновления в одну запись
+            time.sleep(self.delay)
+            self._changed.clear()
+            self.flush()
@@ -0,0 +1,472 @@
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import bulk_fetch
+import circuit_breaker
+import city_index
+import metrics
+import quota
+import spatial_cache
+from single_flight import SingleFlight
+from weather_cache import normalize_location
+
+# Адреса API провайдеров погоды (только HTTPS). Переменные окружения
+# OPENWEATHER_URL / WEATHERAPI_URL позволяют направить запросы на
+# локальную заглушку stub_server.py
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+WEATHERAPI_URL = "https://api.weatherapi.com/v1/current.json"
+# Прогноз: OpenWeather - 5 дней с шагом 3 часа, WeatherAPI.com - по часам
+# (OPENWEATHER_FORECAST_URL / WEATHERAPI_FORECAST_URL - для заглушки)
+OPENWEATHER_FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+WEATHERAPI_FORECAST_URL = "https://api.weatherapi.com/v1/forecast.json"
+FORECAST_DAYS = 5
+
+# Таймауты в секундах: (подключение, чтение)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Пакетные запросы: провайдеры, для которых они включены (WEATHER_BULK_PROVIDERS,
+# через запятую; пакетные запросы WeatherAPI.com доступны не на всех тарифах),
+# и окно сбора городов в миллисекундах (WEATHER_BULK_WINDOW)
+BULK_PROVIDERS = "openweather"
+BULK_WINDOW_MS = 30
+
+# Размер пула соединений на один хост
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+# Одинаковые запросы, пришедшие одновременно, разделяют один HTTP-вызов
+_flights = SingleFlight()
+
+# Общий для всех процессов учет лимитов API (см. quota.py)
+_quota = None
+_quota_lock = threading.Lock()
+_quota_warned = False
+
+# Сборщики пакетных запросов: (провайдер, ключ, единицы, язык) -> BulkBatcher
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+# Локальный индекс городов (см. city_index.py), открывается при первом запросе
+_city_index = None
+_city_index_checked = False
+_city_index_lock = threading.Lock()
+
+
+def get_session():
+    # Одна долгоживущая сессия на процесс: keep-alive и пул соединений
+    # избавляют от DNS-запроса и TCP/TLS-рукопожатия при каждом обновлении
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE
+                )
+                if metrics.enabled:
+                    metrics.instrument_adapter(adapter)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Accept": "application/json",
+                    "Accept-Encoding": "gzip, deflate",
+                    "Connection": "keep-alive",
+                })
+                _session = session
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def openweather_location(city):
+    # Город из индекса запрашиваем по ID или координатам, точку - по
+    # координатам, остальное - по названию
+    if isinstance(city, city_index.CityRecord) and city.owm_id:
+        return {"id": city.id}
+    if isinstance(city, (city_index.CityRecord, spatial_cache.Point)):
+        return {"lat": f"{city.lat:.4f}", "lon": f"{city.lon:.4f}"}
+    return {"q": city}
+
+
+def weatherapi_location(city):
+    if isinstance(city, (city_index.CityRecord, spatial_cache.Point)):
+        return {"q": f"{city.lat:.4f},{city.lon:.4f}"}
+    return {"q": city}
+
+
+def build_openweather_url(city, api_key, units="metric", lang="ru"):
+    query = urllib.parse.urlencode({
+        **openweather_location(city),
+        "appid": api_key,
+        "units": units,
+        "lang": lang,
+    })
+    return f"{os.getenv('OPENWEATHER_URL', OPENWEATHER_URL)}?{query}"
+
+
+def build_weatherapi_url(city, api_key, units="metric", lang="ru"):
+    # WeatherAPI.com всегда возвращает и temp_c, и temp_f, параметр units не нужен
+    query = urllib.parse.urlencode({
+        "key": api_key,
+        **weatherapi_location(city),
+        "lang": lang,
+    })
+    return f"{os.getenv('WEATHERAPI_URL', WEATHERAPI_URL)}?{query}"
+
+
+URL_BUILDERS = {
+    "openweather": build_openweather_url,
+    "weatherapi": build_weatherapi_url,
+}
+
+
+def build_url(provider, city, api_key, units="metric", lang="ru"):
+    try:
+        builder = URL_BUILDERS[provider]
+    except KeyError:
+        raise ValueError(f"Неизвестный провайдер погоды: {provider}")
+    return builder(city, api_key, units=units, lang=lang)
+
+
+def _redact_error(error):
+    # В текст ошибок requests попадает адрес запроса вместе с ключом API,
+    # а этот текст показывается в окне и печатается в журнал
+    error.args = tuple(metrics.redact(str(arg)) for arg in error.args)
+
+
+def request_json(method, url, timeout=TIMEOUT, **kwargs):
+    if not metrics.enabled:
+        try:
+            response = get_session().request(method, url, timeout=timeout, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            _redact_error(e)
+            raise
+
+    # С метриками: этапы запроса (DNS, подключение, TLS, первый байт, разбор JSON)
+    trace = metrics.RequestTrace(method, url)
+    status = "error"
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        status = str(response.status_code)
+        # response.elapsed включает и установку соединения: для нового
+        # соединения вычитаем уже замеренные DNS, подключение и TLS
+        setup = sum(trace.phases.get(name, 0.0) for name in ("dns", "connect", "tls"))
+        trace.phase("ttfb", max(0.0, response.elapsed.total_seconds() - setup))
+        response.raise_for_status()
+        started = time.perf_counter()
+        data = response.json()
+        trace.phase("parse", time.perf_counter() - started)
+        return data
+    except Exception as e:
+        if status == "error":
+            status = metrics.error_type(e)
+        if isinstance(e, requests.exceptions.RequestException):
+            _redact_error(e)
+        raise
+    finally:
+        trace.finish(status)
+
+
+def fetch_json(url, timeout=TIMEOUT):
+    return request_json("GET", url, timeout=timeout)
+
+
+def post_json(url, payload, timeout=TIMEOUT):
+    return request_json("POST", url, timeout=timeout, json=payload)
+
+
+def build_openweather_forecast_url(city, api_key, units="metric", lang="ru"):
+    query = urllib.parse.urlencode({
+        **openweather_location(city),
+        "appid": api_key,
+        "units": units,
+        "lang": lang,
+    })
+    return f"{os.getenv('OPENWEATHER_FORECAST_URL', OPENWEATHER_FORECAST_URL)}?{query}"
+
+
+def build_weatherapi_forecast_url(city, api_key, units="metric", lang="ru"):
+    query = urllib.parse.urlencode({
+        "key": api_key,
+        **weatherapi_location(city),
+        "days": FORECAST_DAYS,
+        "aqi": "no",
+        "alerts": "no",
+        "lang": lang,
+    })
+    return f"{os.getenv('WEATHERAPI_FORECAST_URL', WEATHERAPI_FORECAST_URL)}?{query}"
+
+
+FORECAST_URL_BUILDERS = {
+    "openweather": build_openweather_forecast_url,
+    "weatherapi": build_weatherapi_forecast_url,
+}
+
+
+def build_openweather_group_url(city_ids, api_key, units="metric", lang="ru"):
+    # Текущая погода для нескольких городов по ID: /data/2.5/group?id=1,2,3
+    base = os.getenv("OPENWEATHER_URL", OPENWEATHER_URL).rsplit("/", 1)[0]
+    query = urllib.parse.urlencode({
+        "id": ",".join(str(city_id) for city_id in city_ids),
+        "appid": api_key,
+        "units": units,
+        "lang": lang,
+    })
+    return f"{base}/group?{query}"
+
+
+def build_weatherapi_bulk_url(api_key, lang="ru"):
+    # Список мест передается телом POST-запроса
+    query = urllib.parse.urlencode({"key": api_key, "q": "bulk", "lang": lang})
+    return f"{os.getenv('WEATHERAPI_URL', WEATHERAPI_URL)}?{query}"
+
+
+def bulk_key(provider, location):
+    # Ключ города внутри пакета или None, если город нельзя запросить пакетом
+    providers = os.getenv("WEATHER_BULK_PROVIDERS", BULK_PROVIDERS)
+    if provider not in [name.strip() for name in providers.split(",")]:
+        return None
+    if provider == "openweather":
+        # Группой OpenWeather отдает только города, заданные ID
+        if isinstance(location, city_index.CityRecord) and location.owm_id:
+            return location.id
+        return None
+    if provider == "weatherapi":
+        return weatherapi_location(location)["q"]
+    return None
+
+
+def record_outcome(provider, request):
+    # Исход одного HTTP-запроса - в автомат отключения провайдера. Вызывается
+    # там, где запрос действительно отправляется (ведущий single-flight,
+    # отправка пакета), поэтому один сбой не засчитывается каждому ожидающему
+    breaker = circuit_breaker.get(provider)
+    try:
+        result = request()
+    except Exception as e:
+        breaker.record(e)
+        raise
+    breaker.record_success()
+    return result
+
+
+def send_openweather_group(api_key, units, lang, items):
+    acquire_quota("openweather", api_key, max(items.values()))
+    data = record_outcome("openweather", lambda: fetch_json(
+        build_openweather_group_url(list(items), api_key, units=units, lang=lang)
+    ))
+    result = {entry["id"]: entry for entry in data.get("list", [])}
+    for city_id in items:
+        if city_id not in result:
+            result[city_id] = city_index.CityNotFound(f"Город не найден: id={city_id}")
+    return result
+
+
+def send_weatherapi_bulk(api_key, units, lang, items):
+    acquire_quota("weatherapi", api_key, max(items.values()))
+    queries = list(items)
+    payload = {"locations": [{"q": q, "custom_id": str(i)} for i, q in enumerate(queries)]}
+    data = record_outcome("weatherapi", lambda: post_json(build_weatherapi_bulk_url(api_key, lang=lang), payload))
+    result = {}
+    for entry in data.get("bulk", []):
+        answer = entry.get("query", {})
+        try:
+            q = queries[int(answer.get("custom_id"))]
+        except (TypeError, ValueError, IndexError):
+            continue
+        if "error" in answer:
+            result[q] = city_index.CityNotFound(answer["error"].get("message", f"Город не найден: {q}"))
+        else:
+            result[q] = {"location": answer.get("location"), "current": answer.get("current")}
+    return result
+
+
+BULK_SENDERS = {
+    "openweather": send_openweather_group,
+    "weatherapi": send_weatherapi_bulk,
+}
+
+
+def get_batcher(provider, api_key, units="metric", lang="ru"):
+    key = (provider, api_key, units, lang)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(key)
+            if batcher is None:
+                send = BULK_SENDERS[provider]
+                batcher = bulk_fetch.BulkBatcher(
+                    lambda items: send(api_key, units, lang, items),
+                    bulk_fetch.MAX_BATCH[provider],
+                    window=int(os.getenv("WEATHER_BULK_WINDOW", BULK_WINDOW_MS)) / 1000
+                )
+                _batchers[key] = batcher
+    return batcher
+
+
+def bulk_stats():
+    with _batchers_lock:
+        batchers = list(_batchers.values())
+    stats = {"batches": 0, "items": 0}
+    for batcher in batchers:
+        for name, value in batcher.stats().items():
+            if name in stats:
+                stats[name] += value
+    return stats
+
+
+def get_quota():
+    # WEATHER_QUOTA_DISABLED=1 отключает учет (например, для заглушки)
+    global _quota
+    if _quota is None and not os.getenv("WEATHER_QUOTA_DISABLED"):
+        with _quota_lock:
+            if _quota is None:
+                _quota = quota.QuotaManager()
+    return _quota
+
+
+def set_quota(manager):
+    global _quota
+    with _quota_lock:
+        _quota = manager
+
+
+def acquire_quota(provider, api_key, max_wait=0):
+    # Запрос без свободного токена откладывается не дольше max_wait секунд,
+    # после чего выбрасывается QuotaExceeded
+    manager = get_quota()
+    if manager is None:
+        return
+    wait = _try_acquire(manager, provider, api_key)
+    while 0 < wait <= max_wait:
+        if metrics.enabled:
+            metrics.inc("weather_retries_total", reason="quota_wait")
+        time.sleep(wait)
+        max_wait -= wait
+        wait = _try_acquire(manager, provider, api_key)
+    if wait > 0:
+        raise quota.QuotaExceeded(wait)
+
+
+def _try_acquire(manager, provider, api_key):
+    # Файл учета недоступен (права, диск) - учет пропускается: это не повод
+    # отказывать в запросе и тем более не сбой провайдера
+    global _quota_warned
+    try:
+        return manager.try_acquire(provider, api_key)
+    except OSError as e:
+        if not _quota_warned:
+            _quota_warned = True
+            print(f"Учет лимита запросов недоступен: {str(e)}")
+        return 0.0
+
+
+def get_city_index():
+    global _city_index, _city_index_checked
+    if not _city_index_checked:
+        with _city_index_lock:
+            if not _city_index_checked:
+                path = city_index.default_index_path()
+                if os.path.exists(path):
+                    try:
+                        _city_index = city_index.CityIndex(path)
+                    except Exception as e:
+                        print(f"Ошибка загрузки индекса городов: {str(e)}")
+                _city_index_checked = True
+    return _city_index
+
+
+def set_city_index(index):
+    global _city_index, _city_index_checked
+    with _city_index_lock:
+        _city_index = index
+        _city_index_checked = True
+
+
+def resolve_city(city):
+    # Без индекса название уходит провайдеру как есть. С индексом неизвестное
+    # название отклоняется сразу, без сетевого запроса
+    # (WEATHER_CITY_INDEX_STRICT=0 - отправлять такие названия провайдеру).
+    # Координаты запрашиваются по центру ячейки сетки, как и ключ кэша
+    point = spatial_cache.parse_point(city)
+    if point is not None:
+        return spatial_cache.snap(point)
+    index = get_city_index()
+    if index is None:
+        return city
+    record = index.resolve(city)
+    if record is None:
+        if os.getenv("WEATHER_CITY_INDEX_STRICT", "1") != "0":
+            raise city_index.CityNotFound(f"Город не найден: {city}")
+        return city
+    return record
+
+
+def fetch_weather(provider, city, api_key, units="metric", lang="ru", max_wait=0):
+    if not metrics.enabled:
+        return _fetch_weather(provider, city, api_key, units, lang, max_wait)
+    try:
+        return _fetch_weather(provider, city, api_key, units, lang, max_wait)
+    except Exception as e:
+        metrics.inc("weather_errors_total", provider=provider, type=metrics.error_type(e))
+        raise
+
+
+def _fetch_weather(provider, city, api_key, units, lang, max_wait):
+    key = (provider, normalize_location(city), units, lang)
+    location = resolve_city(city)
+
+    def fetch():
+        # Города, которые провайдер умеет отдавать пакетом, ждут попутчиков
+        # в течение короткого окна и уходят одним запросом (и одним токеном лимита)
+        item_key = bulk_key(provider, location)
+        if item_key is not None:
+            return get_batcher(provider, api_key, units, lang).fetch(item_key, max_wait)
+        acquire_quota(provider, api_key, max_wait)
+        return record_outcome(provider, lambda: fetch_json(build_url(provider, location, api_key, units=units, lang=lang)))
+
+    return _flights.do(key, fetch)
+
+
+def flight_stats():
+    return _flights.stats()
+
+
+def fetch_forecast(provider, city, api_key, units="metric", lang="ru", max_wait=0):
+    # Прогноз не собирается в пакеты: у провайдеров нет пакетного запроса прогноза
+    try:
+        builder = FORECAST_URL_BUILDERS[provider]
+    except KeyError:
+        raise ValueError(f"Неизвестный провайдер погоды: {provider}")
+    key = ("forecast", provider, normalize_location(city), units, lang)
+    location = resolve_city(city)
+
+    def fetch():
+        acquire_quota(provider, api_key, max_wait)
+        return fetch_json(builder(location, api_key, units=units, lang=lang))
+
+    try:
+        return _flights.do(key, fetch)
+    except Exception as e:
+        if metrics.enabled:
+            metrics.inc("weather_errors_total", provider=provider, type=metrics.error_type(e))
+        raise
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import city_index
+import gateway_client
+import metrics
+import providers
+import quota
+import refresh_scheduler
+import weather_cache
+
+# Локальный шлюз погоды: один процесс на машину запрашивает провайдеров,
+# кэширует ответы и планирует обновления, а окна (сколько бы их ни было)
+# подписываются на города и получают новые наблюдения сами, без опроса.
+#   python weather_gateway.py                    # 127.0.0.1:8766
+#   python weather_gateway.py --socket /tmp/weather.sock
+# Протокол - не HTTP, а строки JSON в обе стороны по постоянному соединению,
+# чтобы шлюз присылал обновления сам, без опроса:
+#   -> {"op": "subscribe", "city": "Москва"}   <- {"type": "observation", "city": ..., "provider": ..., "data": {...}}
+#   -> {"op": "unsubscribe", "city": "Москва"} <- {"type": "error", "city": ..., "kind": ..., "error": "..."}
+#   -> {"op": "stats"}                         <- {"type": "stats", ...}
+# Окна, не нашедшие шлюз, запрашивают погоду сами (см. gateway_client.py).
+
+# Сколько ждать медленного подписчика, прежде чем отключить его (секунды)
+SEND_TIMEOUT = 5
+
+
+def error_message(error):
+    # Сообщение об ошибке для окон; ключи API из текста уже убраны
+    if isinstance(error, quota.QuotaExceeded):
+        return {"kind": "quota", "error": str(error), "retry_after": error.retry_after}
+    response = getattr(error, "response", None)
+    if isinstance(error, city_index.CityNotFound) or (response is not None and response.status_code == 404):
+        return {"kind": "not_found", "error": "Город не найден"}
+    return {"kind": "error", "error": str(error)}
+
+
+class CityFeed:
+    # Подписчики одного города, последнее сообщение и задача обновления
+    def __init__(self, city, provider):
+        self.city = city
+        self.subscribers = set()
+        self.message = None
+        self.error = None
+        self.observed = None
+        self.scheduler = refresh_scheduler.RefreshScheduler(provider)
+        self.task = None
+
+
+class Gateway:
+    def __init__(self, client):
+        self.client = client
+        self.feeds = {}
+        self.fetches = 0
+        self.pushes = 0
+        self.started_at = time.time()
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request.get("op")
+                    city = str(request.get("city", "")).strip()
+                except (ValueError, AttributeError):
+                    continue
+                if op == "subscribe" and city:
+                    subscribed.add(self.subscribe(city, writer))
+                elif op == "unsubscribe" and city:
+                    key = weather_cache.normalize_location(city)
+                    subscribed.discard(key)
+                    self.unsubscribe(key, writer)
+                elif op == "stats":
+                    await self.send(writer, {"type": "stats", **self.stats()})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for key in subscribed:
+                self.unsubscribe(key, writer)
+            writer.close()
+
+    def subscribe(self, city, writer):
+        # Координаты в одной ячейке сетки - одна подписка и один запрос
+        key = weather_cache.normalize_location(city)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = CityFeed(city, self.client.primary.name)
+        feed.subscribers.add(writer)
+        # Последнее наблюдение (или ошибка, если его еще нет) - сразу, без запроса к провайдеру
+        latest = feed.message or feed.error
+        if latest is not None:
+            asyncio.create_task(self.send(writer, latest, feed))
+        if feed.task is None:
+            feed.task = asyncio.create_task(self.refresh(feed))
+        return key
+
+    def unsubscribe(self, key, writer):
+        feed = self.feeds.get(key)
+        if feed is None:
+            return
+        feed.subscribers.discard(writer)
+        if not feed.subscribers:
+            # Город больше никому не нужен - перестаем его обновлять
+            if feed.task is not None:
+                feed.task.cancel()
+            del self.feeds[key]
+
+    async def refresh(self, feed):
+        loop = asyncio.get_running_loop()
+        while feed.subscribers:
+            try:
+                self.fetches += 1
+                observation = await loop.run_in_executor(None, self.client.fetch, feed.city)
+            except Exception as e:
+                feed.scheduler.record_failure()
+                # Ошибку получают все, но последнее удачное наблюдение сохраняется
+                feed.error = {"type": "error", "city": feed.city, **error_message(e)}
+                await self.broadcast(feed, feed.error)
+            else:
+                if observation.stale:
+                    feed.scheduler.record_failure()
+                else:
+                    feed.scheduler.record_success(observation.observed_at)
+                feed.error = None
+                # Ответ из кэша с тем же наблюдением подписчикам не рассылается;
+                # stale - провайдер недоступен, это последние сохраненные данные
+                if (observation.raw, observation.stale) != feed.observed:
+                    feed.observed = (observation.raw, observation.stale)
+                    feed.message = {"type": "observation", "city": feed.city, "provider": observation.provider,
+                                    "data": observation.raw, "stale": observation.stale}
+                    await self.broadcast(feed, feed.message)
+            await asyncio.sleep(feed.scheduler.next_delay())
+
+    async def broadcast(self, feed, message):
+        await asyncio.gather(*(self.send(writer, message, feed) for writer in list(feed.subscribers)))
+
+    async def send(self, writer, message, feed=None):
+        try:
+            writer.write(gateway_client.encode(message))
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+            if message.get("type") == "observation":
+                self.pushes += 1
+        except (ConnectionError, asyncio.TimeoutError, RuntimeError):
+            # Подписчик отключился или не успевает читать
+            if feed is not None:
+                self.unsubscribe(weather_cache.normalize_location(feed.city), writer)
+            writer.close()
+
+    def stats(self):
+        return {
+            "cities": len(self.feeds),
+            "subscribers": sum(len(feed.subscribers) for feed in self.feeds.values()),
+            "fetches": self.fetches,
+            "pushes": self.pushes,
+            "uptime": round(time.time() - self.started_at),
+        }
+
+
+def remove_stale_socket(path):
+    # Сокет, оставшийся после прежнего запуска, удаляется; обычный файл или
+    # сокет, на котором уже работает шлюз, - нет
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} существует и не является сокетом")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Шлюз уже запущен: {path}")
+
+
+async def serve(gateway, address):
+    if isinstance(address, str):
+        remove_stale_socket(address)
+        server = await asyncio.start_unix_server(gateway.handle, path=address)
+        print(f"Шлюз погоды: {address}")
+    else:
+        server = await asyncio.start_server(gateway.handle, *address)
+        print(f"Шлюз погоды: {address[0]}:{address[1]}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный шлюз погоды для нескольких окон")
+    parser.add_argument("--port", type=int, help="порт на 127.0.0.1 (по умолчанию WEATHER_GATEWAY_PORT или 8766)")
+    parser.add_argument("--socket", help="Unix-сокет вместо TCP")
+    args = parser.parse_args(argv)
+    if args.socket:
+        os.environ["WEATHER_GATEWAY_SOCKET"] = args.socket
+    elif args.port:
+        os.environ["WEATHER_GATEWAY_PORT"] = str(args.port)
+
+    load_dotenv()
+    metrics.configure()
+    configured = providers.configured_providers()
+    if not configured:
+        print("Не задан ключ API ни одного провайдера")
+        return 1
+    cache = weather_cache.WeatherCache(ttl=int(os.getenv("WEATHER_CACHE_TTL", weather_cache.DEFAULT_TTL)))
+    gateway = Gateway(providers.HedgedClient(configured, cache=cache))
+    try:
+        asyncio.run(serve(gateway, gateway_client.gateway_address()))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Не удалось запустить шлюз: {str(e)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())